@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+Import finder for the archive builds (python 3 only).
+
+The builtin zipimport opens the archive again for every module it loads. ArchiveFinder opens the archive
+once and keeps it open, so one open serves every module of the package, and a process keeps importing
+from the same archive even when the file is replaced. It has no dependency outside the standard library,
+so a launcher can install it before anything else is importable:
+
+    from scm_tools.archive_importer import install_finder
+    install_finder("/builds/my_package.zip")
+    import my_package
+"""
+import os
+import sys
+import marshal
+import zipfile
+import threading
+import importlib.abc
+import importlib.util
+
+# header of a python >= 3.7 pyc: magic, flags, then mtime and size or the source hash
+PYC_HEADER_SIZE = 16
+
+
+class ArchiveLoader(importlib.abc.InspectLoader):
+    """
+    Loader of one module of an ArchiveFinder archive
+    """
+    def __init__(self, finder, member, is_package):
+        super(ArchiveLoader, self).__init__()
+        self.finder = finder
+        self.member = member
+        self._is_package = is_package
+
+    def __repr__(self):
+        return "ArchiveLoader('{0}')".format(self.get_filename())
+
+    def get_filename(self, fullname=None):
+        return os.path.join(self.finder.archive_path, self.member)
+
+    def is_package(self, fullname):
+        return self._is_package
+
+    def get_source(self, fullname):
+        if self.member not in self.finder.members:
+            return None
+        return importlib.util.decode_source(self.finder.read(self.member))
+
+    def get_code(self, fullname):
+        """
+        Load the code from the pyc of the archive, or compile the source when the pyc is missing or is
+        written by another python version. The archive is immutable, so the pyc is never checked against
+        its source.
+        """
+        pyc_member = self.member + "c"
+        if pyc_member in self.finder.members:
+            data = self.finder.read(pyc_member)
+            if data[:4] == importlib.util.MAGIC_NUMBER:
+                return marshal.loads(data[PYC_HEADER_SIZE:])
+
+        return compile(self.finder.read(self.member), self.get_filename(), "exec", dont_inherit=True)
+
+    def get_data(self, path):
+        """
+        Read a data file of the archive, used by pkgutil.get_data()
+        """
+        prefix = self.finder.archive_path + os.sep
+        member = path[len(prefix):].replace(os.sep, "/") if path.startswith(prefix) else path
+        try:
+            return self.finder.read(member)
+        except KeyError:
+            raise IOError("'{0}' is not in the archive".format(path))
+
+
+class ArchiveFinder(importlib.abc.MetaPathFinder):
+    """
+    Meta path finder of the packages in one archive build
+
+    Intended Usages:
+        finder = install_finder("/builds/my_package.zip")
+        finder.close()
+    """
+    def __init__(self, archive_path):
+        super(ArchiveFinder, self).__init__()
+        self.archive_path = os.path.realpath(archive_path)
+        self._lock = threading.Lock()
+        self._archive = zipfile.ZipFile(self.archive_path, "r")
+        self.members = frozenset(self._archive.namelist())
+        self.packages = frozenset(x.split("/", 1)[0] for x in self.members if "/" in x)
+
+    def __repr__(self):
+        return "ArchiveFinder('{0}')".format(self.archive_path)
+
+    def read(self, member):
+        with self._lock:
+            return self._archive.read(member)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname.split(".", 1)[0] not in self.packages:
+            return None
+
+        base = fullname.replace(".", "/")
+        for member, is_package in ((base + "/__init__.py", True), (base + ".py", False)):
+            if member not in self.members and member + "c" not in self.members:
+                continue
+
+            loader = ArchiveLoader(self, member=member, is_package=is_package)
+            return importlib.util.spec_from_file_location(
+                fullname, loader.get_filename(), loader=loader,
+                submodule_search_locations=[os.path.join(self.archive_path, base)] if is_package else None)
+        return None
+
+    def invalidate_caches(self):
+        pass
+
+    def close(self):
+        """
+        Remove the finder from sys.meta_path and close the archive
+        """
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+        with self._lock:
+            self._archive.close()
+
+
+def install_finder(archive_path):
+    """
+    Put an ArchiveFinder of the archive in front of sys.meta_path, so its packages win over any other copy
+    on sys.path. The archive path is resolved, a <pkg>.zip symlink pins the version live at this time.
+
+    :param archive_path:        `str`           archive build path
+    :return:                    `ArchiveFinder` the finder of the archive, an already installed one is reused
+    """
+    real_path = os.path.realpath(archive_path)
+    for finder in sys.meta_path:
+        if isinstance(finder, ArchiveFinder) and finder.archive_path == real_path:
+            return finder
+
+    finder = ArchiveFinder(real_path)
+    sys.meta_path.insert(0, finder)
+    return finder
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+Single file archive builds for the shared storage.
+
+Importing a package from a directory tree costs a few stat/open calls per module, which adds up to
+hundreds of round trips on NFS. The archive build writes the whole package, sources and precompiled
+bytecode, into one zip file. The module lookups are served from its central directory, read once at the
+first import, either by the builtin zipimport (archive path on sys.path) or by the ArchiveFinder of
+archive_importer.py, which also keeps the archive open so one open serves every module.
+
+    PY_BUILDS_DIR/
+        .archives/<pkg>/20240101-120000-1a2b3c4d5e6f.zip
+        .archives/<pkg>/20240101-120000-1a2b3c4d5e6f.json      index: modules, revision, python, size
+        <pkg>.zip -> .archives/<pkg>/20240101-120000-1a2b3c4d5e6f.zip
+
+zipimport reads the archive again by its path for every module, so an archive is never rewritten in
+place. Every build gets its own versioned file and the <pkg>.zip symlink is swapped like a release.
+The processes use the resolved archive path, see add_archive_to_path() and install_finder(), and keep
+using their version until they restart.
+
+Data files are stored in the archive too, but only code reading them through pkgutil.get_data() or
+importlib.resources can see them, not code opening paths relative to __file__.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from . import releases
+from .manifest import InstallSummary, get_file_hash
+from .ignore_matcher import IgnoreMatcher
+from .bytecode import compile_files
+
+logger = get_logger(__name__)
+
+ARCHIVE_EXTENSION = ".zip"
+INDEX_EXTENSION = ".json"
+
+
+def get_archive_path(package_name, install_root=None):
+    """
+    :return:                    `str`           live archive symlink, eg: PY_BUILDS_DIR/<pkg>.zip
+    """
+    return os.path.join(install_root or scm_constants.PY_BUILDS_DIR, package_name + ARCHIVE_EXTENSION)
+
+
+def get_archives_dir(package_name, install_root=None):
+    """
+    :return:                    `str`           PY_BUILDS_DIR/.archives/<pkg>
+    """
+    return os.path.join(install_root or scm_constants.PY_BUILDS_DIR, scm_constants.ARCHIVES_DIR_NAME,
+                        package_name)
+
+
+def get_module_name(rel_path):
+    """
+    Get the dotted module name of the archive member, None if it's not a python source
+
+    :param rel_path:            `str`           posix path in the archive, eg: my_package/sub/__init__.py
+    :return:                    `str`           eg: my_package.sub
+    """
+    if not rel_path.endswith(".py"):
+        return None
+    parts = rel_path[:-len(".py")].split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def _collect_files(source):
+    """
+    Get the (abs path, archive path) of all the files of the source which are not ignored
+    """
+    package_name = os.path.basename(source.rstrip(os.sep))
+    matcher = IgnoreMatcher.for_source(source)
+    members = list()
+    for root, dirs, files in os.walk(source):
+        matcher.prune(root=root, dirs=dirs, files=files)
+        dirs.sort()
+        for each_file in sorted(files):
+            file_path = os.path.join(root, each_file)
+            if matcher.is_ignored(file_path):
+                continue
+            rel_path = os.path.relpath(file_path, source).replace(os.sep, "/")
+            members.append((file_path, "{0}/{1}".format(package_name, rel_path)))
+    return members
+
+
+def _get_new_version(archives_dir, version):
+    # an archive is never overwritten, two builds in the same second get numbered names
+    index = 1
+    name = version
+    while any(os.path.exists(os.path.join(archives_dir, name + x))
+              for x in (ARCHIVE_EXTENSION, ARCHIVE_EXTENSION + releases.STAGING_SUFFIX)):
+        index += 1
+        name = "{0}.{1:03d}".format(version, index)
+    return name
+
+
+def build_archive(source, install_root=None, jobs=None, compile_bytecode=None):
+    """
+    Write the source package into a new versioned archive and make it live.
+
+    :param source:              `str`               source directory of the python package
+    :param install_root:        `str`               install directory, defaults to PY_BUILDS_DIR
+    :param jobs:                `int`               number of byte-compile workers
+    :param compile_bytecode:    `bool`              store the pycs of the sources, defaults to COMPILE_BYTECODE
+    :return:                    `InstallSummary`    copied are the archive members, release the archive version
+    """
+    compile_bytecode = scm_constants.COMPILE_BYTECODE if compile_bytecode is None else compile_bytecode
+    source = os.path.abspath(source)
+    package_name = os.path.basename(source)
+    archives_dir = get_archives_dir(package_name, install_root=install_root)
+    if not os.path.isdir(archives_dir):
+        os.makedirs(archives_dir)
+
+    summary = InstallSummary()
+    members = _collect_files(source)
+    version = _get_new_version(archives_dir, releases.make_version_name(source))
+    staging_path = os.path.join(archives_dir, version + ARCHIVE_EXTENSION + releases.STAGING_SUFFIX)
+    pyc_dir = tempfile.mkdtemp(prefix="scm_archive_")
+    try:
+        sources = [x for x in members if x[1].endswith(".py")]
+        pyc_members = dict()
+        if compile_bytecode:
+            # zipimport only looks for the legacy <module>.pyc next to the source, not in __pycache__.
+            # The tracebacks point into the archive, not to the source checkout
+            archive_path = os.path.join(archives_dir, version + ARCHIVE_EXTENSION)
+            pyc_paths = [os.path.join(pyc_dir, str(x)) for x in range(len(sources))]
+            summary.bytecode = compile_files([x[0] for x in sources], jobs=jobs, pyc_paths=pyc_paths,
+                                             dfiles=[os.path.join(archive_path, x[1]) for x in sources],
+                                             invalidation_mode=scm_constants.ARCHIVE_INVALIDATION_MODE)
+            compiled = set(summary.bytecode.compiled)
+            pyc_members = dict((y[1] + "c", x) for x, y in zip(pyc_paths, sources) if y[0] in compiled)
+
+        with zipfile.ZipFile(staging_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for file_path, arc_name in members:
+                archive.write(file_path, arc_name)
+                summary.copied.append(arc_name)
+                if arc_name + "c" in pyc_members:
+                    archive.write(pyc_members[arc_name + "c"], arc_name + "c")
+    except (IOError, OSError, zipfile.BadZipfile) as e:
+        logger.error("Can't write the archive of '{0}' : {1}".format(package_name, e))
+        summary.failed.append(staging_path)
+        if os.path.isfile(staging_path):
+            os.remove(staging_path)
+        return summary
+    finally:
+        shutil.rmtree(pyc_dir, ignore_errors=True)
+
+    index_path = os.path.join(archives_dir, version + INDEX_EXTENSION)
+    write_index(index_path, package_name=package_name, source=source, archive_path=staging_path,
+                modules=[get_module_name(x[1]) for x in sources], compiled=len(pyc_members))
+
+    summary.release = os.path.splitext(releases.activate_release(
+        package_path=get_archive_path(package_name, install_root=install_root), release_path=staging_path))[0]
+    cleanup_archives(package_name, install_root=install_root)
+    summary.report(name=os.path.basename(get_archive_path(package_name, install_root=install_root)))
+    return summary
+
+
+def write_index(index_path, package_name, source, archive_path, modules, compiled):
+    """
+    Write the json index of an archive, so the tools can list the modules without opening the archive
+    """
+    data_dict = OrderedDict()
+    data_dict["package"] = package_name
+    data_dict["revision"] = releases.get_source_revision(source)
+    data_dict["created"] = time.time()
+    data_dict["python"] = "{0}.{1}".format(*sys.version_info[:2])
+    data_dict["bytecode"] = scm_constants.ARCHIVE_INVALIDATION_MODE if compiled else None
+    data_dict["size"] = os.path.getsize(archive_path)
+    data_dict["hash"] = get_file_hash(archive_path)
+    data_dict["modules"] = sorted(modules)
+    with open(index_path, "w") as write_file:
+        json.dump(data_dict, write_file, indent=4)
+
+
+def read_index(package_name, install_root=None, version=None):
+    """
+    Read the index of the live (or given) archive version
+
+    :return:                    `dict`          None if there is no such archive
+    """
+    if version is None:
+        version = get_live_archive(package_name, install_root=install_root)
+    index_path = os.path.join(get_archives_dir(package_name, install_root=install_root),
+                              "{0}{1}".format(version, INDEX_EXTENSION))
+    if not version or not os.path.isfile(index_path):
+        return None
+    with open(index_path, "r") as read_file:
+        return json.load(read_file)
+
+
+def list_archives(package_name, install_root=None):
+    """
+    Get all the archived versions of the package, oldest first
+    """
+    archives_dir = get_archives_dir(package_name, install_root=install_root)
+    if not os.path.isdir(archives_dir):
+        return list()
+    return sorted(x[:-len(ARCHIVE_EXTENSION)] for x in os.listdir(archives_dir) if x.endswith(ARCHIVE_EXTENSION))
+
+
+def get_live_archive(package_name, install_root=None):
+    """
+    Get the version the archive symlink is pointing to, None if there is no archive build
+    """
+    archive_path = get_archive_path(package_name, install_root=install_root)
+    if not os.path.islink(archive_path):
+        return None
+    return os.path.basename(os.path.realpath(archive_path))[:-len(ARCHIVE_EXTENSION)]
+
+
+def cleanup_archives(package_name, install_root=None, keep=None):
+    """
+    Remove the old archives with their index and the left over staging files. The live archive is never removed.
+
+    :param keep:                `int`           number of newest archives to keep, defaults to RELEASE_RETENTION
+    :return:                    `list`          removed version names
+    """
+    keep = scm_constants.RELEASE_RETENTION if keep is None else keep
+    archives_dir = get_archives_dir(package_name, install_root=install_root)
+    live_archive = get_live_archive(package_name, install_root=install_root)
+    archives = list_archives(package_name, install_root=install_root)
+
+    removed = list()
+    for version in archives[:max(0, len(archives) - keep)]:
+        if version == live_archive:
+            continue
+        for extension in (ARCHIVE_EXTENSION, INDEX_EXTENSION):
+            file_path = os.path.join(archives_dir, version + extension)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+        removed.append(version)
+
+    if os.path.isdir(archives_dir):
+        for name in os.listdir(archives_dir):
+            staging_path = os.path.join(archives_dir, name)
+            if name.endswith(releases.STAGING_SUFFIX) and \
+                    time.time() - os.path.getmtime(staging_path) > scm_constants.STALE_STAGING_SECONDS:
+                os.remove(staging_path)
+
+    if removed:
+        logger.debug("Removed old archives: {0}".format(removed))
+    return removed
+
+
+def add_archive_to_path(package_name, install_root=None):
+    """
+    Put the live archive of the package on sys.path, resolved to its version file so the process keeps
+    importing from the same archive when a new build goes live.
+
+    :return:                    `str`           archive path added to sys.path, None if there is no archive build
+    """
+    archive_path = get_archive_path(package_name, install_root=install_root)
+    if not os.path.exists(archive_path):
+        return None
+
+    archive_path = os.path.realpath(archive_path)
+    if archive_path not in sys.path:
+        sys.path.insert(0, archive_path)
+    return archive_path
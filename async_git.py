@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio engine of the git operations.
+
+The clone, fetch, rebase, push and development branch operations are implemented here as coroutines, so many
+repositories can be handled concurrently from one event loop. The functions of the same name in git_utils are
+thin wrappers running them with run_sync().
+
+The commands talking to a remote have a deadline (GIT_COMMAND_TIMEOUT, GIT_CLONE_TIMEOUT for the clones) and
+the running git process is killed when the deadline passes or when the awaiting task is cancelled.
+
+    results = asyncio.run(run_concurrently([fetch_origin_async(x, timeout=60) for x in paths]))
+"""
+import os
+import time
+import asyncio
+import subprocess
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .command_runner import (CommandResult, CommandRecord, PROFILER, DEFAULT_TIMEOUT, get_timeout, use_new_session,
+                             kill_process, _record_name)
+from .git_utils import (RebaseResult, get_clone_args, get_fetch_args, get_git_active_branch,
+                        get_git_branch_names, get_reference_path, get_repository_name, remove_partial_clone)
+from .git_refs import is_rebase_in_progress
+from .mirror_cache import ensure_mirror, get_origin_url
+
+logger = get_logger(__name__)
+
+# seconds to wait for a killed git to be reaped, see _stop_process()
+KILL_WAIT_SECONDS = 5
+KILLED_EXIT_CODE = -9
+
+
+async def run_command_async(args, cwd=None, capture=False, log_output=True, prefix=None, env=None, timeout=None):
+    """
+    Run the command without blocking the event loop, see command_runner.run_command().
+    The process is killed if it runs longer than timeout or if the task is cancelled.
+
+    :param args:                `list`          command and its arguments
+    :param cwd:                 `str`           directory to run the command in, defaults to os.getcwd()
+    :param capture:             `bool`          return the output text in the result
+    :param log_output:          `bool`          log every output line
+    :param prefix:              `str`           prefix for every logged line, eg: the package name
+    :param env:                 `dict`          environment of the command, defaults to os.environ
+    :param timeout:             `int`           kill the command after this many seconds, None waits forever
+    :return:                    `CommandResult`
+    """
+    cwd = cwd or os.getcwd()
+    line_prefix = "[{0}] ".format(prefix) if prefix else ""
+    if log_output:
+        logger.info("{0}Running: '{1}' ".format(line_prefix, " ".join(args)))
+
+    start_time = time.time()
+    new_session = bool(timeout) and use_new_session()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args, cwd=cwd, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if log_output else subprocess.PIPE, start_new_session=new_session)
+    except OSError as e:
+        logger.error("{0}Failed to run '{1}' : {2}".format(line_prefix, args[0], e))
+        PROFILER.add(CommandRecord(name=_record_name(args), argv=list(args), cwd=cwd, start=start_time,
+                                   duration=time.time() - start_time, exit_code=-1))
+        return CommandResult(exit_code=-1, output="" if capture else None)
+
+    timed_out = False
+    output = list()
+    try:
+        await asyncio.wait_for(_read_output(process, output, log_output, line_prefix), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        logger.error("{0}'{1}' timed out after {2}s and was killed".format(line_prefix, " ".join(args), timeout))
+        await _stop_process(process, new_session)
+    except asyncio.CancelledError:
+        logger.warning("{0}'{1}' cancelled, killing it".format(line_prefix, " ".join(args)))
+        await _stop_process(process, new_session)
+        raise
+
+    exit_code = KILLED_EXIT_CODE if process.returncode is None else process.returncode
+    output_size = sum(len(x) for x in output)
+    PROFILER.add(CommandRecord(name=_record_name(args), argv=list(args), cwd=cwd, start=start_time,
+                               duration=time.time() - start_time, exit_code=exit_code, output_size=output_size))
+    text = b"".join(output).decode("utf-8", "replace") if capture else None
+    return CommandResult(exit_code=exit_code, output=text, timed_out=timed_out)
+
+
+async def _stop_process(process, new_session):
+    kill_process(process, new_session=new_session)
+    try:
+        # wait() returns once every pipe is closed. Without a session of its own (interactive terminal) the ssh
+        # of the killed git keeps the output pipe open, so the wait is bounded
+        await asyncio.wait_for(process.wait(), KILL_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.debug("Killed process {0} still has its output pipe open, not waiting for it".format(process.pid))
+        # asyncio has no public api to give up on the pipes, closing the transport closes our end of them
+        process._transport.close()
+
+
+async def _read_output(process, output, log_output, line_prefix):
+    if log_output:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            output.append(line)
+            logger.info("{0}{1}".format(line_prefix, line.decode("utf-8", "replace").rstrip()))
+        await process.wait()
+    else:
+        stdout, _stderr = await process.communicate()
+        output.append(stdout)
+
+
+async def run_git_async(args, cwd=None, **kwargs):
+    """
+    Run a git command, see run_command_async() and command_runner.run_git()
+
+    :param args:                `list`          git arguments, eg: ["fetch", "origin"]
+    :return:                    `CommandResult`
+    """
+    return await run_command_async(["git"] + list(args), cwd=cwd, **kwargs)
+
+
+def run_sync(coroutine):
+    """
+    Run the coroutine in a new event loop and return its result, for the synchronous api of git_utils.
+    Can be called from any thread, but not from a running event loop.
+    """
+    return asyncio.run(coroutine)
+
+
+async def run_concurrently(coroutines, jobs=None):
+    """
+    Await the coroutines with at most $jobs of them running at the same time
+
+    :param coroutines:          `list`          coroutines, eg: [fetch_origin_async(x) for x in paths]
+    :param jobs:                `int`           concurrency limit, defaults to GIT_JOBS
+    :return:                    `list`          results in the order of the coroutines
+    """
+    semaphore = asyncio.Semaphore(jobs or scm_constants.GIT_JOBS)
+
+    async def _limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*[_limited(x) for x in coroutines])
+
+
+async def in_thread(function, *args):
+    """
+    Await the blocking call in the default executor of the running loop, eg: the mirror cache refresh.
+    A thread can't be cancelled, give the blocking call its own deadline.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+def get_deadline(timeout):
+    """
+    :return:                    `float`         time at which the timeout is over, None for no deadline
+    """
+    return None if timeout is None else time.time() + timeout
+
+
+def get_remaining(deadline):
+    """
+    :return:                    `float`         seconds left until the deadline, None for no deadline
+    """
+    return None if deadline is None else max(deadline - time.time(), 0)
+
+
+def _is_expired(deadline, what, prefix=None):
+    if deadline is None or deadline > time.time():
+        return False
+    logger.error("{0}No time left for the {1}, the deadline passed".format(
+        "[{0}] ".format(prefix) if prefix else "", what))
+    return True
+
+
+async def clone_repository_async(git_ssh_url, branch=None, directory_path=None, target_name=None, prefix=None,
+                                 depth=None, clone_filter=None, single_branch=False, reference=None, use_mirror=None,
+                                 timeout=DEFAULT_TIMEOUT):
+    """
+    Clone the given git_ssh_url to given directory_path, see git_utils.clone_repository() for the parameters
+
+    :param timeout:             `int`           deadline of the clone, defaults to GIT_CLONE_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the clone succeeded
+    """
+    directory_path = directory_path or os.getcwd()
+    use_mirror = scm_constants.USE_MIRROR_CACHE if use_mirror is None else use_mirror
+    timeout = get_timeout(timeout, scm_constants.GIT_CLONE_TIMEOUT)
+    deadline = get_deadline(timeout)
+    reference = get_reference_path(reference, target_name or get_repository_name(git_ssh_url))
+
+    # the mirror step gets the same deadline, the clone only the time left
+    mirror_path = await in_thread(ensure_mirror, git_ssh_url, None, None, False, timeout) if use_mirror else None
+    if _is_expired(deadline, "clone", prefix=prefix):
+        return False
+    args, target_name = get_clone_args(git_ssh_url, branch=branch, target_name=target_name, depth=depth,
+                                       clone_filter=clone_filter, single_branch=single_branch, reference=reference,
+                                       mirror_path=mirror_path)
+    clone_path = os.path.join(directory_path, target_name or get_repository_name(git_ssh_url))
+    existed = os.path.exists(clone_path)
+
+    try:
+        result = await run_git_async(args, cwd=directory_path, prefix=prefix, timeout=get_remaining(deadline))
+    except asyncio.CancelledError:
+        if not existed:
+            remove_partial_clone(clone_path)
+        raise
+
+    if not result:
+        if result.timed_out and not existed:
+            # a killed git leaves the half written clone behind
+            remove_partial_clone(clone_path)
+        return False
+
+    if mirror_path:
+        # push and later fetches should know the real upstream
+        return bool(await run_git_async(["remote", "set-url", "origin", git_ssh_url], cwd=clone_path,
+                                        prefix=prefix))
+    return True
+
+
+async def fetch_origin_async(directory_path=None, prefix=None, use_mirror=None, max_age=None,
+                             timeout=DEFAULT_TIMEOUT):
+    """
+    Update the origin/* remote branches of the repository, see git_utils.fetch_origin()
+
+    :param max_age:             `int`           refresh the mirror first if it's older, 0 always refreshes it,
+                                                defaults to MIRROR_REFRESH_SECONDS
+    :param timeout:             `int`           deadline of the fetch, defaults to GIT_COMMAND_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the fetch succeeded
+    """
+    directory_path = directory_path or os.getcwd()
+    use_mirror = scm_constants.USE_MIRROR_CACHE if use_mirror is None else use_mirror
+    timeout = get_timeout(timeout, scm_constants.GIT_COMMAND_TIMEOUT)
+    deadline = get_deadline(timeout)
+
+    if use_mirror:
+        origin_url = await in_thread(get_origin_url, directory_path)
+        mirror_path = await in_thread(ensure_mirror, origin_url, None, max_age, False, timeout) \
+            if origin_url else None
+        if _is_expired(deadline, "fetch", prefix=prefix):
+            return False
+        if mirror_path:
+            if await run_git_async(get_fetch_args(mirror_path), cwd=directory_path, prefix=prefix,
+                                   timeout=get_remaining(deadline)):
+                return True
+            # eg: a tracking branch newer than the mirror, or a branch rewritten upstream
+            logger.warning("Fetch from the mirror '{0}' was rejected, fetching from origin".format(mirror_path))
+            if _is_expired(deadline, "fetch", prefix=prefix):
+                return False
+
+    return bool(await run_git_async(get_fetch_args(), cwd=directory_path, prefix=prefix,
+                                    timeout=get_remaining(deadline)))
+
+
+async def do_git_rebase_async(source_branch=None, directory_path=None, abort_on_conflict=False, prefix=None,
+                              timeout=DEFAULT_TIMEOUT):
+    """
+    Fetch once and rebase the active branch onto origin/$source_branch, the fast mode of
+    git_utils.do_git_rebase(). Never checks out another branch, so the work tree is only touched by the
+    rebase itself.
+
+    :param source_branch:       `str`           branch to rebase onto, defaults 'master'
+    :param directory_path:      `str`           directory path of the project
+    :param abort_on_conflict:   `bool`          abort the rebase if it stops on a conflict
+    :param prefix:              `str`           prefix for the logged git output
+    :param timeout:             `int`           deadline of the fetch, defaults to GIT_COMMAND_TIMEOUT, None waits
+                                                forever
+    :return:                    `RebaseResult`
+    """
+    directory_path = directory_path or os.getcwd()
+    source_branch = source_branch or scm_constants.MASTER_BRANCH
+    upstream = "origin/{0}".format(source_branch)
+
+    active_branch = get_git_active_branch(directory_path=directory_path)
+    if not active_branch or active_branch.startswith("("):
+        logger.warning("No active branch to rebase at '{0}'".format(directory_path))
+        return RebaseResult(status=scm_constants.REBASE_FAILED, branch=active_branch, onto=upstream,
+                            message="no active branch")
+
+    logger.debug("Fetching the data from upstream origin...")
+    if not await fetch_origin_async(directory_path=directory_path, prefix=prefix, max_age=0, timeout=timeout):
+        return RebaseResult(status=scm_constants.REBASE_FAILED, branch=active_branch, onto=upstream,
+                            message="fetch failed")
+
+    if await run_git_async(["merge-base", "--is-ancestor", upstream, "HEAD"], cwd=directory_path,
+                           log_output=False):
+        logger.info("{0}'{1}' is already up to date with '{2}'".format(
+            "[{0}] ".format(prefix) if prefix else "", active_branch, upstream))
+        return RebaseResult(status=scm_constants.REBASE_UP_TO_DATE, branch=active_branch, onto=upstream)
+
+    logger.debug("Running git rebase onto '{0}'".format(upstream))
+    if await run_git_async(["rebase", upstream], cwd=directory_path, prefix=prefix):
+        return RebaseResult(status=scm_constants.REBASE_REBASED, branch=active_branch, onto=upstream)
+    return await rebase_failed_async(active_branch, upstream, directory_path, abort_on_conflict, prefix=prefix)
+
+
+async def rebase_failed_async(branch, onto, directory_path, abort_on_conflict, prefix=None):
+    """
+    Result of a failed 'git rebase' of branch onto onto. It's a conflict only if the rebase stopped, git also
+    fails without starting it, eg: local changes in the way. The stopped rebase is aborted if asked.
+
+    :return:                    `RebaseResult`
+    """
+    if not is_rebase_in_progress(directory_path):
+        logger.warning("Rebase of '{0}' onto '{1}' failed, see the git output.".format(branch, onto))
+        return RebaseResult(status=scm_constants.REBASE_FAILED, branch=branch, onto=onto, message="rebase failed")
+
+    if abort_on_conflict:
+        logger.warning("Rebase of '{0}' onto '{1}' has conflicts, aborting it.".format(branch, onto))
+        await run_git_async(["rebase", "--abort"], cwd=directory_path, prefix=prefix)
+    else:
+        logger.warning("Rebase of '{0}' onto '{1}' stopped with conflicts. Resolve them and run "
+                       "'git rebase --continue'".format(branch, onto))
+    return RebaseResult(status=scm_constants.REBASE_CONFLICT, branch=branch, onto=onto)
+
+
+async def do_git_push_async(to_branch=None, force=False, directory_path=None, prefix=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Push the branches to origin in one 'git push', see git_utils.do_git_push()
+
+    :param to_branch:           `str|list`      branch name or list of branch names, defaults to active branch
+    :param force:               `bool`
+    :param directory_path:      `str`           directory path of the project
+    :param prefix:              `str`           prefix for the logged git output
+    :param timeout:             `int`           deadline of the push, defaults to GIT_COMMAND_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the push succeeded
+    """
+    directory_path = directory_path or os.getcwd()
+    timeout = get_timeout(timeout, scm_constants.GIT_COMMAND_TIMEOUT)
+    to_branch = to_branch or get_git_active_branch(directory_path=directory_path)
+    branches = list(to_branch) if isinstance(to_branch, (list, tuple)) else [to_branch]
+
+    args = ["push", "origin"] + branches
+    if force:
+        args.append("--force")
+    return bool(await run_git_async(args, cwd=directory_path, prefix=prefix, timeout=timeout))
+
+
+async def create_dev_branch_async(dev_branch, source_branch=None, directory_path=None, prefix=None,
+                                  timeout=DEFAULT_TIMEOUT):
+    """
+    Create the development branch from the fetched origin/$source_branch, see git_utils.create_dev_branch().
+    Branches off origin directly, so the local $source_branch is not checked out or merged.
+
+    :param dev_branch:          `str`           new branch name
+    :param source_branch:       `str`           upstream branch, defaults 'master'
+    :param directory_path:      `str`           directory path of the project
+    :param prefix:              `str`           prefix for the logged git output
+    :param timeout:             `int`           deadline of the fetch, defaults to GIT_COMMAND_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the branch was created
+    """
+    directory_path = directory_path or os.getcwd()
+    source_branch = source_branch or scm_constants.MASTER_BRANCH
+
+    all_branches = get_git_branch_names(directory_path=directory_path)
+    if not all_branches:
+        return False
+
+    if dev_branch in all_branches:
+        logger.warning("{0} branch already exists in your local.".format(dev_branch))
+        logger.warning("Run 'git pull origin {0}' to update your local branch with remote branch.!".format(dev_branch))
+        return False
+
+    logger.debug("Fetching the data from upstream origin...")
+    if not await fetch_origin_async(directory_path=directory_path, prefix=prefix, max_age=0, timeout=timeout):
+        return False
+
+    upstream = "origin/{0}".format(source_branch)
+    logger.debug("Creating new branch.!")
+    if not await run_git_async(["checkout", "-b", dev_branch, upstream], cwd=directory_path, prefix=prefix):
+        return False
+
+    logger.debug("Setting up the upstream pointers...")
+    await run_git_async(["branch", "--set-upstream-to", upstream], cwd=directory_path, prefix=prefix)
+    logger.info("Development branch created.!")
+    return True
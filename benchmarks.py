@@ -0,0 +1,685 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmarks of the scm_tools operations against synthetic data.
+
+Every benchmark generates its own data in a scratch directory, times the operation a few times and
+returns a json friendly result, so the numbers of two commits can be compared:
+
+    python -m scm_tools.benchmarks import --modules 500 --repeat 7 --output import.json
+    python -m scm_tools.benchmarks install --files 100000 --output new.json --compare base.json
+
+Everything runs offline, the git repositories are local and cloned through file://.
+
+    *   import      time to import every module of a package installed as a tree and as an archive, through
+                    zipimport and through the ArchiveFinder
+    *   startup     wall time of `scm --help` and `scm branch` against the eager imports of the old scripts,
+                    with the list of the heavy modules `scm --help` imported (should stay empty)
+    *   install     scm_install_package() full, no-op and 1% changed on a deep tree with large binaries,
+                    scm_install_bin_files() full and no-op
+    *   branches    get_all_git_branches() and get_git_active_branch() with thousands of loose/packed refs
+    *   clone       clone_repository() time and disk size of full, shallow, blobless, treeless, single
+                    branch and --reference clones
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from .command_runner import run_command
+
+logger = get_logger(__name__)
+
+BENCHMARKS = OrderedDict()
+SYNTHETIC_PACKAGE = "scm_bench_pkg"
+MODULE_TEMPLATE = '''
+"""
+Synthetic module {index}
+"""
+import os
+
+VALUE = {index}
+
+
+class Item{index}(object):
+    def __init__(self, name):
+        super(Item{index}, self).__init__()
+        self.name = name
+
+    def describe(self):
+        return "{{0}}:{{1}}".format(self.name, VALUE)
+
+
+def compute(count=100):
+    return sum(x * VALUE for x in range(count)) + len(os.sep)
+'''
+# prints the import time and the number of file opens and directory listings (python >= 3.8 audit events),
+# which is what costs a round trip each on NFS
+IMPORT_TIMER = """
+import sys, time
+{0}
+timer = getattr(time, "perf_counter", time.time)
+calls = [0] if hasattr(sys, "addaudithook") else None
+if calls is not None:
+    sys.addaudithook(lambda event, args: calls.__setitem__(0, calls[0] + (event in ("open", "os.listdir",
+                                                                                    "os.scandir"))))
+start = timer()
+import {1}.import_all
+sys.stdout.write("{{0!r}} {{1}}".format(timer() - start, calls and calls[0]))
+"""
+# the modules the scm dispatcher must not import before a command runs
+HEAVY_MODULES = ("logIO", "my_python.common", "my_python.system", "subprocess", "json", "getpass", "sqlite3",
+                 "asyncio", "scm_tools.git_utils", "scm_tools.common", "scm_tools.command_runner",
+                 "scm_tools.registry", "scm_tools.async_git")
+# runs a command line in a fresh interpreter, the last output line lists the heavy modules it imported
+STARTUP_RUNNER = """
+import sys
+sys.path.insert(0, {0!r})
+{1}
+sys.stdout.write("\\nmodules:" + ",".join(x for x in {2!r} if x in sys.modules))
+"""
+CLI_COMMAND = """
+from {0}.cli import main
+try:
+    main({1!r})
+except SystemExit:
+    pass
+"""
+# what the bin/scm_* scripts imported before they parsed their arguments
+EAGER_COMMAND = """
+import argparse
+from logIO import get_logger
+from {0} import constants
+from {0}.git_utils import PyGitRepository
+from {0} import command_runner
+from {0}.cli import add_profile_arguments
+try:
+    add_profile_arguments(argparse.ArgumentParser()).parse_args(["--help"])
+except SystemExit:
+    pass
+"""
+# what scm install ran for every project before the in-process install api
+SUBPROCESS_INSTALL = """
+from {0}.installer import install_project
+if not install_project({1!r}, install_root={2!r}, bin_install_dir={3!r}).success:
+    sys.exit(1)
+"""
+FINDER_SETUP = """
+sys.path.insert(0, {0!r})
+from {1}.archive_importer import install_finder
+install_finder({2!r})
+"""
+
+
+def benchmark(name):
+    """
+    Register the decorated function as the named benchmark. It's called with the scratch directory, the repeat
+    count and all the options of the command line, as keyword arguments, and returns a json friendly dict.
+    """
+    def _register(function):
+        BENCHMARKS[name] = function
+        return function
+    return _register
+
+
+def summarize(samples):
+    """
+    :param samples:             `list`          timings in seconds
+    :return:                    `OrderedDict`   min, median, mean and the number of runs
+    """
+    samples = sorted(samples)
+    middle = len(samples) // 2
+    median = samples[middle] if len(samples) % 2 else (samples[middle - 1] + samples[middle]) / 2.0
+    data_dict = OrderedDict()
+    data_dict["min"] = round(samples[0], 6)
+    data_dict["median"] = round(median, 6)
+    data_dict["mean"] = round(sum(samples) / float(len(samples)), 6)
+    data_dict["runs"] = len(samples)
+    return data_dict
+
+
+def make_synthetic_package(root_path, modules=200, modules_per_package=20):
+    """
+    Write a package of $modules small modules, nested so every sub package has $modules_per_package of them.
+    The package has an import_all module importing all of them.
+
+    :param root_path:           `str`           directory to write the package into
+    :return:                    `str`           source directory of the package
+    """
+    source = os.path.join(root_path, SYNTHETIC_PACKAGE)
+    module_names = list()
+    for index in range(modules):
+        parts = ["sub{0}".format(x) for x in _get_sub_packages(index // modules_per_package)]
+        package_dir = os.path.join(source, *parts)
+        if not os.path.isdir(package_dir):
+            os.makedirs(package_dir)
+            with open(os.path.join(package_dir, "__init__.py"), "w") as write_file:
+                write_file.write("")
+
+        module_name = "module{0}".format(index)
+        with open(os.path.join(package_dir, module_name + ".py"), "w") as write_file:
+            write_file.write(MODULE_TEMPLATE.format(index=index))
+        module_names.append(".".join([SYNTHETIC_PACKAGE] + parts + [module_name]))
+
+    with open(os.path.join(source, "import_all.py"), "w") as write_file:
+        write_file.write("".join("import {0}\n".format(x) for x in module_names))
+    return source
+
+
+def _get_sub_packages(package_index):
+    # 0 -> [], 1 -> [0], 2 -> [1], ... 10 -> [0, 0], a tree which gets deeper with the package count
+    parts = list()
+    while package_index:
+        package_index, remainder = divmod(package_index - 1, 10)
+        parts.insert(0, remainder)
+    return parts
+
+
+def time_imports(path_entry, repeat=5, finder=False):
+    """
+    Import the synthetic package from path_entry in $repeat fresh interpreters
+
+    :param path_entry:          `str`           sys.path entry, a directory or an archive
+    :param finder:              `bool`          import the archive through the ArchiveFinder instead of zipimport
+    :return:                    `tuple`         (import time of each run in seconds, file system calls or None)
+    """
+    setup = "sys.path.insert(0, {0!r})".format(path_entry)
+    if finder:
+        # the finder is imported before the timer starts, like a launcher would do
+        setup = FINDER_SETUP.format(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), __package__,
+                                    path_entry)
+    code = IMPORT_TIMER.format(setup, SYNTHETIC_PACKAGE)
+
+    samples, calls = list(), None
+    for _ in range(repeat):
+        result = run_command([sys.executable, "-E", "-S", "-c", code], capture=True, log_output=False)
+        if not result:
+            raise RuntimeError("Import of '{0}' failed : {1}".format(path_entry, result.output.strip()))
+        elapsed, calls = result.output.strip().splitlines()[-1].split()
+        samples.append(float(elapsed))
+    return samples, None if calls == "None" else int(calls)
+
+
+@benchmark("import")
+def benchmark_import(work_dir, repeat=5, modules=200, **_options):
+    """
+    Compare the import time of the synthetic package installed as a tree (with its __pycache__) and as a
+    single archive. The numbers of a local disk with a warm page cache are a lower bound of the gain on NFS,
+    where every stat/open the archive saves is a round trip.
+    """
+    from .common import scm_install_package
+
+    source = make_synthetic_package(os.path.join(work_dir, "source"), modules=modules)
+    tree_root = os.path.join(work_dir, "tree")
+    archive_root = os.path.join(work_dir, "archive")
+    scm_install_package(source, install_root=tree_root, versioned=False, compile_bytecode=True)
+    scm_install_package(source, install_root=archive_root, compile_bytecode=True, build_format="archive")
+
+    archive_path = os.path.realpath(os.path.join(archive_root, SYNTHETIC_PACKAGE + ".zip"))
+    result = OrderedDict()
+    result["modules"] = modules
+    for layout, path_entry, finder in (("tree", tree_root, False), ("zipimport", archive_path, False),
+                                       ("archive_finder", archive_path, True)):
+        if finder and sys.version_info[0] < 3:
+            continue
+        samples, calls = time_imports(path_entry, repeat=repeat, finder=finder)
+        result[layout] = summarize(samples)
+        result[layout]["fs_calls"] = calls
+        result[layout]["speedup"] = round(result["tree"]["median"] / max(result[layout]["median"], 1e-9), 2)
+    return result
+
+
+def time_command_line(code, repeat=5):
+    """
+    Run the python code in $repeat fresh interpreters, with the scm_tools package importable
+
+    :return:                    `tuple`         (wall time of each run in seconds, heavy modules imported)
+    """
+    code = STARTUP_RUNNER.format(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), code, HEAVY_MODULES)
+    samples, modules = list(), list()
+    for _ in range(repeat):
+        start_time = time.time()
+        result = run_command([sys.executable, "-c", code], capture=True, log_output=False)
+        samples.append(time.time() - start_time)
+        if not result:
+            raise RuntimeError("Command line failed : {0}".format(result.output.strip()))
+        modules = [x for x in result.output.strip().splitlines()[-1].split(":", 1)[-1].split(",") if x]
+    return samples, modules
+
+
+@benchmark("startup")
+def benchmark_startup(work_dir, repeat=5, **_options):
+    """
+    Time the start of the scm dispatcher, which imports the subsystem of a command only when it runs,
+    against the imports the old bin/scm_* scripts did before parsing their arguments
+    """
+    repository_path = os.path.join(work_dir, "repository")
+    run_command(["git", "init", "-q", repository_path], capture=True, log_output=False)
+
+    result = OrderedDict()
+    for name, code in (("eager_help", EAGER_COMMAND.format(__package__)),
+                       ("help", CLI_COMMAND.format(__package__, ["--help"])),
+                       ("branch", CLI_COMMAND.format(__package__, ["branch", repository_path]))):
+        samples, modules = time_command_line(code, repeat=repeat)
+        result[name] = summarize(samples)
+        result[name]["heavy_modules"] = modules
+    result["help"]["speedup"] = round(result["eager_help"]["median"] / max(result["help"]["median"], 1e-9), 2)
+    return result
+
+
+def time_call(function, repeat=5, setup=None):
+    """
+    Time the function $repeat times, setup is called (untimed) before every run
+
+    :return:                    `list`          wall time of each run in seconds
+    """
+    samples = list()
+    for index in range(repeat):
+        if setup is not None:
+            setup(index)
+        start_time = time.time()
+        function(index)
+        samples.append(time.time() - start_time)
+    return samples
+
+
+def get_disk_usage(path):
+    """
+    Get the allocated size of all the files under path, hardlinked files are counted once
+
+    :return:                    `int`           size in bytes
+    """
+    inodes = set()
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for each_name in dirs + files:
+            stat_result = os.lstat(os.path.join(root, each_name))
+            if (stat_result.st_dev, stat_result.st_ino) in inodes:
+                continue
+            inodes.add((stat_result.st_dev, stat_result.st_ino))
+            total += getattr(stat_result, "st_blocks", 0) * 512 or stat_result.st_size
+    return total
+
+
+def make_synthetic_tree(root_path, files=10000, depth=6, binaries=2, binary_mb=16, name="scm_bench_tree"):
+    """
+    Write a source tree of $files small files (half of them python) spread over directories $depth levels
+    deep, plus $binaries large binary files of $binary_mb MB each
+
+    :param root_path:           `str`           directory to write the tree into
+    :return:                    `str`           source directory of the tree
+    """
+    source = os.path.join(root_path, name)
+    for index in range(files):
+        # walk down one directory per level, 8 sub directories on each
+        parts = ["dir{0}".format((index // 8 ** x) % 8) for x in range(depth)][:1 + index % depth]
+        directory = os.path.join(source, *parts)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if index % 2:
+            file_name, content = "data{0}.json".format(index), json.dumps({"index": index, "name": name})
+        else:
+            file_name, content = "module{0}.py".format(index), MODULE_TEMPLATE.format(index=index)
+        with open(os.path.join(directory, file_name), "w") as write_file:
+            write_file.write(content)
+
+    for index in range(binaries):
+        with open(os.path.join(source, "binary{0}.bin".format(index)), "wb") as write_file:
+            for _ in range(binary_mb):
+                write_file.write(os.urandom(1024 * 1024))
+    return source
+
+
+def _touch_files(source, fraction=0.01):
+    """
+    Append a line to every 1/fraction-th python file of the source, like a small commit would
+    """
+    step = max(1, int(1 / fraction))
+    py_files = sorted(os.path.join(root, x) for root, dirs, files in os.walk(source) for x in files
+                      if x.endswith(".py"))
+    for file_path in py_files[::step]:
+        with open(file_path, "a") as write_file:
+            write_file.write("\nCHANGED = {0!r}\n".format(time.time()))
+
+
+@benchmark("install")
+def benchmark_install(work_dir, repeat=5, files=10000, depth=6, binaries=2, binary_mb=16, scripts=500, **_options):
+    """
+    Time scm_install_package() on a synthetic tree: a full install into an empty root, a no-op reinstall and
+    a reinstall after 1% of the python files changed. Time scm_install_bin_files() full and no-op too.
+    """
+    from .common import scm_install_package, scm_install_bin_files
+
+    source = make_synthetic_tree(os.path.join(work_dir, "source"), files=files, depth=depth, binaries=binaries,
+                                 binary_mb=binary_mb)
+    install_root = os.path.join(work_dir, "builds")
+
+    def _full_install(index):
+        scm_install_package(source, install_root=os.path.join(install_root, "full{0}".format(index)))
+
+    def _remove_full_install(index):
+        shutil.rmtree(os.path.join(install_root, "full{0}".format(index - 1)), ignore_errors=True)
+
+    def _reinstall(index):
+        scm_install_package(source, install_root=os.path.join(install_root, "incremental"))
+
+    result = OrderedDict()
+    result["files"] = files
+    result["source_bytes"] = get_disk_usage(source)
+    result["full"] = summarize(time_call(_full_install, repeat=repeat, setup=_remove_full_install))
+    _reinstall(0)
+    result["noop"] = summarize(time_call(_reinstall, repeat=repeat))
+    result["changed_1pct"] = summarize(time_call(_reinstall, repeat=repeat, setup=lambda x: _touch_files(source)))
+
+    bin_source = os.path.join(work_dir, "bin_source")
+    os.makedirs(bin_source)
+    for index in range(scripts):
+        with open(os.path.join(bin_source, "script{0}".format(index)), "w") as write_file:
+            write_file.write("#!/usr/bin/env python\nprint({0})\n".format(index))
+
+    bin_root = os.path.join(work_dir, "bin_builds")
+    result["bin_full"] = summarize(time_call(
+        lambda x: scm_install_bin_files(bin_source, install_dir=os.path.join(bin_root, str(x))), repeat=repeat))
+    result["bin_noop"] = summarize(time_call(
+        lambda x: scm_install_bin_files(bin_source, install_dir=os.path.join(bin_root, "0")), repeat=repeat))
+    return result
+
+
+def make_synthetic_projects(root_path, projects=20, files=200, scripts=5):
+    """
+    Write $projects project roots with the package_setup.py layout: src/<name> and src/bin
+
+    :return:                    `list`          project root directories
+    """
+    project_roots = list()
+    for index in range(projects):
+        name = "project{0}".format(index)
+        project_root = os.path.join(root_path, name)
+        make_synthetic_tree(os.path.join(project_root, "src"), files=files, depth=3, binaries=0, binary_mb=0,
+                            name=name)
+        bin_dir = os.path.join(project_root, "src", "bin")
+        os.makedirs(bin_dir)
+        for script_index in range(scripts):
+            with open(os.path.join(bin_dir, "{0}_script{1}".format(name, script_index)), "w") as write_file:
+                write_file.write("#!/usr/bin/env python\nprint({0})\n".format(script_index))
+        project_roots.append(project_root)
+    return project_roots
+
+
+@benchmark("batch_install")
+def benchmark_batch_install(work_dir, repeat=5, projects=20, project_files=200, **_options):
+    """
+    Install $projects small projects of $project_files files with one interpreter per project, like the package_setup.py
+    subprocesses of scm install did, against a single in-process install_projects() call
+    """
+    from .installer import install_projects
+
+    project_roots = make_synthetic_projects(os.path.join(work_dir, "projects"), projects=projects,
+                                            files=project_files)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def _get_roots(mode, index):
+        root_path = os.path.join(work_dir, mode, str(index))
+        return os.path.join(root_path, "builds"), os.path.join(root_path, "bin_builds")
+
+    def _subprocess_install(index):
+        install_root, bin_install_dir = _get_roots("subprocess", index)
+        for project_root in project_roots:
+            code = STARTUP_RUNNER.format(package_dir, SUBPROCESS_INSTALL.format(
+                __package__, project_root, install_root, bin_install_dir), ())
+            result = run_command([sys.executable, "-c", code], capture=True, log_output=False)
+            if not result:
+                raise RuntimeError("Install of '{0}' failed : {1}".format(project_root, result.output.strip()))
+
+    def _batch_install(index):
+        install_root, bin_install_dir = _get_roots("batch", index)
+        report = install_projects(project_roots, install_root=install_root, bin_install_dir=bin_install_dir)
+        if not report.success:
+            raise RuntimeError(report.format())
+
+    result = OrderedDict()
+    result["projects"] = projects
+    result["files"] = projects * project_files
+    for mode, function in (("subprocess", _subprocess_install), ("batch", _batch_install)):
+        result[mode] = OrderedDict()
+        result[mode]["full"] = summarize(time_call(function, repeat=repeat))
+        result[mode]["noop"] = summarize(time_call(lambda x: function(0), repeat=repeat))
+    for name in ("full", "noop"):
+        result["batch"][name]["speedup"] = round(result["subprocess"][name]["median"] /
+                                                 max(result["batch"][name]["median"], 1e-9), 2)
+    return result
+
+
+def _git(args, cwd):
+    result = run_command(["git", "-c", "user.name=scm_bench", "-c", "user.email=scm_bench@localhost"] + args,
+                         cwd=cwd, capture=True, log_output=False)
+    if not result:
+        raise RuntimeError("git {0} failed : {1}".format(" ".join(args), result.output.strip()))
+    return result.output.strip()
+
+
+def make_synthetic_repository(root_path, files=2000, commits=20, branches=5000, packed=True, binary_mb=4):
+    """
+    Create a git repository with a history of $commits commits over $files files and $branches branches,
+    plus a bare clone of it which serves as the remote of the clone benchmarks
+
+    :param root_path:           `str`           directory to create the repositories in
+    :param packed:              `bool`          pack the refs, the branches are loose ref files otherwise
+    :param binary_mb:           `int`           size of the binary file of the repository in MB
+    :return:                    `tuple`         (work tree path, bare repository path)
+    """
+    work_tree = os.path.join(root_path, "repository")
+    source = make_synthetic_tree(work_tree, files=files, depth=4, binaries=1, binary_mb=binary_mb, name="src")
+    _git(["init", "-q"], cwd=work_tree)
+    for index in range(commits):
+        if index:
+            _touch_files(source, fraction=0.05)
+        _git(["add", "-A"], cwd=work_tree)
+        _git(["commit", "-q", "-m", "commit {0}".format(index)], cwd=work_tree)
+
+    # the branches are written as ref files, thousands of 'git branch' calls would take minutes
+    head_sha = _git(["rev-parse", "HEAD"], cwd=work_tree)
+    for index in range(branches):
+        ref_path = os.path.join(work_tree, ".git", "refs", "heads", "feature", "branch{0:06d}".format(index))
+        if not os.path.isdir(os.path.dirname(ref_path)):
+            os.makedirs(os.path.dirname(ref_path))
+        with open(ref_path, "w") as write_file:
+            write_file.write(head_sha + "\n")
+    if packed:
+        _git(["pack-refs", "--all"], cwd=work_tree)
+
+    bare_path = os.path.join(root_path, "remote.git")
+    _git(["clone", "-q", "--bare", work_tree, bare_path], cwd=root_path)
+    # partial clones need the filter support of the serving side
+    _git(["config", "uploadpack.allowFilter", "true"], cwd=bare_path)
+    return work_tree, bare_path
+
+
+@benchmark("branches")
+def benchmark_branches(work_dir, repeat=5, branches=5000, **_options):
+    """
+    Time get_all_git_branches() and get_git_active_branch() on a repository with $branches branches, with
+    loose and with packed refs, against the 'git for-each-ref' call they replace
+    """
+    from .git_utils import get_all_git_branches, get_git_active_branch
+    from .git_refs import _get_branch_state_from_git
+
+    result = OrderedDict()
+    result["branches"] = branches
+    for layout, packed in (("loose", False), ("packed", True)):
+        work_tree = make_synthetic_repository(os.path.join(work_dir, layout), files=10, commits=1, branches=branches,
+                                              packed=packed, binary_mb=0)[0]
+        result[layout] = OrderedDict()
+        result[layout]["all_branches"] = summarize(time_call(lambda x: get_all_git_branches(work_tree), repeat=repeat))
+        result[layout]["active_branch"] = summarize(time_call(lambda x: get_git_active_branch(work_tree),
+                                                              repeat=repeat))
+        result[layout]["git_for_each_ref"] = summarize(time_call(lambda x: _get_branch_state_from_git(work_tree),
+                                                                 repeat=repeat))
+    return result
+
+
+@benchmark("clone")
+def benchmark_clone(work_dir, repeat=5, repo_files=2000, commits=20, branches=1000, **_options):
+    """
+    Time clone_repository() from a local bare repository through the file:// protocol, so git packs the
+    objects like it does for a remote, and compare the disk size of the full, shallow and partial clones.
+    The reference clone borrows the objects of the source repository, like a clone next to a shared
+    reference checkout.
+    """
+    from .git_utils import clone_repository
+
+    bare_path = make_synthetic_repository(os.path.join(work_dir, "source"), files=repo_files, commits=commits,
+                                          branches=branches)[1]
+    clone_root = os.path.join(work_dir, "clones")
+    os.makedirs(clone_root)
+
+    result = OrderedDict()
+    result["files"] = repo_files
+    result["commits"] = commits
+    for mode, options in (("full", dict()), ("shallow", dict(depth=1)), ("blobless", dict(clone_filter="blobless")),
+                          ("treeless", dict(clone_filter="treeless")), ("single_branch", dict(single_branch=True)),
+                          ("reference", dict(reference=bare_path))):
+        def _clone(index):
+            if not clone_repository("file://" + bare_path, directory_path=clone_root, use_mirror=False,
+                                    target_name="{0}{1}".format(mode, index), **options):
+                raise RuntimeError("{0} clone failed".format(mode))
+
+        result[mode] = summarize(time_call(_clone, repeat=repeat))
+        result[mode]["bytes"] = get_disk_usage(os.path.join(clone_root, "{0}0".format(mode)))
+    return result
+
+
+def _flatten(data, prefix=""):
+    # {"install": {"full": {"median": 1.0}}} -> {"install.full": 1.0}, only the medians are compared
+    values = dict()
+    for key, value in data.items():
+        if isinstance(value, dict):
+            values.update(_flatten(value, prefix="{0}{1}.".format(prefix, key)))
+        elif key == "median":
+            values[prefix.rstrip(".")] = value
+    return values
+
+
+def compare_reports(base, current, threshold=0.2, min_delta=0.005):
+    """
+    Compare the medians of two run_benchmarks() reports
+
+    :param base:                `dict`          report of the base commit
+    :param current:             `dict`          report of the commit to check
+    :param threshold:           `float`         relative slowdown counted as a regression, 0.2 is 20% slower
+    :param min_delta:           `float`         slowdowns under this many seconds are noise, not regressions
+    :return:                    `list`          (name, base median, current median, ratio, is regression) of
+                                                the timings in both reports
+    """
+    base_values = _flatten(base.get("results", dict()))
+    current_values = _flatten(current.get("results", dict()))
+    rows = list()
+    for name in sorted(set(base_values) & set(current_values)):
+        ratio = current_values[name] / max(base_values[name], 1e-9)
+        regression = ratio > 1 + threshold and current_values[name] - base_values[name] > min_delta
+        rows.append((name, base_values[name], current_values[name], round(ratio, 3), regression))
+    return rows
+
+
+def format_comparison(rows):
+    """
+    Format the compare_reports() rows as a table
+    """
+    width = max([len("Benchmark")] + [len(x[0]) for x in rows])
+    lines = ["{0:<{width}}  {1:>10}  {2:>10}  {3:>7}".format("Benchmark", "Base", "Current", "Ratio", width=width)]
+    for name, base_value, current_value, ratio, regression in rows:
+        lines.append("{0:<{width}}  {1:>9.4f}s  {2:>9.4f}s  {3:>7.3f}{4}".format(
+            name, base_value, current_value, ratio, "  REGRESSION" if regression else "", width=width))
+    lines.append("{0} timings compared, {1} regressions".format(len(rows), len([x for x in rows if x[-1]])))
+    return "\n".join(lines)
+
+
+def run_benchmarks(names=None, work_dir=None, **options):
+    """
+    Run the benchmarks, each in its own scratch directory which is removed afterwards
+
+    :param names:               `list`          benchmark names, defaults to all of them
+    :param work_dir:            `str`           keep the scratch directories under this directory
+    :param options:             `dict`          keyword arguments for the benchmark functions
+    :return:                    `OrderedDict`   environment info and the result of each benchmark
+    """
+    from .releases import get_source_revision
+
+    report = OrderedDict()
+    report["created"] = time.time()
+    report["revision"] = get_source_revision(os.path.dirname(os.path.abspath(__file__)))
+    report["python"] = platform.python_version()
+    report["platform"] = platform.platform()
+    report["results"] = OrderedDict()
+
+    for name in names or BENCHMARKS:
+        scratch_dir = tempfile.mkdtemp(prefix="scm_bench_{0}_".format(name), dir=work_dir)
+        logger.info("Running benchmark '{0}' in '{1}'".format(name, scratch_dir))
+        try:
+            report["results"][name] = BENCHMARKS[name](work_dir=scratch_dir, **options)
+        finally:
+            if work_dir is None:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    """
+    Run the benchmarks from the command line
+
+    :return:                    `int`           exit code, 1 if --compare found a regression
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmarks: {0}".format(", ".join(BENCHMARKS)))
+    parser.add_argument("names", nargs="*", help="Benchmarks to run, defaults to all of them")
+    parser.add_argument('-r', '--repeat', type=int, help="Timed runs of each operation", default=5)
+    parser.add_argument('--modules', type=int, help="Modules of the synthetic package (import)", default=200)
+    parser.add_argument('--files', type=int, help="Files of the synthetic tree (install)", default=10000)
+    parser.add_argument('--depth', type=int, help="Directory levels of the synthetic tree (install)", default=6)
+    parser.add_argument('--binaries', type=int, help="Large binary files of the synthetic tree (install)", default=2)
+    parser.add_argument('--binary_mb', type=int, help="Size of each binary file in MB (install)", default=16)
+    parser.add_argument('--scripts', type=int, help="Scripts of the synthetic bin directory (install)", default=500)
+    parser.add_argument('--projects', type=int, help="Projects installed in one run (batch_install)", default=20)
+    parser.add_argument('--project_files', type=int, help="Files of each project (batch_install)", default=200)
+    parser.add_argument('--branches', type=int, help="Branches of the synthetic repository (branches)", default=5000)
+    parser.add_argument('--repo_files', type=int, help="Files of the synthetic repository (clone)", default=2000)
+    parser.add_argument('--commits', type=int, help="Commits of the synthetic repository (clone)", default=20)
+    parser.add_argument('--work_dir', help="Keep the generated data under this directory", default=None)
+    parser.add_argument('-o', '--output', help="Write the json results to this file", default=None)
+    parser.add_argument('--compare', metavar="BASE", help="Compare the results with this earlier json result file")
+    parser.add_argument('--threshold', type=float, help="Slowdown reported as regression by --compare, 0.2 is 20%%",
+                        default=0.2)
+    args = parser.parse_args()
+
+    unknown = [x for x in args.names if x not in BENCHMARKS]
+    if unknown:
+        parser.error("Unknown benchmarks {0}, expected some of {1}".format(unknown, list(BENCHMARKS)))
+
+    report = run_benchmarks(names=args.names, work_dir=args.work_dir, repeat=args.repeat, modules=args.modules,
+                            files=args.files, depth=args.depth, binaries=args.binaries, binary_mb=args.binary_mb,
+                            scripts=args.scripts, branches=args.branches, repo_files=args.repo_files,
+                            commits=args.commits, projects=args.projects, project_files=args.project_files)
+    if args.output:
+        with open(args.output, "w") as write_file:
+            json.dump(report, write_file, indent=4)
+        logger.info("Results written to '{0}'".format(args.output))
+    else:
+        print(json.dumps(report, indent=4))
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare, "r") as read_file:
+        rows = compare_reports(json.load(read_file), report, threshold=args.threshold)
+    print(format_comparison(rows))
+    return 1 if any(x[-1] for x in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+Byte-compile stage of the installs.
+
+The production processes import from read-only shares, where they can't write their own bytecode, so the
+install compiles the .py files it wrote, in parallel over the cpu cores. The pycs are hash based
+(python >= 3.7), so they stay valid no matter what mtime the copy or hardlink gave the source file.
+Only the files changed by the install are compiled. The pycs of removed files are removed too.
+"""
+import os
+import glob
+import py_compile
+import multiprocessing
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+
+logger = get_logger(__name__)
+
+# compiling a handful of files is faster than starting the worker processes
+MIN_FILES_FOR_POOL = 16
+
+
+class CompileSummary(object):
+    """
+    Counters of one compile stage
+    """
+    def __init__(self):
+        super(CompileSummary, self).__init__()
+        self.compiled = list()
+        self.failed = list()
+        self.removed = list()
+
+    def __repr__(self):
+        return "Compiled: {0}, Failed: {1}, Removed: {2}".format(len(self.compiled), len(self.failed),
+                                                                 len(self.removed))
+
+
+def get_pyc_path(file_path):
+    """
+    :param file_path:           `str`           abs .py file path
+    :return:                    `str`           pyc path used by the running interpreter
+    """
+    try:
+        from importlib.util import cache_from_source
+    except ImportError:
+        return file_path + "c"
+    return cache_from_source(file_path)
+
+
+def get_invalidation_mode(name=None):
+    """
+    Get the py_compile invalidation mode for the PYC_INVALIDATION_MODE name, None before python 3.7
+
+    :param name:                `str`           "checked-hash", "unchecked-hash" or "timestamp"
+    """
+    mode_enum = getattr(py_compile, "PycInvalidationMode", None)
+    if mode_enum is None:
+        return None
+    name = (name or scm_constants.PYC_INVALIDATION_MODE).upper().replace("-", "_")
+    return getattr(mode_enum, name)
+
+
+def _compile_file(task):
+    """
+    Worker of compile_files(), module level so it can be pickled for the process pool
+
+    :return:                    `tuple`         (file_path, error message or None)
+    """
+    file_path, mode_name, pyc_path, dfile = task
+    kwargs = dict()
+    invalidation_mode = get_invalidation_mode(mode_name)
+    if invalidation_mode is not None:
+        kwargs["invalidation_mode"] = invalidation_mode
+
+    pyc_path = pyc_path or get_pyc_path(file_path)
+    # the pyc can be a hardlink into the live release (seeded staging), never write through it
+    _remove_file(pyc_path)
+    try:
+        py_compile.compile(file_path, cfile=pyc_path, dfile=dfile, doraise=True, **kwargs)
+    except (py_compile.PyCompileError, IOError, OSError) as e:
+        _remove_file(pyc_path)
+        return file_path, str(e).strip().splitlines()[-1] if str(e).strip() else repr(e)
+    return file_path, None
+
+
+def _get_pool(processes):
+    """
+    Get a forked process pool, None where fork is not available. The spawned workers would import the
+    __main__ module again, and package_setup.py installs at import time.
+    """
+    if not hasattr(os, "fork"):
+        return None
+    get_context = getattr(multiprocessing, "get_context", None)
+    if get_context is None:
+        # python 2 always forks
+        return multiprocessing.Pool(processes=processes)
+    return get_context("fork").Pool(processes=processes)
+
+
+def compile_files(file_paths, jobs=None, invalidation_mode=None, pyc_paths=None, dfiles=None):
+    """
+    Byte-compile the files in parallel. A file which fails to compile has its old pyc removed so a stale
+    pyc is never used instead of the new source.
+
+    :param file_paths:          `list`          abs .py file paths
+    :param jobs:                `int`           number of worker processes, defaults to COMPILE_JOBS or the cpu count
+    :param invalidation_mode:   `str`           "checked-hash", "unchecked-hash" or "timestamp",
+                                                defaults to PYC_INVALIDATION_MODE
+    :param pyc_paths:           `list`          pyc path of each file, defaults to get_pyc_path()
+    :param dfiles:              `list`          file name of each file in the tracebacks, defaults to its path
+    :return:                    `CompileSummary`
+    """
+    summary = CompileSummary()
+    mode_name = invalidation_mode or scm_constants.PYC_INVALIDATION_MODE
+    pyc_paths = pyc_paths or [None] * len(file_paths)
+    dfiles = dfiles or [None] * len(file_paths)
+    tasks = [(x, mode_name, y, z) for x, y, z in zip(file_paths, pyc_paths, dfiles)]
+    if not tasks:
+        return summary
+
+    jobs = jobs or scm_constants.COMPILE_JOBS or multiprocessing.cpu_count()
+    pool = _get_pool(processes=min(jobs, len(tasks))) if jobs > 1 and len(tasks) >= MIN_FILES_FOR_POOL else None
+    if pool is None:
+        results = [_compile_file(x) for x in tasks]
+    else:
+        try:
+            results = pool.map(_compile_file, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+        finally:
+            pool.close()
+            pool.join()
+
+    for file_path, error in results:
+        if error:
+            logger.warning("Can't compile '{0}' : {1}".format(file_path, error))
+            summary.failed.append(file_path)
+        else:
+            summary.compiled.append(file_path)
+    return summary
+
+
+def remove_bytecode(file_path):
+    """
+    Remove all the pycs (any interpreter, any optimization level) of the given .py file
+
+    :return:                    `list`          removed pyc paths
+    """
+    directory, file_name = os.path.split(file_path)
+    module_name = os.path.splitext(file_name)[0]
+    pattern = glob.escape(module_name) if hasattr(glob, "escape") else module_name
+    pyc_paths = glob.glob(os.path.join(directory, "__pycache__", pattern + ".*.pyc"))
+    pyc_paths.extend(x for x in (file_path + "c", file_path + "o") if os.path.isfile(x))
+
+    removed = list()
+    for pyc_path in pyc_paths:
+        if _remove_file(pyc_path):
+            removed.append(pyc_path)
+
+    cache_dir = os.path.join(directory, "__pycache__")
+    if os.path.isdir(cache_dir) and not os.listdir(cache_dir):
+        os.rmdir(cache_dir)
+    return removed
+
+
+def _remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        return False
+    return True
+
+
+def compile_install(installation_path, changed, removed=None, jobs=None):
+    """
+    Compile stage of install_tree(): compile the changed .py files and remove the pycs of the removed ones
+
+    :param installation_path:   `str`           install directory
+    :param changed:             `list`          relative paths written by the install
+    :param removed:             `list`          relative paths removed by the install
+    :param jobs:                `int`           number of worker processes
+    :return:                    `CompileSummary`
+    """
+    file_paths = [os.path.join(installation_path, x) for x in changed if x.endswith(".py")]
+    summary = compile_files(file_paths, jobs=jobs)
+
+    for rel_path in removed or list():
+        if rel_path.endswith(".py"):
+            summary.removed.extend(remove_bytecode(os.path.join(installation_path, rel_path)))
+
+    logger.info("Bytecode for '{0}': {1}".format(os.path.basename(installation_path.rstrip(os.sep)), summary))
+    return summary
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+
+"""
+Single `scm` entry point of the scm_tools commands.
+
+Building the command line only imports argparse and the constants. The subsystem of a command (git_utils,
+common, registry, ...) and logIO are imported when that command runs, so `scm --help` and the quick queries
+don't pay for the imports of everything else. The bin/scm_* scripts are thin shims calling main() with
+their command name.
+
+    scm clone my_package -b develop
+    scm rebase --fast
+    scm branch
+"""
+import os
+import sys
+import argparse
+
+from . import constants as scm_constants
+
+GROUP_OPERATION_NAMES = {"fetch": "fetched", "rebase": "rebased", "status": "checked", "push": "pushed"}
+
+
+def _get_logger():
+    from logIO import get_logger
+    return get_logger(__name__)
+
+
+def add_profile_arguments(parser):
+    """
+    Add the --profile arguments to the argparse parser of a command
+    """
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="Write the timings of all the commands to this json file")
+    parser.add_argument("--profile_format", choices=["chrome", "json"], default=None,
+                        help="Profile format, chrome trace or plain json list")
+    return parser
+
+
+def run_clone(args):
+    """
+    Clone the Git package(s) to the user directory
+    """
+    from .git_utils import PyGitRepository, clone_packages, format_clone_report
+    from .package_group import read_manifest
+
+    packages = list(args.package)
+    if args.manifest:
+        packages.extend(read_manifest(args.manifest))
+
+    if not packages:
+        _get_logger().error("No package given to clone.!")
+        return False
+
+    clone_options = dict(depth=args.depth, clone_filter=args.filter, single_branch=args.single_branch,
+                         reference=args.reference, use_mirror=False if args.no_mirror else None)
+
+    if len(packages) == 1 and not isinstance(packages[0], tuple):
+        obj = PyGitRepository(pkg_name=str(packages[0]))
+        return obj.clone(source_branch=args.branch, overwrite_existing=args.force, **clone_options)
+
+    results = clone_packages(packages, branch=args.branch, overwrite_existing=args.force, jobs=args.jobs,
+                             **clone_options)
+    _get_logger().info("\n" + format_clone_report(results))
+    return all(x.success for x in results.values())
+
+
+def run_develop(args):
+    """
+    Create a dev branch for active git project
+    """
+    from .git_utils import PyGitRepository
+
+    py_project = PyGitRepository.from_path(path=os.getcwd())
+    if args.worktree or args.sparse:
+        worktree = py_project.develop_worktree(to_branch=args.branch, source_branch=args.source,
+                                               sparse_paths=args.sparse, description=args.description)
+        if worktree is None:
+            return False
+        print(worktree.disk_path)
+        return True
+
+    return py_project.develop(to_branch=args.branch, need_rebase=args.rebase, source_branch=args.source,
+                              description=args.description)
+
+
+def run_worktree(args):
+    """
+    List, clean up or remove the ticket worktrees of the git project
+    """
+    from .worktrees import get_main_path, list_worktrees, format_worktrees, cleanup_worktrees, remove_worktree
+
+    main_path = get_main_path(os.path.abspath(args.directory or os.getcwd()))
+    if main_path is None:
+        _get_logger().error("Not a git repository : '{0}'".format(args.directory or os.getcwd()))
+        return False
+
+    if args.operation == "list":
+        print(format_worktrees(main_path, list_worktrees(main_path)))
+        return True
+
+    if args.operation == "cleanup":
+        worktrees = cleanup_worktrees(main_path, dry_run=args.dry_run)
+        print("{0} finished worktree(s) {1}".format(len(worktrees), "found" if args.dry_run else "removed"))
+        return True
+
+    if not args.branch:
+        _get_logger().error("Give the branch or the path of the worktree to remove")
+        return False
+
+    worktrees = [x for x in list_worktrees(main_path)
+                 if args.branch in (x.branch, x.path) or x.path == os.path.abspath(args.branch)]
+    if not worktrees:
+        _get_logger().error("No worktree of '{0}' in '{1}'".format(args.branch, main_path))
+        return False
+    return remove_worktree(main_path, worktrees[0], force=args.force, delete_branch=not args.keep_branch)
+
+
+def run_rebase(args):
+    """
+    Rebase the active branch of the git project
+    """
+    from .git_utils import PyGitRepository
+
+    py_project = PyGitRepository.from_path(path=os.getcwd())
+    result = py_project.rebase(with_branch=args.branch, fast=args.fast or None)
+    _get_logger().info("Rebase result: {0}".format(result.status))
+    return result
+
+
+def run_push(args):
+    """
+    Push the active branch, or the given branches in one git push, of the git project
+    """
+    from .git_utils import PyGitRepository
+
+    py_project = PyGitRepository.from_path(path=os.getcwd())
+    return py_project.push(to_branch=args.branches or None, open_merge_request=args.pull_request, force=args.force)
+
+
+def run_branch(args):
+    """
+    Print the active branch of the git project, read from the .git files without running git
+    """
+    from .git_refs import find_git_directory, get_branch_state
+
+    git_directory = find_git_directory(os.path.abspath(args.path))
+    if git_directory is None:
+        _get_logger().error("'{0}' is not in a git repository.!".format(args.path))
+        return False
+
+    print(get_branch_state(directory_path=git_directory.work_tree, with_branches=False)[0] or "HEAD")
+    return True
+
+
+def run_install(args):
+    """
+    Install the current package, or all the given projects in one run, to the user repository
+    """
+    from my_python.common.general import get_project_root_from_path
+
+    if args.gc:
+        from .object_store import ObjectStore
+        for install_root in (scm_constants.PY_BUILDS_DIR, scm_constants.BIN_BUILDS_DIR):
+            ObjectStore.for_install_root(install_root).gc(dry_run=args.dry_run)
+        return True
+
+    project_roots = list()
+    for path in args.projects or [os.getcwd()]:
+        project = get_project_root_from_path(source_path=os.path.abspath(path))
+        if project is None:
+            _get_logger().error("No project found in '{0}'".format(path))
+            return False
+        project_roots.append(project.root_path)
+
+    if args.rollback is not None:
+        from . import releases
+        success = True
+        for project_root in project_roots:
+            package_path = os.path.join(scm_constants.PY_BUILDS_DIR, os.path.basename(project_root))
+            success = releases.rollback(package_path=package_path, version=args.rollback or None) and success
+        return success
+
+    from .installer import install_projects
+    report = install_projects(project_roots, live=args.live, override=args.force, jobs=args.jobs,
+                              dedup=args.dedup or None, compile_bytecode=False if args.no_compile else None,
+                              build_format="archive" if args.archive else None)
+    if len(report) > 1 or not report.success:
+        print(report.format())
+    if not report.success or not args.watch:
+        return report.success
+
+    from .watcher import get_sync_targets, watch
+    targets = list()
+    for project_root in project_roots:
+        targets.extend(get_sync_targets(project_root, for_qc=args.live, compile_bytecode=not args.no_compile,
+                                        build_format="archive" if args.archive else None))
+    if not targets:
+        _get_logger().error("Nothing to watch in {0}".format(project_roots))
+        return False
+    watch(targets)
+    return True
+
+
+def run_group(args):
+    """
+    Fetch, rebase, push or check the status of a group of packages in parallel
+    """
+    import json
+    from .package_group import PackageGroup, format_group_report
+
+    group_path = os.path.abspath(args.directory or os.getcwd())
+    if args.manifest:
+        group = PackageGroup.from_manifest(args.manifest, group_path=group_path)
+    else:
+        group = PackageGroup.load(group_path)
+
+    if args.operation == "save":
+        return group.save()
+
+    if not len(group):
+        _get_logger().error("No package found in the group '{0}'".format(group_path))
+        return False
+
+    if args.operation == "fetch":
+        results = group.fetch(jobs=args.jobs)
+    elif args.operation == "rebase":
+        results = group.rebase(with_branch=args.branch, fast=args.fast or None, jobs=args.jobs)
+    elif args.operation == "push":
+        results = group.push(force=args.force, jobs=args.jobs)
+    else:
+        results = group.status(jobs=args.jobs)
+
+    if args.json:
+        print(json.dumps([x.to_dict() for x in results.values()], indent=2))
+    else:
+        _get_logger().info("\n" + format_group_report(results, operation=GROUP_OPERATION_NAMES[args.operation]))
+    return all(x.success for x in results.values())
+
+
+def run_status(args):
+    """
+    Show the branch, ahead/behind, dirty flag and stash count of many repositories at once
+    """
+    import json
+    from .package_group import get_packages_status, format_status_report
+
+    packages = get_status_packages(paths=args.path or [os.getcwd()], from_registry=args.registry)
+    if not packages:
+        _get_logger().error("No repository found.!")
+        return False
+
+    results = get_packages_status(packages, untracked=args.untracked, jobs=args.jobs)
+    if args.dirty_only:
+        results = [x for x in results if x.value is None or x.value.has_local_work]
+
+    if args.json:
+        print(json.dumps([x.to_dict() for x in results], indent=2))
+    else:
+        print(format_status_report(results))
+    return all(x.success for x in results)
+
+
+def get_status_packages(paths, from_registry=False):
+    """
+    Get the repositories to check:
+
+        *   --registry                  all the registered checkouts under the paths
+        *   path inside a repository    that repository
+        *   any other directory         the package group of the directory
+    """
+    from .git_utils import PyGitRepository
+    from .git_refs import find_git_directory
+    from .package_group import PackageGroup
+
+    packages = list()
+    for path in (os.path.abspath(x) for x in paths):
+        if from_registry:
+            from .registry import get_registry
+            for record in get_registry().find_by_prefix(path):
+                packages.append(PyGitRepository(pkg_name=record.pkg_name, ssh_path=record.ssh_path,
+                                                ticket_id=record.ticket_id, disk_path=record.disk_path))
+            continue
+
+        git_directory = find_git_directory(path)
+        if git_directory is not None:
+            package = PyGitRepository.from_path(path=git_directory.work_tree)
+            packages.append(package or PyGitRepository(pkg_name=os.path.basename(git_directory.work_tree),
+                                                       disk_path=git_directory.work_tree))
+            continue
+
+        packages.extend(PackageGroup.load(path))
+    return packages
+
+
+def run_registry(args):
+    """
+    Query and rescan the workspace registry of all the known checkouts
+    """
+    import json
+    from .registry import get_registry
+
+    registry = get_registry(db_path=args.db)
+    if args.registry_command == "rescan":
+        return registry.rescan(roots=[os.path.abspath(x) for x in args.args], full=args.full)
+
+    if args.registry_command == "find":
+        records = list()
+        for pkg_name in args.args:
+            records.extend(registry.find_by_name(pkg_name))
+    elif args.registry_command == "where":
+        path = args.args[0] if args.args else os.getcwd()
+        record = registry.find_containing(path)
+        records = [record] if record else list()
+    else:
+        records = registry.find_by_prefix(args.args[0]) if args.args else registry.all()
+
+    if args.json:
+        print(json.dumps([x.to_dict() for x in records], indent=2))
+    else:
+        for record in records:
+            print("{0:<30} {1:<20} {2}".format(record.pkg_name, record.branch or "", record.disk_path))
+    return bool(records)
+
+
+def _add_command(subparsers, name, function, **kwargs):
+    parser = subparsers.add_parser(name, help=function.__doc__.strip().splitlines()[0],
+                                   description=function.__doc__.strip(), **kwargs)
+    parser.set_defaults(function=function)
+    return parser
+
+
+def get_parser():
+    """
+    Build the argparse parser of all the commands
+    """
+    parser = argparse.ArgumentParser(prog="scm", description="Source code management tools")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    sub_parser = _add_command(subparsers, "clone", run_clone)
+    sub_parser.add_argument("package", nargs="*")
+    sub_parser.add_argument('-m', '--manifest', help="File with the package names to clone, one per line")
+    sub_parser.add_argument('-b', '--branch', help="Branch name, defaults to master",
+                            default=scm_constants.MASTER_BRANCH)
+    sub_parser.add_argument('-f', '--force', help="Override existing files", action="store_true", default=False)
+    sub_parser.add_argument('-j', '--jobs', type=int, help="Number of parallel clones",
+                            default=scm_constants.CLONE_JOBS)
+    sub_parser.add_argument('--depth', type=int, help="Shallow clone with only the last N commits", default=None)
+    sub_parser.add_argument('--filter', help="Partial clone: blobless, treeless or a git filter spec", default=None)
+    sub_parser.add_argument('--single_branch', help="Fetch only the history of the branch", action="store_true",
+                            default=False)
+    sub_parser.add_argument('--reference', default=None,
+                            help="Local repository to borrow objects from, '{0}' is the package name")
+    sub_parser.add_argument('--no_mirror', help="Clone straight from upstream, skip the host mirror cache",
+                            action="store_true", default=False)
+
+    sub_parser = _add_command(subparsers, "develop", run_develop)
+    sub_parser.add_argument("branch", nargs='?', default=scm_constants.DEVELOP_BRANCH)
+    sub_parser.add_argument("-s", "--source", help="Source branch to clone from", default=scm_constants.MASTER_BRANCH)
+    sub_parser.add_argument("-r", "--rebase", help="Do you want to rebase dev_branch", action="store_true",
+                            default=True)
+    sub_parser.add_argument("-d", "--description", help="Description note for the branch")
+    sub_parser.add_argument("-w", "--worktree", action="store_true", default=False,
+                            help="Create the branch in its own git worktree next to the checkout")
+    sub_parser.add_argument("--sparse", nargs="+", metavar="PATH", default=None,
+                            help="Only check out these directories in the worktree, implies --worktree")
+
+    sub_parser = _add_command(subparsers, "worktree", run_worktree)
+    sub_parser.add_argument("operation", choices=["list", "cleanup", "remove"],
+                            help="'cleanup' removes the worktrees whose branch is merged and which have no changes")
+    sub_parser.add_argument("branch", nargs="?", default=None, help="Branch or path of the worktree to remove")
+    sub_parser.add_argument("-d", "--directory", help="Path in the repository, defaults to the current directory",
+                            default=None)
+    sub_parser.add_argument("-f", "--force", action="store_true", default=False,
+                            help="Remove the worktree with its local changes and its unmerged branch")
+    sub_parser.add_argument("--keep_branch", action="store_true", default=False,
+                            help="Keep the branch of the removed worktree")
+    sub_parser.add_argument("--dry_run", action="store_true", default=False,
+                            help="Only report the finished worktrees cleanup would remove")
+
+    sub_parser = _add_command(subparsers, "rebase", run_rebase)
+    sub_parser.add_argument("-b", "--branch", default=scm_constants.MASTER_BRANCH)
+    sub_parser.add_argument("--fast", help="Single fetch and rebase onto origin/<branch> without switching branches",
+                            action="store_true", default=False)
+
+    sub_parser = _add_command(subparsers, "push", run_push)
+    sub_parser.add_argument("branches", nargs="*", help="Branches to push, defaults to the active branch")
+    sub_parser.add_argument("-pr", "--pull_request", action="store_true", default=False)
+    sub_parser.add_argument("-f", "--force", action="store_true", default=False)
+
+    sub_parser = _add_command(subparsers, "branch", run_branch)
+    sub_parser.add_argument("path", nargs="?", default=".", help="Path in the repository, defaults to the current one")
+
+    sub_parser = _add_command(subparsers, "install", run_install)
+    sub_parser.add_argument("projects", nargs="*",
+                            help="Projects to install in one run, defaults to the project of the current directory")
+    sub_parser.add_argument('-l', '--live', action="store_true", default=False)
+    sub_parser.add_argument('-f', '--force', action="store_true", default=False)
+    sub_parser.add_argument('-j', '--jobs', type=int, help="Number of parallel copy workers", default=None)
+    sub_parser.add_argument('--rollback', nargs='?', const="", default=None, metavar="VERSION",
+                            help="Make the previous (or given) release live again")
+    sub_parser.add_argument('--dedup', action="store_true", default=False,
+                            help="Link the files from the content-addressed object store")
+    sub_parser.add_argument('--gc', action="store_true", default=False,
+                            help="Remove the object store blobs which no install is using anymore")
+    sub_parser.add_argument('--no_compile', action="store_true", default=False,
+                            help="Skip the byte-compile stage of the install")
+    sub_parser.add_argument('--archive', action="store_true", default=False,
+                            help="Install the python package as a single zipimport archive")
+    sub_parser.add_argument('-w', '--watch', action="store_true", default=False,
+                            help="Keep watching the sources and install every change right away, Ctrl+C to stop")
+    sub_parser.add_argument('--dry_run', action="store_true", default=False,
+                            help="Only report what --gc would remove")
+
+    sub_parser = _add_command(subparsers, "group", run_group)
+    sub_parser.add_argument("operation", choices=["fetch", "rebase", "status", "push", "save"],
+                            help="Operation to run, 'save' writes the group file from the manifest/discovered packages")
+    sub_parser.add_argument('-d', '--directory', help="Group directory, defaults to the current directory",
+                            default=None)
+    sub_parser.add_argument('-m', '--manifest', help="File with the package names of the group, one per line")
+    sub_parser.add_argument('-b', '--branch', help="Rebase onto this branch instead of the group branches",
+                            default=None)
+    sub_parser.add_argument('-j', '--jobs', type=int, help="Number of parallel packages",
+                            default=scm_constants.GIT_JOBS)
+    sub_parser.add_argument("--fast", help="Single fetch and rebase onto origin/<branch> without switching branches",
+                            action="store_true", default=False)
+    sub_parser.add_argument('-f', '--force', help="Force push", action="store_true", default=False)
+    sub_parser.add_argument('--json', help="Print the results as json", action="store_true", default=False)
+
+    sub_parser = _add_command(subparsers, "status", run_status)
+    sub_parser.add_argument("path", nargs="*", help="Repositories or group directories, defaults to the current one")
+    sub_parser.add_argument('-u', '--untracked', help="Count the untracked files too (slow on big trees)",
+                            action="store_true", default=False)
+    sub_parser.add_argument('-r', '--registry', help="Check all the registered checkouts under the paths",
+                            action="store_true", default=False)
+    sub_parser.add_argument('-d', '--dirty_only', help="Only show the repositories with local work",
+                            action="store_true", default=False)
+    sub_parser.add_argument('-j', '--jobs', type=int, help="Number of parallel repositories",
+                            default=scm_constants.GIT_JOBS)
+    sub_parser.add_argument('--json', help="Print the status as json", action="store_true", default=False)
+
+    sub_parser = _add_command(subparsers, "registry", run_registry,
+                              usage="scm registry rescan [ROOT...] | find PKG... | where [PATH] | list [PREFIX]")
+    sub_parser.add_argument("registry_command", choices=["rescan", "find", "where", "list"], metavar="command")
+    sub_parser.add_argument("args", nargs="*", help="scan roots, package names or a path depending on the command")
+    sub_parser.add_argument('--db', help="Registry file, defaults to REGISTRY_FILE", default=None)
+    sub_parser.add_argument('--full', help="rescan: list every directory again, even the unchanged ones",
+                            action="store_true", default=False)
+    sub_parser.add_argument('--json', help="Print the checkouts as json", action="store_true", default=False)
+
+    for sub_parser in subparsers.choices.values():
+        add_profile_arguments(sub_parser)
+    return parser
+
+
+def main(argv=None, command=None):
+    """
+    Run the command line
+
+    :param argv:                `list`          arguments, defaults to sys.argv[1:]
+    :param command:             `str`           run this command with argv, used by the bin/scm_* shims
+    :return:                    `int`           exit code, 0 when the command succeeded
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if command:
+        argv.insert(0, command)
+
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, "function", None):
+        parser.print_help()
+        return 2
+
+    if args.profile:
+        from .command_runner import setup_profiling
+        setup_profiling(args)
+
+    try:
+        result = args.function(args)
+    finally:
+        # only if the command used the registry, importing it here would slow down the quick commands
+        registry_module = sys.modules.get(__name__.rsplit(".", 1)[0] + ".registry")
+        if registry_module is not None:
+            registry_module.close_registries()
+    return 0 if result is None or result else 1
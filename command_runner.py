@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+"""
+Instrumented command runner.
+
+Every external command (mostly git) of scm_tools goes through run_command(), which records the argv, cwd,
+wall time, exit code and output size of the command. The records can be written as plain json or as a
+Chrome trace (chrome://tracing, https://ui.perfetto.dev) with the --profile flag of the bin/scm_* scripts.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import select
+import signal
+import threading
+import subprocess
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+
+logger = get_logger(__name__)
+
+# timeout argument of the git functions meaning "the configured deadline of this kind of command"
+DEFAULT_TIMEOUT = object()
+READ_SIZE = 65536
+
+
+class CommandResult(object):
+    """
+    Result of run_command()
+    """
+    def __init__(self, exit_code, output=None, timed_out=False):
+        super(CommandResult, self).__init__()
+        self.exit_code = exit_code
+        self.output = output
+        self.timed_out = timed_out
+
+    def __repr__(self):
+        return "CommandResult({0}{1})".format(self.exit_code, ", timed out" if self.timed_out else "")
+
+    def __bool__(self):
+        return self.exit_code == 0
+
+    __nonzero__ = __bool__
+
+
+class CommandRecord(object):
+    """
+    Timing record of one command or step
+    """
+    def __init__(self, name, argv=None, cwd=None, start=None, duration=None, exit_code=None, output_size=0,
+                 category="command"):
+        super(CommandRecord, self).__init__()
+        self.name = name
+        self.argv = argv
+        self.cwd = cwd
+        self.start = start
+        self.duration = duration
+        self.exit_code = exit_code
+        self.output_size = output_size
+        self.category = category
+        self.thread_id = threading.current_thread().ident
+
+    def to_dict(self):
+        data_dict = OrderedDict()
+        data_dict["name"] = self.name
+        data_dict["category"] = self.category
+        data_dict["argv"] = self.argv
+        data_dict["cwd"] = self.cwd
+        data_dict["start"] = self.start
+        data_dict["duration"] = self.duration
+        data_dict["exit_code"] = self.exit_code
+        data_dict["output_size"] = self.output_size
+        data_dict["thread_id"] = self.thread_id
+        return data_dict
+
+
+class Profiler(object):
+    """
+    Collects the CommandRecord of all the commands run in this process
+
+    Intended Usages:
+        PROFILER.enable()
+        ...
+        PROFILER.write("profile.json", profile_format="chrome")
+    """
+    def __init__(self):
+        super(Profiler, self).__init__()
+        self.enabled = False
+        self.records = list()
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+
+    def enable(self):
+        self.enabled = True
+        self._start_time = time.time()
+
+    def add(self, record):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.records.append(record)
+
+    @contextmanager
+    def span(self, name, **details):
+        """
+        Record a python side step, eg: with PROFILER.span("install"): ...
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(CommandRecord(name=name, argv=details or None, start=start_time,
+                                   duration=time.time() - start_time, category="step"))
+
+    def to_json(self):
+        with self._lock:
+            return [x.to_dict() for x in self.records]
+
+    def to_chrome_trace(self):
+        """
+        Convert the records to the Chrome trace event format, complete ("X") events in microseconds.
+        """
+        events = list()
+        with self._lock:
+            records = list(self.records)
+
+        for record in records:
+            args = OrderedDict()
+            args["argv"] = " ".join(record.argv) if isinstance(record.argv, list) else record.argv
+            args["cwd"] = record.cwd
+            args["exit_code"] = record.exit_code
+            args["output_size"] = record.output_size
+            events.append(OrderedDict([
+                ("name", record.name),
+                ("cat", record.category),
+                ("ph", "X"),
+                ("ts", int((record.start - self._start_time) * 1e6)),
+                ("dur", int(record.duration * 1e6)),
+                ("pid", os.getpid()),
+                ("tid", record.thread_id),
+                ("args", args),
+            ]))
+        return OrderedDict([("traceEvents", events), ("displayTimeUnit", "ms")])
+
+    def write(self, file_path, profile_format=None):
+        """
+        Write the profile to given file
+
+        :param file_path:           `str`           output json file
+        :param profile_format:      `str`           "json" or "chrome", defaults to PROFILE_FORMAT
+        """
+        profile_format = profile_format or scm_constants.PROFILE_FORMAT
+        data = self.to_chrome_trace() if profile_format == "chrome" else self.to_json()
+        with open(file_path, "w") as write_file:
+            json.dump(data, write_file, indent=2)
+        logger.info("Profile with {0} record(s) written to '{1}'".format(len(self.records), file_path))
+
+    def summary(self):
+        """
+        :return:                    `list`          (name, count, total seconds) sorted by total time
+        """
+        totals = dict()
+        with self._lock:
+            for record in self.records:
+                count, total = totals.get(record.name, (0, 0.0))
+                totals[record.name] = (count + 1, total + record.duration)
+        return sorted(((x, y[0], y[1]) for x, y in totals.items()), key=lambda x: -x[2])
+
+
+# process wide profiler used by all the commands
+PROFILER = Profiler()
+
+
+def enable_profiling(file_path, profile_format=None):
+    """
+    Enable the profiler and write the profile to given file when the process exits
+    """
+    PROFILER.enable()
+    atexit.register(PROFILER.write, file_path, profile_format)
+
+
+def setup_profiling(args):
+    """
+    Enable the profiling if asked on the command line, args are the parsed argparse arguments
+    """
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile, profile_format=getattr(args, "profile_format", None))
+
+
+def run_command(args, cwd=None, capture=False, log_output=True, prefix=None, env=None, timeout=None):
+    """
+    Run the command, log its output line by line and record its timings.
+    Never changes the process cwd, so it is safe to use from multiple threads.
+
+    :param args:                `list`          command and its arguments
+    :param cwd:                 `str`           directory to run the command in, defaults to os.getcwd()
+    :param capture:             `bool`          return the output text in the result
+    :param log_output:          `bool`          log every output line
+    :param prefix:              `str`           prefix for every logged line, eg: the package name
+    :param env:                 `dict`          environment of the command, defaults to os.environ
+    :param timeout:             `int`           kill the command after this many seconds, None waits forever
+    :return:                    `CommandResult`
+    """
+    cwd = cwd or os.getcwd()
+    line_prefix = "[{0}] ".format(prefix) if prefix else ""
+    if log_output:
+        logger.info("{0}Running: '{1}' ".format(line_prefix, " ".join(args)))
+
+    start_time = time.time()
+    new_session = bool(timeout) and use_new_session()
+    try:
+        process = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT if log_output else subprocess.PIPE,
+                                   **_get_session_options(new_session))
+    except OSError as e:
+        logger.error("{0}Failed to run '{1}' : {2}".format(line_prefix, args[0], e))
+        PROFILER.add(CommandRecord(name=_record_name(args), argv=list(args), cwd=cwd, start=start_time,
+                                   duration=time.time() - start_time, exit_code=-1))
+        return CommandResult(exit_code=-1, output="" if capture else None)
+
+    timed_out = list()
+    timer = None
+    if timeout and os.name == "posix":
+        exit_code, output_size, output_lines = _read_output_until(process, capture, log_output, line_prefix,
+                                                                  start_time + timeout, new_session, timed_out)
+    else:
+        if timeout:
+            timer = threading.Timer(timeout, _kill_on_timeout, args=(process, new_session, timed_out))
+            timer.daemon = True
+            timer.start()
+        try:
+            exit_code, output_size, output_lines = _read_output(process, capture, log_output, line_prefix)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    if timed_out:
+        logger.error("{0}'{1}' timed out after {2}s and was killed".format(line_prefix, " ".join(args), timeout))
+
+    PROFILER.add(CommandRecord(name=_record_name(args), argv=list(args), cwd=cwd, start=start_time,
+                               duration=time.time() - start_time, exit_code=exit_code, output_size=output_size))
+    return CommandResult(exit_code=exit_code, output="".join(output_lines) if capture else None,
+                         timed_out=bool(timed_out))
+
+
+def _read_output(process, capture, log_output, line_prefix):
+    output_size = 0
+    output_lines = list()
+    if log_output:
+        for line in iter(process.stdout.readline, b""):
+            output_size += len(line)
+            line = line.decode("utf-8", "replace")
+            if capture:
+                output_lines.append(line)
+            logger.info("{0}{1}".format(line_prefix, line.rstrip()))
+        process.stdout.close()
+        exit_code = process.wait()
+    else:
+        stdout, _stderr = process.communicate()
+        output_size = len(stdout)
+        if capture:
+            output_lines.append(stdout.decode("utf-8", "replace"))
+        exit_code = process.returncode
+    return exit_code, output_size, output_lines
+
+
+def _read_output_until(process, capture, log_output, line_prefix, deadline, new_session, timed_out):
+    # the output is only read until the deadline. Without a session of its own (interactive terminal), killing
+    # git leaves its ssh running with the output pipe open, reading until the end of the pipe would block
+    stdout_fd = process.stdout.fileno()
+    open_fds = [x.fileno() for x in (process.stdout, process.stderr) if x is not None]
+    chunks = list()
+    pending = b""
+    while open_fds:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            timed_out.append(True)
+            kill_process(process, new_session=new_session)
+            break
+
+        for fd in select.select(open_fds, [], [], remaining)[0]:
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                open_fds.remove(fd)
+            elif fd == stdout_fd:
+                chunks.append(data)
+                if log_output:
+                    lines = (pending + data).split(b"\n")
+                    pending = lines.pop()
+                    for line in lines:
+                        logger.info("{0}{1}".format(line_prefix, line.decode("utf-8", "replace").rstrip()))
+
+    if log_output and pending:
+        logger.info("{0}{1}".format(line_prefix, pending.decode("utf-8", "replace").rstrip()))
+
+    for stream in (process.stdout, process.stderr):
+        if stream is not None:
+            stream.close()
+    exit_code = process.wait()
+
+    output = b"".join(chunks)
+    return exit_code, len(output), [output.decode("utf-8", "replace")] if capture else list()
+
+
+def use_new_session():
+    """
+    Start the commands with a deadline in their own session, so the timeout kills the ssh and other helpers of
+    git too. Only done without a terminal, the password prompts of the interactive sessions need the tty.
+    """
+    if not hasattr(os, "setsid"):
+        return False
+    return not (sys.stdin and sys.stdin.isatty())
+
+
+def _get_session_options(new_session):
+    if not new_session:
+        return dict()
+    if sys.version_info[0] >= 3:
+        return {"start_new_session": True}
+    return {"preexec_fn": os.setsid}
+
+
+def kill_process(process, new_session=False):
+    """
+    Kill the process, the whole session if it was started with use_new_session()
+    """
+    try:
+        if new_session:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        # already finished
+        pass
+
+
+def _kill_on_timeout(process, new_session, timed_out):
+    timed_out.append(True)
+    kill_process(process, new_session=new_session)
+
+
+def run_git(args, cwd=None, **kwargs):
+    """
+    Run a git command, see run_command(). Local commands have no deadline, the commands talking to a remote
+    are given GIT_COMMAND_TIMEOUT or GIT_CLONE_TIMEOUT by their callers.
+
+    :param args:                `list`          git arguments, eg: ["fetch", "origin"]
+    :return:                    `CommandResult`
+    """
+    return run_command(["git"] + list(args), cwd=cwd, **kwargs)
+
+
+def get_timeout(timeout, default):
+    """
+    Resolve the timeout argument of the git functions
+
+    :param timeout:             `int`           seconds, None for no deadline or DEFAULT_TIMEOUT
+    :param default:             `int`           deadline used for DEFAULT_TIMEOUT, eg: GIT_COMMAND_TIMEOUT
+    :return:                    `int`           seconds, None for no deadline
+    """
+    return default if timeout is DEFAULT_TIMEOUT else timeout
+
+
+def _record_name(args):
+    if os.path.basename(args[0]) == "git" and len(args) > 1:
+        return "git {0}".format(args[1])
+    if args[0] == sys.executable and len(args) > 1:
+        return "python {0}".format(os.path.basename(args[1]))
+    return os.path.basename(args[0])
@@ -4,45 +4,70 @@
 General Utility module for SCM_TOOLS
 """
 import os
+import threading
 from logIO import get_logger
 from my_python.system import file_manager
 
 from . import constants as scm_constants
+from .manifest import InstallManifest, InstallSummary, get_file_hash
+from .copy_engine import ParallelCopier
+from .ignore_matcher import IgnoreMatcher, get_default_matcher
+from .link_strategies import FileInstaller
+from . import releases
+from .object_store import ObjectStore
+from .bytecode import compile_install
+from .archives import build_archive
 
 logger = get_logger(__name__)
 
 
 def is_valid_path(file_path):
     """
-    Check if the given path is any of the invalid file type in the given constants.py
+    Check if the given path or any of its directories matches the ignore patterns in the given constants.py
 
     :param file_path:           `str`           abs file path
     :return:                    `bool`          returns True if is valid file otherwise False
     """
-    if os.path.isfile(file_path):
-        ext = os.path.splitext(file_path)[-1]
-        if ext in scm_constants.INVALID_FORMATS:
-            return False
+    return not get_default_matcher().is_ignored_component(file_path)
 
-    for token in scm_constants.INVALID_FORMATS:
-        if token == str(file_path):
-            return False
 
-        if token in str(file_path):
-            return False
-
-    return True
+def _remove_empty_parents(path, stop_at):
+    """
+    Remove the empty directories from path upwards until stop_at directory.
+    """
+    stop_at = os.path.abspath(stop_at)
+    path = os.path.abspath(path)
+    # with the separator, so /builds/pkg_old is not inside /builds/pkg
+    stop_prefix = stop_at.rstrip(os.sep) + os.sep
+    while path.startswith(stop_prefix) and os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
 
 
-def scm_install_package(source, for_qc=False, override=False):
+def scm_install_package(source, for_qc=False, override=False, jobs=None, install_root=None, link_mode=None,
+                        versioned=None, dedup=None, compile_bytecode=None, build_format=None, file_installer=None):
     """
     Compile the source code and generate a skeleton for production use.
-    This method will take your active directory and
+    This method will take your active directory and install only the files which are new or changed
+    since the last install, files removed from the source are removed from the build as well.
 
-    :param source:                                  s
-    :param for_qc:
-    :param override:            `bool`              Override old files.?
-    :return:
+    With versioned installs the files are staged into a new release directory and made live
+    with an atomic symlink swap, see releases.py
+
+    The "archive" build format writes the package into a single zipimport archive instead, see archives.py
+
+    :param source:              `str`               source directory of the python package
+    :param for_qc:              `bool`              Install as symlink in the testing directory
+    :param override:            `bool`              Override old files.? Ignores the install manifest
+    :param jobs:                `int`               number of parallel copy workers
+    :param install_root:        `str`               install directory, defaults to PY_BUILDS_DIR
+    :param link_mode:           `str`               install strategy (constants.LINK_MODES), defaults to auto
+    :param versioned:           `bool`              stage into a versioned release, defaults to VERSIONED_INSTALLS
+    :param dedup:               `bool`              link the files from the object store, defaults to DEDUP_INSTALLS
+    :param compile_bytecode:    `bool`              byte-compile the changed files, defaults to COMPILE_BYTECODE
+    :param build_format:        `str`               "tree" or "archive", defaults to BUILD_FORMAT
+    :param file_installer:      `FileInstaller`     shared installer of a batch install, see installer.py
+    :return:                    `InstallSummary`    summary of copied, skipped and removed files
     """
     if for_qc:
         # if user asked for installing the package just in the test suite,
@@ -53,25 +78,136 @@ def scm_install_package(source, for_qc=False, override=False):
         return True
 
     # Let's build and install everything in the PY_BUILDS directory
-    installation_path = os.path.join(scm_constants.PY_BUILDS_DIR, os.path.basename(source))
+    install_root = install_root or scm_constants.PY_BUILDS_DIR
+    build_format = build_format or scm_constants.BUILD_FORMAT
+    if build_format not in scm_constants.BUILD_FORMATS:
+        raise ValueError("Invalid build format '{0}', expected one of {1}".format(build_format,
+                                                                              scm_constants.BUILD_FORMATS))
+    if build_format == "archive":
+        return build_archive(source=source, install_root=install_root, jobs=jobs, compile_bytecode=compile_bytecode)
+
+    installation_path = os.path.join(install_root, os.path.basename(source))
+    versioned = scm_constants.VERSIONED_INSTALLS if versioned is None else versioned
+    dedup = scm_constants.DEDUP_INSTALLS if dedup is None else dedup
+    store = ObjectStore.for_install_root(install_root) if dedup else None
+
+    if versioned:
+        staging_path = releases.stage_release(package_path=installation_path, source=source, seed=not override)
+        summary = install_tree(source=source, installation_path=staging_path, override=override, jobs=jobs,
+                               link_mode=link_mode, store=store, compile_bytecode=compile_bytecode,
+                               file_installer=file_installer)
+        if summary.failed:
+            releases.discard_release(staging_path)
+            return summary
+
+        summary.release = releases.activate_release(package_path=installation_path, release_path=staging_path)
+        releases.cleanup_releases(package_path=installation_path)
+        return summary
+
+    if os.path.islink(installation_path):
+        # left over from a live (for_qc) or versioned install, never write through it
+        os.remove(installation_path)
+
+    return install_tree(source=source, installation_path=installation_path, override=override, jobs=jobs,
+                        link_mode=link_mode, store=store, compile_bytecode=compile_bytecode,
+                        file_installer=file_installer)
+
+
+def install_tree(source, installation_path, override=False, jobs=None, link_mode=None, store=None,
+                 compile_bytecode=None, file_installer=None):
+    """
+    Install the source directory to the installation_path, using the install manifest of installation_path
+    so that only new or changed files are copied and deleted files are removed.
+
+    :param source:              `str`               source directory of the python package
+    :param installation_path:   `str`               directory to install into
+    :param override:            `bool`              Copy everything, the manifest is only used to remove files
+    :param jobs:                `int`               number of parallel copy workers
+    :param link_mode:           `str`               install strategy (constants.LINK_MODES), defaults to auto
+    :param store:               `ObjectStore`       link the files from this object store instead of copying
+    :param compile_bytecode:    `bool`              byte-compile the changed files, defaults to COMPILE_BYTECODE
+    :param file_installer:      `FileInstaller`     shared installer, its owner reports the strategies used
+    :return:                    `InstallSummary`    summary of copied, skipped and removed files
+    """
+    compile_bytecode = scm_constants.COMPILE_BYTECODE if compile_bytecode is None else compile_bytecode
     if not os.path.isdir(installation_path):
         os.makedirs(installation_path)
 
-    for root, dirs, files in os.walk(source):
-        if not is_valid_path(file_path=root):
+    # override copies every file again, the old manifest is still needed to remove the deleted ones
+    old_manifest = InstallManifest.load(install_dir=installation_path)
+    new_manifest = InstallManifest(install_dir=installation_path)
+    summary = InstallSummary()
+    source_files = set()
+    matcher = IgnoreMatcher.for_source(source)
+    # the copy workers and the walk both record into new_manifest and summary
+    results_lock = threading.Lock()
+
+    def _on_copied(src_path, dst_path, result):
+        rel_path = os.path.relpath(dst_path, installation_path)
+        stat = os.stat(src_path)
+        # the object store already hashed the file, don't read it again
+        file_hash = result if store else get_file_hash(src_path)
+        with results_lock:
+            new_manifest.add(rel_path=rel_path, size=stat.st_size, mtime=stat.st_mtime, file_hash=file_hash)
+            summary.copied.append(rel_path)
+
+    shared_installer = file_installer is not None and store is None
+    file_installer = store or file_installer or FileInstaller(link_mode=link_mode)
+    with ParallelCopier(jobs=jobs, copy_function=file_installer) as copier:
+        for root, dirs, files in os.walk(source):
+            matcher.prune(root=root, dirs=dirs, files=files)
+
+            dest_dir = os.path.join(installation_path, os.path.relpath(root, source))
+            for each_file in files:
+                file_path = os.path.join(root, each_file)
+                if matcher.is_ignored(file_path):
+                    continue
+
+                rel_path = os.path.relpath(file_path, source)
+                source_files.add(rel_path)
+
+                if not override and old_manifest.is_unchanged(rel_path=rel_path, src_path=file_path):
+                    with results_lock:
+                        new_manifest.add_from_source(rel_path=rel_path, src_path=file_path,
+                                                     file_hash=old_manifest.get(rel_path)["hash"])
+                        summary.skipped.append(rel_path)
+                    continue
+
+                # directories are created here in the walk so the workers never race on them
+                if not os.path.isdir(dest_dir):
+                    os.makedirs(dest_dir)
+
+                logger.debug("Installing : '{0}'".format(rel_path))
+                copier.submit(src_path=file_path, dst_path=os.path.join(installation_path, rel_path),
+                              callback=_on_copied)
+
+    summary.failed = copier.errors
+    copier.report_errors()
+    if not shared_installer:
+        file_installer.report()
+
+    for rel_path in old_manifest:
+        if rel_path in source_files:
             continue
 
-        for each_file in files:
-            if not is_valid_path(file_path=each_file):
-                continue
+        dest_path = os.path.join(installation_path, rel_path)
+        logger.debug("Removing : '{0}'".format(rel_path))
+        if os.path.isfile(dest_path):
+            os.remove(dest_path)
+            _remove_empty_parents(path=os.path.dirname(dest_path), stop_at=installation_path)
+        summary.removed.append(rel_path)
 
-            file_path = os.path.join(root, each_file)
-            dest_path = file_path.replace(source, installation_path)
-            logger.debug("Installing : '{0}'".format(each_file))
-            file_manager.copy_files(src_path=file_path, dst_path=dest_path)
+    if compile_bytecode:
+        summary.bytecode = compile_install(installation_path=installation_path, changed=summary.copied,
+                                           removed=summary.removed)
 
+    new_manifest.save()
+    summary.report(name=os.path.basename(source))
+    return summary
 
-def scm_install_bin_files(bin_directory, for_qc=False, override=False):
+
+def scm_install_bin_files(bin_directory, for_qc=False, override=False, jobs=None, install_dir=None, link_mode=None,
+                          dedup=None, file_installer=None):
     """
     Compile the source code and generate a skeleton for production use.
     This method will take your active directory and
@@ -79,35 +215,48 @@ def scm_install_bin_files(bin_directory, for_qc=False, override=False):
     :param bin_directory:                                  s
     :param for_qc:
     :param override:            `bool`              Override old files.?
+    :param jobs:                `int`               number of parallel copy workers
+    :param install_dir:         `str`               install directory, defaults to BIN_BUILDS_DIR/BIN_TESTING_DIR
+    :param link_mode:           `str`               install strategy (constants.LINK_MODES), defaults to auto
+    :param dedup:               `bool`              link the files from the object store, defaults to DEDUP_INSTALLS
+    :param file_installer:      `FileInstaller`     shared installer of a batch install, see installer.py
     :return:
     """
     if not os.path.isdir(bin_directory):
         logger.warning("Expected a bin/script directory. Found file.!")
         return False
 
-    install_dir = scm_constants.BIN_TESTING_DIR if for_qc else scm_constants.BIN_BUILDS_DIR
+    if not install_dir:
+        install_dir = scm_constants.BIN_TESTING_DIR if for_qc else scm_constants.BIN_BUILDS_DIR
+
+    dedup = scm_constants.DEDUP_INSTALLS if dedup is None else dedup
+    if dedup:
+        file_installer = ObjectStore.for_install_root(install_dir)
+    else:
+        file_installer = file_installer or FileInstaller(link_mode=link_mode)
 
     existing_files = list()
-    for bin_file in os.listdir(bin_directory):
-        src_file_path = os.path.join(bin_directory, bin_file)
-        dst_file_path = os.path.join(install_dir, bin_file)
+    with ParallelCopier(jobs=jobs, copy_function=file_installer) as copier:
+        for bin_file in os.listdir(bin_directory):
+            src_file_path = os.path.join(bin_directory, bin_file)
+            dst_file_path = os.path.join(install_dir, bin_file)
 
-        if os.path.exists(dst_file_path) and not override:
-            existing_files.append(dst_file_path)
-            continue
+            if os.path.exists(dst_file_path) and not override:
+                existing_files.append(dst_file_path)
+                continue
 
-        if for_qc:
-            logger.info("Installing for testing: '{0}' >>> '{1}' ".format(src_file_path, dst_file_path))
-            file_manager.create_symlinks(source=src_file_path, destination=dst_file_path)
-        else:
-            logger.info("Installing package: '{0}' >>> '{1}' ".format(src_file_path, dst_file_path))
-            file_manager.copy_files(src_path=src_file_path, dst_path=dst_file_path)
+            if for_qc:
+                logger.info("Installing for testing: '{0}' >>> '{1}' ".format(src_file_path, dst_file_path))
+                file_manager.create_symlinks(source=src_file_path, destination=dst_file_path)
+            else:
+                logger.info("Installing package: '{0}' >>> '{1}' ".format(src_file_path, dst_file_path))
+                copier.submit(src_path=src_file_path, dst_path=dst_file_path)
 
     if existing_files:
         msg = "File(s) already exists in the destination place. Please use force/override command to overwrite them."
         logger.info(msg)
 
-    return True
+    return copier.report_errors()
 
 
 if __name__ == "__main__":
@@ -11,6 +11,102 @@ BASE_URL = "git@github.com:arjun-namdeo/{0}.git"
 MASTER_BRANCH = "master"
 DEVELOP_BRANCH = "develop"
 
-INVALID_FORMATS = [".pyc", ".gitignore", ".ini", ".idea", ".git"]
+# glob patterns (.gitignore syntax) skipped by the installs, see ignore_matcher.py
+IGNORE_PATTERNS = ["*.pyc", "__pycache__/", ".gitignore", "*.ini", ".idea", ".git"]
+GIT_IGNORE_FILE = ".gitignore"
 ACTIVE_BRANCH_MARK = "* "
 PACKAGE_CONFIG_FILE = ".scmconf"
+
+# install manifest
+INSTALL_MANIFEST_FILE = ".scm_manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# parallel copy
+DEFAULT_COPY_JOBS = 8
+COPY_QUEUE_FACTOR = 4
+
+# install strategies, see link_strategies.py
+LINK_MODE_AUTO = "auto"
+LINK_MODE_HARDLINK = "hardlink"
+LINK_MODE_REFLINK = "reflink"
+LINK_MODE_COPY_FILE_RANGE = "copy_file_range"
+LINK_MODE_SENDFILE = "sendfile"
+LINK_MODE_COPY = "copy"
+LINK_MODES = [LINK_MODE_AUTO, LINK_MODE_HARDLINK, LINK_MODE_REFLINK, LINK_MODE_COPY_FILE_RANGE,
+              LINK_MODE_SENDFILE, LINK_MODE_COPY]
+
+# versioned releases, see releases.py
+VERSIONED_INSTALLS = True
+RELEASES_DIR_NAME = ".releases"
+RELEASE_RETENTION = 5
+STALE_STAGING_SECONDS = 24 * 60 * 60
+
+# content-addressed object store, see object_store.py
+DEDUP_INSTALLS = False
+OBJECT_STORE_DIR_NAME = ".objects"
+GC_GRACE_SECONDS = 60 * 60
+
+# concurrent clones
+CLONE_JOBS = 8
+CLONE_FILTERS = {"blobless": "blob:none", "treeless": "tree:0"}
+
+# host level mirror cache, see mirror_cache.py
+USE_MIRROR_CACHE = True
+MIRROR_CACHE_DIR = "/var/tmp/scm_tools/mirrors"
+MIRROR_REFRESH_SECONDS = 5 * 60
+
+# rebase
+FAST_REBASE = False
+REBASE_UP_TO_DATE = "up-to-date"
+REBASE_REBASED = "rebased"
+REBASE_CONFLICT = "conflict"
+REBASE_FAILED = "failed"
+
+# profiling of the external commands, "chrome" trace events or plain "json" records
+PROFILE_FORMAT = "chrome"
+
+# deadline in seconds of the git commands talking to a remote (fetch, push, ls-remote), a hung remote fails
+# instead of blocking forever. None disables it
+GIT_COMMAND_TIMEOUT = 1800
+# deadline of the clones, a large repository can take hours so there is none by default
+GIT_CLONE_TIMEOUT = None
+# number of concurrent git operations of the async api
+GIT_JOBS = 8
+
+# package groups, the member list of a group directory
+PACKAGE_GROUP_FILE = ".scmgroup"
+
+# workspace registry of all the known checkouts, see registry.py
+USE_REGISTRY = True
+REGISTRY_FILE = "~/.scm_tools/registry.sqlite"
+
+# status, use the builtin fsmonitor of git where it is available (git >= 2.36 on macOS/Windows)
+STATUS_USE_FSMONITOR = True
+
+# byte-compile stage of the installs, see bytecode.py
+COMPILE_BYTECODE = True
+# "checked-hash", "unchecked-hash" or "timestamp", hash based pycs need python >= 3.7
+PYC_INVALIDATION_MODE = "checked-hash"
+# worker processes, None uses all the cpu cores
+COMPILE_JOBS = None
+
+# build format of scm_install_package, "tree" (a directory) or "archive" (one zipimport file), see archives.py
+BUILD_FORMAT = "tree"
+BUILD_FORMATS = ("tree", "archive")
+ARCHIVES_DIR_NAME = ".archives"
+# the archive is immutable, so the pycs in it never need to check their source
+ARCHIVE_INVALIDATION_MODE = "unchecked-hash"
+
+# ticket worktrees of scm develop --worktree, created in <checkout><WORKTREE_DIR_SUFFIX>/<branch>, see worktrees.py
+WORKTREE_DIR_SUFFIX = "-worktrees"
+
+# watch mode of scm install, see watcher.py
+# a batch of changes is applied once the source was quiet for this long
+WATCH_DEBOUNCE_SECONDS = 0.2
+# scan interval where inotify is not available
+WATCH_POLL_SECONDS = 1.0
+
+# in-process installs, see installer.py
+# sha1 of the package_setup.py templates released before the install api, a project with any other
+# package_setup.py (besides the current template) is installed by running it
+STOCK_PACKAGE_SETUP_HASHES = ("a1aea3f78a3d3a36aa4814015685353b493fb1cd",)
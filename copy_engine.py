@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parallel copy engine for the package and bin installs.
+
+The directory walk feeds a bounded queue and a pool of worker threads does the copies,
+on network storage most of the install time is per-file latency so the workers overlap it.
+"""
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from logIO import get_logger
+from my_python.system import file_manager
+
+from . import constants as scm_constants
+
+logger = get_logger(__name__)
+
+_STOP = object()
+
+
+class CopyError(object):
+    """
+    Failed copy job
+    """
+    def __init__(self, src_path, dst_path, error):
+        super(CopyError, self).__init__()
+        self.src_path = src_path
+        self.dst_path = dst_path
+        self.error = error
+
+    def __repr__(self):
+        return "'{0}' >>> '{1}' : {2}".format(self.src_path, self.dst_path, self.error)
+
+
+class ParallelCopier(object):
+    """
+    Bounded worker pool for copying files
+
+    Intended Usages:
+        with ParallelCopier(jobs=8) as copier:
+            for src, dst in files:
+                copier.submit(src, dst)
+        copier.report_errors()
+    """
+    def __init__(self, jobs=None, copy_function=None):
+        super(ParallelCopier, self).__init__()
+        self.jobs = max(1, int(jobs or scm_constants.DEFAULT_COPY_JOBS))
+        self.copy_function = copy_function or file_manager.copy_files
+        self.errors = list()
+
+        self._queue = queue.Queue(maxsize=self.jobs * scm_constants.COPY_QUEUE_FACTOR)
+        self._lock = threading.Lock()
+        self._workers = list()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.join()
+        return False
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        for index in range(self.jobs):
+            worker = threading.Thread(target=self._worker, name="scm-copy-{0}".format(index))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, src_path, dst_path, callback=None):
+        """
+        Add a copy job, blocks if the queue is full so the walk never runs too far ahead of the workers.
+
+        :param src_path:            `str`           abs source file path
+        :param dst_path:            `str`           abs destination file path
+        :param callback:            `callable`      called with (src_path, dst_path, result) in the worker after
+                                                        the copy, result is the copy_function return value
+        """
+        if not self._workers:
+            self.start()
+        self._queue.put((src_path, dst_path, callback))
+
+    def join(self):
+        """
+        Wait for all the submitted jobs and stop the workers
+
+        :return:                    `list`          list of CopyError for all failed jobs
+        """
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self._workers = list()
+        return self.errors
+
+    def report_errors(self):
+        """
+        Log all the failed copies, returns True if there was none
+        """
+        if not self.errors:
+            return True
+
+        logger.error("{0} file(s) failed to install:".format(len(self.errors)))
+        for error in self.errors:
+            logger.error("    {0}".format(error))
+        return False
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+
+            src_path, dst_path, callback = job
+            try:
+                result = self.copy_function(src_path, dst_path)
+                if callback:
+                    callback(src_path, dst_path, result)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append(CopyError(src_path=src_path, dst_path=dst_path, error=e))
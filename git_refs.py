@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+Native git ref reader.
+
+Resolves HEAD, the loose refs under refs/heads and the packed-refs file directly from the git directory,
+without starting a git process. Worktrees (.git file + commondir) and a detached HEAD are supported.
+If the repository can't be read natively (eg: reftable ref storage), a single batched
+'git for-each-ref' call is used instead.
+"""
+import os
+
+from logIO import get_logger
+
+from .command_runner import run_git
+
+logger = get_logger(__name__)
+
+HEADS_PREFIX = "refs/heads/"
+SYMREF_PREFIX = "ref: "
+GITDIR_PREFIX = "gitdir: "
+INVALID_HEAD_REF = "refs/heads/.invalid"
+# state directories of a stopped rebase, merge backend and apply backend
+REBASE_STATE_DIRS = ("rebase-merge", "rebase-apply")
+
+
+class GitRefError(Exception):
+    """
+    Raised when the refs can't be read natively
+    """
+
+
+class GitDirectory(object):
+    """
+    Paths of a git repository or worktree
+
+        *   git_dir         per worktree directory, has HEAD
+        *   common_dir      shared directory, has refs/ and packed-refs
+    """
+    def __init__(self, work_tree, git_dir, common_dir=None):
+        super(GitDirectory, self).__init__()
+        self.work_tree = work_tree
+        self.git_dir = git_dir
+        self.common_dir = common_dir or git_dir
+
+    def __repr__(self):
+        return "GitDirectory('{0}')".format(self.git_dir)
+
+    @property
+    def head_file(self):
+        return os.path.join(self.git_dir, "HEAD")
+
+    @property
+    def packed_refs_file(self):
+        return os.path.join(self.common_dir, "packed-refs")
+
+    @property
+    def heads_dir(self):
+        return os.path.join(self.common_dir, "refs", "heads")
+
+    @property
+    def is_worktree(self):
+        return self.git_dir != self.common_dir
+
+
+def find_git_directory(path=None):
+    """
+    Find the git directory for the given path or os.getcwd(), walking up to the work tree root.
+
+    :param path:                `str`               any path inside the work tree
+    :return:                    `GitDirectory`      None if the path is not inside a git work tree
+    """
+    path = os.path.abspath(path or os.getcwd())
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return GitDirectory(work_tree=path, git_dir=dot_git, common_dir=_read_common_dir(dot_git))
+
+        if os.path.isfile(dot_git):
+            # worktree or submodule, the .git file points to the real git directory
+            with open(dot_git, "r") as read_file:
+                content = read_file.read().strip()
+            if content.startswith(GITDIR_PREFIX):
+                git_dir = content[len(GITDIR_PREFIX):].strip()
+                git_dir = os.path.normpath(os.path.join(path, git_dir))
+                return GitDirectory(work_tree=path, git_dir=git_dir, common_dir=_read_common_dir(git_dir))
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _read_common_dir(git_dir):
+    file_path = os.path.join(git_dir, "commondir")
+    if not os.path.isfile(file_path):
+        return git_dir
+
+    with open(file_path, "r") as read_file:
+        common_dir = read_file.read().strip()
+    return os.path.normpath(os.path.join(git_dir, common_dir))
+
+
+def read_head(git_directory):
+    """
+    Read the HEAD of the git directory
+
+    :param git_directory:       `GitDirectory`
+    :return:                    `tuple`         ("ref", "refs/heads/<name>") or ("detached", "<sha>")
+    """
+    try:
+        with open(git_directory.head_file, "r") as read_file:
+            content = read_file.read().strip()
+    except (IOError, OSError) as e:
+        raise GitRefError("Can't read HEAD: {0}".format(e))
+
+    if content.startswith(SYMREF_PREFIX):
+        ref_name = content[len(SYMREF_PREFIX):].strip()
+        if ref_name == INVALID_HEAD_REF:
+            # reftable (or any other non file based) ref storage
+            raise GitRefError("Refs are not stored as files")
+        return "ref", ref_name
+
+    if len(content) >= 40:
+        return "detached", content
+
+    raise GitRefError("Invalid HEAD: '{0}'".format(content))
+
+
+def read_packed_refs(git_directory, prefix=HEADS_PREFIX):
+    """
+    Read the packed-refs file
+
+    :param git_directory:       `GitDirectory`
+    :param prefix:              `str`           only the refs starting with this prefix
+    :return:                    `dict`          {refname: sha}
+    """
+    refs = dict()
+    if not os.path.isfile(git_directory.packed_refs_file):
+        return refs
+
+    with open(git_directory.packed_refs_file, "r") as read_file:
+        for line in read_file:
+            if not line or line[0] in "#^":
+                continue
+
+            parts = line.split()
+            if len(parts) == 2 and parts[1].startswith(prefix):
+                refs[parts[1]] = parts[0]
+    return refs
+
+
+def read_loose_refs(git_directory, prefix=HEADS_PREFIX):
+    """
+    Read the loose refs, branch names with '/' are nested directories
+
+    :param git_directory:       `GitDirectory`
+    :param prefix:              `str`           only the refs starting with this prefix
+    :return:                    `dict`          {refname: sha}
+    """
+    refs = dict()
+    refs_root = os.path.join(git_directory.common_dir, *prefix.rstrip("/").split("/"))
+    for root, dirs, files in os.walk(refs_root):
+        for each_file in files:
+            if each_file.endswith(".lock"):
+                continue
+
+            file_path = os.path.join(root, each_file)
+            rel_name = os.path.relpath(file_path, refs_root).replace(os.sep, "/")
+            with open(file_path, "r") as read_file:
+                refs[prefix + rel_name] = read_file.read().strip()
+    return refs
+
+
+def read_local_branches(git_directory):
+    """
+    Get all the local branch names, loose refs override the packed ones
+
+    :param git_directory:       `GitDirectory`
+    :return:                    `dict`          {branch_name: sha}
+    """
+    refs = read_packed_refs(git_directory)
+    refs.update(read_loose_refs(git_directory))
+    return dict((name[len(HEADS_PREFIX):], sha) for name, sha in refs.items())
+
+
+def get_branch_state(directory_path=None, with_branches=True):
+    """
+    Get the active branch and all local branches of the repository at directory_path or os.getcwd().
+    Reads the refs natively and falls back to one 'git for-each-ref' call if that's not possible.
+
+    :param directory_path:      `str`           any path inside the work tree
+    :param with_branches:       `bool`          list the local branches too, only HEAD is read otherwise
+    :return:                    `tuple`         (active_branch, [branch names]), (None, []) if not a git repo.
+                                                active_branch is "(HEAD detached at <sha>)" for a detached HEAD
+    """
+    directory_path = directory_path or os.getcwd()
+    git_directory = find_git_directory(directory_path)
+    if git_directory is None:
+        return None, list()
+
+    try:
+        head_type, head_value = read_head(git_directory)
+        branches = sorted(read_local_branches(git_directory)) if with_branches else list()
+    except (GitRefError, IOError, OSError) as e:
+        logger.debug("Can't read the refs natively, using git for-each-ref : {0}".format(e))
+        return _get_branch_state_from_git(directory_path)
+
+    if head_type == "detached":
+        return "(HEAD detached at {0})".format(head_value[:7]), branches
+
+    if head_value.startswith(HEADS_PREFIX):
+        return head_value[len(HEADS_PREFIX):], branches
+    return None, branches
+
+
+def _get_branch_state_from_git(directory_path):
+    result = run_git(["for-each-ref", "--format=%(HEAD) %(refname:short)", HEADS_PREFIX], cwd=directory_path,
+                     capture=True, log_output=False)
+    if not result:
+        return None, list()
+
+    active_branch = None
+    branches = list()
+    for line in result.output.splitlines():
+        if not line.strip():
+            continue
+        marker, name = line[0], line[2:].strip()
+        branches.append(name)
+        if marker == "*":
+            active_branch = name
+    return active_branch, sorted(branches)
+
+
+def get_branch_sha(branch, directory_path=None):
+    """
+    Get the commit sha of the local branch
+
+    :param branch:              `str`           branch name
+    :param directory_path:      `str`           any path inside the work tree
+    :return:                    `str`           sha, None if the branch doesn't exist
+    """
+    git_directory = find_git_directory(directory_path or os.getcwd())
+    if git_directory is None:
+        return None
+
+    try:
+        read_head(git_directory)
+        return read_local_branches(git_directory).get(branch)
+    except (GitRefError, IOError, OSError):
+        pass
+
+    result = run_git(["rev-parse", "--verify", "-q", HEADS_PREFIX + branch], cwd=directory_path, capture=True,
+                     log_output=False)
+    return result.output.strip() or None if result else None
+
+
+def read_stash_count(git_directory):
+    """
+    Count the stash entries from the refs/stash reflog, one line per entry
+
+    :param git_directory:       `GitDirectory`
+    :return:                    `int`           number of stash entries
+    """
+    reflog_file = os.path.join(git_directory.common_dir, "logs", "refs", "stash")
+    if os.path.isfile(reflog_file):
+        with open(reflog_file, "rb") as read_file:
+            return sum(1 for line in read_file if line.strip())
+
+    # no reflog (core.logAllRefUpdates=false), only the latest stash is known
+    if os.path.isfile(os.path.join(git_directory.common_dir, "refs", "stash")):
+        return 1
+    return 1 if "refs/stash" in read_packed_refs(git_directory, prefix="refs/stash") else 0
+
+
+def get_stash_count(directory_path=None):
+    """
+    Get the number of stash entries of the repository at directory_path or os.getcwd()
+
+    :param directory_path:      `str`           any path inside the work tree
+    :return:                    `int`           None if not a git repo
+    """
+    directory_path = directory_path or os.getcwd()
+    git_directory = find_git_directory(directory_path)
+    if git_directory is None:
+        return None
+
+    try:
+        read_head(git_directory)
+        return read_stash_count(git_directory)
+    except (GitRefError, IOError, OSError):
+        pass
+
+    result = run_git(["stash", "list"], cwd=directory_path, capture=True, log_output=False)
+    return len([x for x in result.output.splitlines() if x.strip()]) if result else None
+
+
+def is_rebase_in_progress(directory_path=None):
+    """
+    Check if a rebase is stopped in the work tree at directory_path, waiting for --continue or --abort
+
+    :param directory_path:      `str`           any path inside the work tree
+    :return:                    `bool`
+    """
+    git_directory = find_git_directory(directory_path)
+    if git_directory is None:
+        return False
+    return any(os.path.isdir(os.path.join(git_directory.git_dir, x)) for x in REBASE_STATE_DIRS)
@@ -3,15 +3,20 @@
 Main module which contains all the git methodology
 """
 import os
+import sys
 import json
+import time
+import shutil
 import getpass
-import traceback
-import subprocess
 from collections import OrderedDict
 
 from logIO import get_logger
 from . import constants as scm_constants
-from my_python.decorators.context_decorators import RunFromPath
+from .common import scm_install_package, scm_install_bin_files
+from .git_refs import get_branch_state, get_branch_sha, get_stash_count, find_git_directory, HEADS_PREFIX
+from .repo_cache import STATE_CACHE
+from .command_runner import run_git, DEFAULT_TIMEOUT
+from .registry import register_checkout, find_registered_checkout
 from my_python.system.file_manager import remove_from_disk
 
 logger = get_logger(__name__)
@@ -38,160 +43,547 @@ def get_ticket_url_from_id(ticket_id):
     return "https://jira.com/id={0}".format(ticket_id)
 
 
-def clone_repository(git_ssh_url, branch=None, directory_path=None):
+def run_git_command(args, cwd=None, prefix=None):
     """
-    Clone the given git_ssh_url to given directory_path
+    Run the git command and log its output line by line. Never changes the process cwd,
+    so it is safe to use from multiple threads.
+
+    :param args:                `list`          git arguments, eg: ["clone", url]
+    :param cwd:                 `str`           directory to run the command in, defaults to os.getcwd()
+    :param prefix:              `str`           prefix for every output line, eg: the package name
+    :return:                    `int`           exit code of the command
     """
-    directory_path = directory_path or os.getcwd()
+    return run_git(args, cwd=cwd, prefix=prefix).exit_code
+
+
+def clone_repository(git_ssh_url, branch=None, directory_path=None, target_name=None, prefix=None, depth=None,
+                     clone_filter=None, single_branch=False, reference=None, use_mirror=None,
+                     timeout=DEFAULT_TIMEOUT):
+    """
+    Clone the given git_ssh_url to given directory_path, see async_git.clone_repository_async()
+
+    :param git_ssh_url:         `str`           url of the repository
+    :param branch:              `str`           branch to checkout
+    :param directory_path:      `str`           parent directory of the clone, defaults to os.getcwd()
+    :param target_name:         `str`           name of the clone directory, defaults to the repository name
+    :param prefix:              `str`           prefix for the logged git output
+    :param depth:               `int`           shallow clone with only the last $depth commits
+    :param clone_filter:        `str`           partial clone, "blobless", "treeless" or a raw git filter spec
+    :param single_branch:       `bool`          fetch only the history of $branch
+    :param reference:           `str`           local repository to borrow the objects from (alternates), may
+                                                contain '{0}' for the clone name
+    :param use_mirror:          `bool`          clone from the host mirror cache, defaults to USE_MIRROR_CACHE
+    :param timeout:             `int`           deadline of the clone, defaults to GIT_CLONE_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the clone succeeded
+    """
+    from .async_git import run_sync, clone_repository_async
+
+    return run_sync(clone_repository_async(git_ssh_url, branch=branch, directory_path=directory_path,
+                                           target_name=target_name, prefix=prefix, depth=depth,
+                                           clone_filter=clone_filter, single_branch=single_branch,
+                                           reference=reference, use_mirror=use_mirror, timeout=timeout))
+
+
+def get_reference_path(reference, clone_name):
+    """
+    Resolve the --reference repository of a clone
+
+    :param reference:           `str`           reference repository path, '{0}' is replaced by the clone name
+    :param clone_name:          `str`           clone directory name, eg: the package name
+    :return:                    `str`           reference path, None if not given or it doesn't exist
+    """
+    if not reference:
+        return None
+
+    reference = reference.format(clone_name)
+    if not os.path.isdir(reference):
+        logger.warning("Reference repository '{0}' doesn't exist, cloning without it".format(reference))
+        return None
+    return reference
+
+
+def remove_partial_clone(clone_path):
+    """
+    Remove the directory of a clone which was killed before it finished
+    """
+    logger.warning("Removing the unfinished clone '{0}'".format(clone_path))
+    shutil.rmtree(clone_path, ignore_errors=True)
+
+
+def get_clone_args(git_ssh_url, branch=None, target_name=None, depth=None, clone_filter=None, single_branch=False,
+                   reference=None, mirror_path=None):
+    """
+    Get the 'git clone' arguments of clone_repository(), see it for the parameters
+
+    :param mirror_path:         `str`           clone from this host mirror instead of git_ssh_url
+    :return:                    `tuple`         (git arguments, target_name)
+    """
+    clone_source = git_ssh_url
+    if mirror_path:
+        # the mirror is a local path, git ignores depth and filter for local clones unless given as file:// url
+        clone_source = "file://" + mirror_path if (depth or clone_filter) else mirror_path
+        target_name = target_name or get_repository_name(git_ssh_url)
+
+    args = ["clone"]
+    if depth:
+        args.append("--depth={0}".format(int(depth)))
+    if clone_filter:
+        args.append("--filter={0}".format(scm_constants.CLONE_FILTERS.get(clone_filter, clone_filter)))
+    if single_branch:
+        args.append("--single-branch")
+    if reference:
+        # skipped by git if the reference repository can't be used
+        args.append("--reference-if-able={0}".format(reference))
+
+    args.append(clone_source)
+    if target_name:
+        args.append(target_name)
+    if branch:
+        args.extend(["-b", branch])
+    return args, target_name
+
+
+def get_repository_name(git_url):
+    """
+    Get the default clone directory name of the git url, same as git does.
+
+    :param git_url:             `str`           eg: git@github.com:user/my_repo.git
+    :return:                    `str`           eg: my_repo
+    """
+    name = git_url.rstrip("/").rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+    return name[:-4] if name.endswith(".git") else name
+
+
+def fetch_origin(directory_path=None, prefix=None, use_mirror=None, max_age=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Update the origin/* remote branches of the repository. With the mirror cache the objects and refs come
+    from the host mirror and only the mirror refresh goes upstream. See async_git.fetch_origin_async()
+
+    :param directory_path:      `str`           directory path of the project, defaults to os.getcwd()
+    :param prefix:              `str`           prefix for the logged git output
+    :param use_mirror:          `bool`          fetch from the host mirror cache, defaults to USE_MIRROR_CACHE
+    :param max_age:             `int`           refresh the mirror first if it's older, 0 always refreshes it. Give
+                                                0 when the result must be current, eg: before a rebase
+    :param timeout:             `int`           deadline of the fetch, defaults to GIT_COMMAND_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the fetch succeeded
+    """
+    from .async_git import run_sync, fetch_origin_async
+
+    return run_sync(fetch_origin_async(directory_path=directory_path, prefix=prefix, use_mirror=use_mirror,
+                                       max_age=max_age, timeout=timeout))
+
+
+def get_fetch_args(mirror_path=None):
+    """
+    :param mirror_path:         `str`           fetch the origin/* branches from this host mirror
+    :return:                    `list`          git arguments of fetch_origin()
+    """
+    if mirror_path:
+        # not forced and not pruned, a stale mirror must not rewind or delete what origin already gave us. The
+        # branches rewritten upstream are rejected and fetched from origin instead
+        return ["fetch", mirror_path, "refs/heads/*:refs/remotes/origin/*", "refs/tags/*:refs/tags/*"]
+    return ["fetch", "origin"]
+
+
+def clone_packages(packages, branch=None, directory_path=None, overwrite_existing=False, jobs=None,
+                   **clone_options):
+    """
+    Clone many packages concurrently, every clone writes its .scmconf like PyGitRepository.clone()
+
+    :param packages:            `list`          package names or (package name, branch) pairs
+    :param branch:              `str`           default branch for the packages without one
+    :param directory_path:      `str`           parent directory of the clones, defaults to os.getcwd()
+    :param overwrite_existing:  `bool`          remove existing checkouts first
+    :param jobs:                `int`           number of parallel clones, defaults to CLONE_JOBS
+    :param clone_options:       `dict`          depth, clone_filter, single_branch, reference and use_mirror for
+                                                clone_repository(), reference may contain '{0}' for the package name
+    :return:                    `OrderedDict`   {package name: CloneResult}
+    """
+    from multiprocessing.pool import ThreadPool
 
-    with RunFromPath(path=directory_path):
-        command_string = "git clone {0}".format(git_ssh_url)
-        if branch:
-            command_string += " -b {0}".format(branch)
-        logger.info("Running: '{0}' ".format(command_string))
-        os.system(command_string)
+    directory_path = os.path.abspath(directory_path or os.getcwd())
+    packages = [(x[0], x[1] or branch) if isinstance(x, (list, tuple)) else (x, branch) for x in packages]
 
-    return True
+    def _clone(package):
+        pkg_name, pkg_branch = package
+        start_time = time.time()
+        obj = PyGitRepository(pkg_name=pkg_name, disk_path=os.path.join(directory_path, pkg_name))
+        try:
+            success = bool(obj.clone(source_branch=pkg_branch, overwrite_existing=overwrite_existing,
+                                     **clone_options))
+            message = "" if success else "clone failed"
+        except Exception as e:
+            success, message = False, str(e)
+        return CloneResult(pkg_name=pkg_name, branch=pkg_branch, success=success,
+                           elapsed=time.time() - start_time, message=message)
+
+    pool = ThreadPool(processes=max(1, min(jobs or scm_constants.CLONE_JOBS, len(packages) or 1)))
+    try:
+        results = pool.map(_clone, packages)
+    finally:
+        pool.close()
+        pool.join()
+
+    return OrderedDict((x.pkg_name, x) for x in results)
+
+
+class CloneResult(object):
+    """
+    Result of one clone of clone_packages()
+    """
+    def __init__(self, pkg_name, branch, success, elapsed, message=""):
+        super(CloneResult, self).__init__()
+        self.pkg_name = pkg_name
+        self.branch = branch
+        self.success = success
+        self.elapsed = elapsed
+        self.message = message
+
+
+def format_clone_report(results):
+    """
+    Format the clone_packages() results as a table
+
+    :param results:             `dict`          {package name: CloneResult}
+    :return:                    `str`           table text
+    """
+    width = max([len("Package")] + [len(x) for x in results])
+    lines = ["{0:<{width}}  {1:<7}  {2:>8}  {3}".format("Package", "Status", "Time", "Message", width=width)]
+    for result in results.values():
+        lines.append("{0:<{width}}  {1:<7}  {2:>7.1f}s  {3}".format(
+            result.pkg_name, "OK" if result.success else "FAILED", result.elapsed, result.message, width=width))
+
+    failed = len([x for x in results.values() if not x.success])
+    lines.append("{0} cloned, {1} failed".format(len(results) - failed, failed))
+    return "\n".join(lines)
 
 
 def get_all_git_branches(directory_path=None):
     """
     get all the git branches from given directory_path or os.getcwd()
-    :param directory_path:
-    :return:
+    The active branch is marked with ACTIVE_BRANCH_MARK, same as the 'git branch' output.
+
+    :param directory_path:      `str`           directory path of the project
+    :return:                    `list`          branch names, eg: ["develop", "* master"]
     """
-    directory_path = directory_path or os.getcwd()
+    active_branch, branches = get_branch_state(directory_path=directory_path)
+    all_branches = [scm_constants.ACTIVE_BRANCH_MARK + x if x == active_branch else x for x in branches]
+    if active_branch and active_branch not in branches:
+        # detached HEAD, git lists it first
+        all_branches.insert(0, scm_constants.ACTIVE_BRANCH_MARK + active_branch)
+    return all_branches
 
-    with RunFromPath(path=directory_path):
-        try:
-            data = subprocess.check_output(["git", "branch"])
-            return [x.strip() for x in data.split("\n") if x]
 
-        except subprocess.CalledProcessError:
-            return list()
+def get_git_branch_names(directory_path=None):
+    """
+    Get the local branch names from given directory_path or os.getcwd()
 
-        except Exception, e:
-            traceback.print_exc()
-            logger.warning("Error while looking for git_active_branch at '{0}' : {1}".format(os.getcwd(), e))
-            return list()
+    :param directory_path:      `str`           directory path of the project
+    :return:                    `list`          branch names
+    """
+    return get_branch_state(directory_path=directory_path)[1]
 
 
 def get_git_active_branch(directory_path=None):
     """
     Get the active branch from directory_path or os.getcwd()
     """
-    directory_path = directory_path or os.getcwd()
+    return get_branch_state(directory_path=directory_path, with_branches=False)[0]
 
-    with RunFromPath(path=directory_path):
-        all_branches = get_all_git_branches()
-        if not all_branches:
-            return None
 
-        all_valid_branches = [x for x in all_branches if scm_constants.ACTIVE_BRANCH_MARK in str(x)]
-        if len(all_valid_branches) > 1:
-            msg = "Something is wrong with your git repository.! Multiple branches are marked as active branch.!\n"
-            msg += "Please go to '{0}' and run 'git branch' and find out more.!".format(os.getcwd())
-            logger.error(msg)
-            return None
+class RebaseResult(object):
+    """
+    Result of do_git_rebase()
 
-        return str(all_valid_branches[0]).split(scm_constants.ACTIVE_BRANCH_MARK)[-1]
+        *   status              one of REBASE_UP_TO_DATE, REBASE_REBASED, REBASE_CONFLICT, REBASE_FAILED
+        *   branch              rebased branch
+        *   onto                branch/ref it was rebased onto
+    """
+    def __init__(self, status, branch=None, onto=None, message=""):
+        super(RebaseResult, self).__init__()
+        self.status = status
+        self.branch = branch
+        self.onto = onto
+        self.message = message
 
+    def __repr__(self):
+        return "RebaseResult({0}: '{1}' onto '{2}')".format(self.status, self.branch, self.onto)
+
+    def __bool__(self):
+        return self.status in (scm_constants.REBASE_UP_TO_DATE, scm_constants.REBASE_REBASED)
+
+    __nonzero__ = __bool__
 
-def do_git_rebase(source_branch=None, directory_path=None):
+
+def do_git_rebase(source_branch=None, directory_path=None, fast=None, abort_on_conflict=False):
     """
     Do the rebase for active branch
 
     :param source_branch:       `str`           From which branch do you wants to do the rebase, defaults 'master'
     :param directory_path:      `str`           directory path of the project
+    :param fast:                `bool`          single fetch and rebase onto origin/$source_branch without switching
+                                                branches (async_git.do_git_rebase_async()), defaults to FAST_REBASE
+    :param abort_on_conflict:   `bool`          abort the rebase if it stops on a conflict
+    :return:                    `RebaseResult`
     """
     directory_path = directory_path or os.getcwd()
     source_branch = source_branch or scm_constants.MASTER_BRANCH
+    fast = scm_constants.FAST_REBASE if fast is None else fast
 
-    with RunFromPath(path=directory_path):
-        active_branch = get_git_active_branch()
+    if fast:
+        from .async_git import run_sync, do_git_rebase_async
+        return run_sync(do_git_rebase_async(source_branch=source_branch, directory_path=directory_path,
+                                            abort_on_conflict=abort_on_conflict))
 
-        if active_branch is not source_branch:
-            logger.debug("You're not in the '{0}' branch. Switching back the branch to '{0}'".format(source_branch))
-            try:
-                os.system("git checkout {0}".format(source_branch))
-            except subprocess.CalledProcessError:
-                logger.warning("You have uncommitted changes in your local.!")
-                logger.warning("Please commit your changes or stash them before you can switch branches.!")
-                return False
+    active_branch = get_git_active_branch(directory_path=directory_path)
+
+    if active_branch != source_branch:
+        logger.debug("You're not in the '{0}' branch. Switching back the branch to '{0}'".format(source_branch))
+        if run_git_command(["checkout", source_branch], cwd=directory_path) != 0:
+            logger.warning("You have uncommitted changes in your local.!")
+            logger.warning("Please commit your changes or stash them before you can switch branches.!")
+            return RebaseResult(status=scm_constants.REBASE_FAILED, branch=active_branch, onto=source_branch)
 
-        logger.debug("Fetching the data from upstream origin...")
-        os.system("git fetch origin")
+    def _failed(message):
+        logger.warning("Rebase of '{0}' onto '{1}' not started, {2}.".format(active_branch, source_branch, message))
+        if active_branch != source_branch and get_git_active_branch(directory_path=directory_path) != active_branch:
+            run_git_command(["checkout", active_branch], cwd=directory_path)
+        return RebaseResult(status=scm_constants.REBASE_FAILED, branch=active_branch, onto=source_branch,
+                            message=message)
 
-        logger.debug("Updating the local repo with origin/latest")
-        os.system("git pull origin {0}".format(source_branch))
+    logger.debug("Fetching the data from upstream origin...")
+    if not fetch_origin(directory_path=directory_path, max_age=0):
+        return _failed("fetch failed")
 
-        logger.debug("Checkout the original branch.")
-        os.system("git checkout {0}".format(active_branch))
+    logger.debug("Updating the local repo with origin/latest")
+    if run_git_command(["merge", "origin/{0}".format(source_branch)], cwd=directory_path) != 0:
+        run_git_command(["merge", "--abort"], cwd=directory_path)
+        return _failed("merge of origin/{0} failed".format(source_branch))
 
-        logger.debug("Running git rebase")
-        os.system("git rebase {0}".format(source_branch))
+    logger.debug("Checkout the original branch.")
+    if run_git_command(["checkout", active_branch], cwd=directory_path) != 0:
+        return _failed("checkout of '{0}' failed".format(active_branch))
 
+    logger.debug("Running git rebase")
+    if run_git_command(["rebase", source_branch], cwd=directory_path) != 0:
+        return _rebase_failed(active_branch, source_branch, directory_path, abort_on_conflict)
+    return RebaseResult(status=scm_constants.REBASE_REBASED, branch=active_branch, onto=source_branch)
 
-def do_git_push(to_branch=None, pull_request=False, force=False):
+
+def _rebase_failed(branch, onto, directory_path, abort_on_conflict):
+    from .async_git import run_sync, rebase_failed_async
+    return run_sync(rebase_failed_async(branch, onto, directory_path, abort_on_conflict))
+
+
+def do_git_push(to_branch=None, pull_request=False, force=False, directory_path=None, timeout=DEFAULT_TIMEOUT):
     """
-    Do the git push
+    Do the git push, see async_git.do_git_push_async()
 
-    :param to_branch:           `str`
+    :param to_branch:           `str|list`      branch name or list of branch names pushed together, defaults to
+                                                active branch
     :param pull_request:        `bool`
     :param force:               `bool`
+    :param directory_path:      `str`           directory path of the project
+    :param timeout:             `int`           deadline of the push, defaults to GIT_COMMAND_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the push succeeded
     """
-    to_branch = get_git_active_branch() if to_branch is None else to_branch
-    directory_path = os.getcwd()
+    from .async_git import run_sync, do_git_push_async
 
-    with RunFromPath(path=directory_path):
-        logger.debug("Pushing the changes to upstream")
-        cmd = "git push origin {0}".format(to_branch)
-        if force:
-            cmd += " --force"
-        os.system(cmd)
+    logger.debug("Pushing the changes to upstream")
+    return run_sync(do_git_push_async(to_branch=to_branch, force=force, directory_path=directory_path,
+                                      timeout=timeout))
 
 
-def create_dev_branch(dev_branch, source_branch=None, directory_path=None, description=None):
+def get_remote_heads(branches, directory_path=None):
     """
-    Create the Development branch
+    Get the origin heads of the given branches with a single 'git ls-remote'
+
+    :param branches:            `list`          branch names
+    :param directory_path:      `str`           directory path of the project
+    :return:                    `dict`          {branch: sha or None if not on the remote}, None if ls-remote failed
     """
     directory_path = directory_path or os.getcwd()
-    source_branch = source_branch or scm_constants.MASTER_BRANCH
+    refs = ["refs/heads/{0}".format(x) for x in branches]
+    result = run_git(["ls-remote", "origin"] + refs, cwd=directory_path, capture=True, log_output=False,
+                     timeout=scm_constants.GIT_COMMAND_TIMEOUT)
+    if not result:
+        logger.warning("Can't read the remote heads, git ls-remote exited with {0}".format(result.exit_code))
+        return None
+
+    heads = dict((x, None) for x in branches)
+    for line in result.output.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].startswith(HEADS_PREFIX):
+            heads[parts[1][len(HEADS_PREFIX):]] = parts[0]
+    return heads
+
+
+def is_ancestor(commit, of_commit="HEAD", directory_path=None):
+    """
+    Check if the commit is an ancestor of of_commit, False if the commit is not in the local repository.
+    """
+    return bool(run_git(["merge-base", "--is-ancestor", commit, of_commit], cwd=directory_path, log_output=False))
 
-    with RunFromPath(path=directory_path):
-        all_branches = get_git_active_branch()
-        if not all_branches:
-            return False
 
-        if dev_branch in all_branches:
-            logger.warning("{0} branch already exists in your local.".format(dev_branch))
-            logger.warning("Run 'git pull origin {0}' to update your local branch with remote branch.!".format(dev_branch))
-            return False
+class RepositoryStatus(object):
+    """
+    Working tree status of a repository, see get_repository_status()
+
+        *   branch              active branch, None for a detached HEAD
+        *   upstream            tracked remote branch, eg: origin/master
+        *   ahead/behind        commits ahead and behind the upstream
+        *   changed             number of modified/staged/renamed files
+        *   untracked           number of untracked files, None if they were not scanned
+        *   conflicts           number of unmerged files
+        *   stashes             number of stash entries
+    """
+    def __init__(self, branch=None, upstream=None, ahead=0, behind=0, changed=0, untracked=None, conflicts=0,
+                 stashes=0):
+        super(RepositoryStatus, self).__init__()
+        self.branch = branch
+        self.upstream = upstream
+        self.ahead = ahead
+        self.behind = behind
+        self.changed = changed
+        self.untracked = untracked
+        self.conflicts = conflicts
+        self.stashes = stashes
 
-        active_branch = get_git_active_branch()
-        if active_branch is not source_branch:
-            logger.debug("You're not in the '{0}' branch. Switching back the branch to '{0}'".format(source_branch))
-            try:
-                os.system("git checkout {0}".format(source_branch))
-            except subprocess.CalledProcessError:
-                logger.warning("You have uncommitted changes in your local.!")
-                logger.warning("Please commit your changes or stash them before you can switch branches.!")
-                return False
+    def __repr__(self):
+        return "RepositoryStatus({0})".format(self.describe())
 
-        logger.debug("Fetching the data from upstream origin...")
-        os.system("git fetch origin")
+    @property
+    def is_dirty(self):
+        return bool(self.changed or self.conflicts)
 
-        logger.debug("Updating the local repo with origin/latest")
-        os.system("git pull origin {0}".format(source_branch))
+    @property
+    def has_local_work(self):
+        """
+        True if something would be lost by removing the checkout: changes, stashes or unpushed commits
+        """
+        return bool(self.is_dirty or self.stashes or self.ahead or (self.branch and not self.upstream))
 
-        logger.debug("Creating new branch.!")
-        os.system("git checkout -b {0}".format(dev_branch))
+    def describe(self):
+        """
+        :return:                    `str`           one line summary, eg: "master +1 -2, 3 changed, 1 stash"
+        """
+        parts = [self.branch or "(detached)"]
+        if self.ahead:
+            parts.append("+{0}".format(self.ahead))
+        if self.behind:
+            parts.append("-{0}".format(self.behind))
+
+        details = list()
+        for count, label in ((self.conflicts, "conflicts"), (self.changed, "changed"), (self.untracked, "untracked"),
+                             (self.stashes, "stash")):
+            if count:
+                details.append("{0} {1}".format(count, label))
+        return " ".join(parts) + (", " + ", ".join(details) if details else "")
+
+    def to_dict(self):
+        data_dict = OrderedDict()
+        for key in ("branch", "upstream", "ahead", "behind", "changed", "untracked", "conflicts", "stashes"):
+            data_dict[key] = getattr(self, key)
+        data_dict["dirty"] = self.is_dirty
+        return data_dict
 
-        logger.debug("Setting up the upstream pointers...")
-        os.system("git branch --set-upstream-to origin/{0}".format(source_branch))
 
-        logger.info("Development branch created.!")
-        return True
+_GIT_VERSION = list()
+
+
+def get_git_version():
+    """
+    Get the version of the git executable, read once per process
+
+    :return:                    `tuple`         eg: (2, 39, 2), (0,) if git can't be run
+    """
+    if not _GIT_VERSION:
+        result = run_git(["version"], capture=True, log_output=False)
+        numbers = list()
+        if result:
+            # git version 2.39.2 / git version 2.39.2.windows.1
+            for part in result.output.split()[2].split(".") if len(result.output.split()) > 2 else []:
+                if not part.isdigit():
+                    break
+                numbers.append(int(part))
+        _GIT_VERSION.append(tuple(numbers) or (0,))
+    return _GIT_VERSION[0]
+
+
+def get_status_config_args(untracked=False):
+    """
+    Get the '-c' options which make 'git status' faster on this host:
+
+        *   core.untrackedCache     caches the untracked scan per directory mtime, only when untracked files are
+                                    scanned at all
+        *   core.fsmonitor          the builtin file system monitor of git >= 2.36, only available on macOS and
+                                    Windows. Elsewhere the fsmonitor hook configured in the repository is used as is
+    """
+    args = list()
+    if untracked:
+        args.extend(["-c", "core.untrackedCache=true"])
+    if scm_constants.STATUS_USE_FSMONITOR and sys.platform in ("darwin", "win32") and get_git_version() >= (2, 36):
+        args.extend(["-c", "core.fsmonitor=true"])
+    return args
+
+
+def get_repository_status(directory_path=None, untracked=False):
+    """
+    Get the branch, ahead/behind counts and the dirty files with a single 'git status --porcelain=v2'.
+    The stash entries are counted from the stash reflog.
+
+    :param directory_path:      `str`           directory path of the project
+    :param untracked:           `bool`          count the untracked files too, skipped by default as the
+                                                untracked scan walks the whole work tree
+    :return:                    `RepositoryStatus`  None if the status can't be read
+    """
+    directory_path = directory_path or os.getcwd()
+    args = get_status_config_args(untracked=untracked) + ["status", "--porcelain=v2", "--branch",
+                                                          "--untracked-files={0}".format("normal" if untracked else "no")]
+    result = run_git(args, cwd=directory_path, capture=True, log_output=False)
+    if not result:
+        return None
+
+    status = RepositoryStatus(untracked=0 if untracked else None)
+    for line in result.output.splitlines():
+        if line.startswith("# branch.head "):
+            head = line[len("# branch.head "):]
+            status.branch = None if head == "(detached)" else head
+        elif line.startswith("# branch.upstream "):
+            status.upstream = line[len("# branch.upstream "):]
+        elif line.startswith("# branch.ab "):
+            ahead, behind = line[len("# branch.ab "):].split()
+            status.ahead, status.behind = abs(int(ahead)), abs(int(behind))
+        elif line[:2] in ("1 ", "2 "):
+            status.changed += 1
+        elif line.startswith("u "):
+            status.conflicts += 1
+        elif line.startswith("? ") and line[2:] != scm_constants.PACKAGE_CONFIG_FILE:
+            status.untracked += 1
+
+    status.stashes = get_stash_count(directory_path=directory_path) or 0
+    return status
+
+
+def create_dev_branch(dev_branch, source_branch=None, directory_path=None, description=None,
+                      timeout=DEFAULT_TIMEOUT):
+    """
+    Create the Development branch from the fetched origin/$source_branch, see async_git.create_dev_branch_async()
+
+    :param dev_branch:          `str`           new branch name
+    :param source_branch:       `str`           upstream branch, defaults 'master'
+    :param directory_path:      `str`           directory path of the project
+    :param timeout:             `int`           deadline of the fetch, defaults to GIT_COMMAND_TIMEOUT, None waits
+                                                forever
+    :return:                    `bool`          True if the branch was created
+    """
+    from .async_git import run_sync, create_dev_branch_async
+
+    return run_sync(create_dev_branch_async(dev_branch, source_branch=source_branch, directory_path=directory_path,
+                                            timeout=timeout))
 
 
 class PyGitRepository(object):
@@ -213,8 +605,6 @@ class PyGitRepository(object):
         self.disk_path = disk_path or os.path.join(os.getcwd(), self.pkg_name)
 
     def _write_config(self):
-        self.cd_to_directory()
-
         data_dict = OrderedDict()
         data_dict["pkg_name"] = self.pkg_name
         data_dict["ssh_path"] = self.ssh_path
@@ -223,17 +613,39 @@ class PyGitRepository(object):
         data_dict["disk_path"] = self.disk_path
         data_dict["user"] = getpass.getuser()
 
-        with open(scm_constants.PACKAGE_CONFIG_FILE, "w") as write_cfg:
+        with open(os.path.join(self.disk_path, scm_constants.PACKAGE_CONFIG_FILE), "w") as write_cfg:
             json.dump(data_dict, write_cfg, indent=4)
 
+        STATE_CACHE.invalidate(key=os.path.join(self.disk_path, scm_constants.PACKAGE_CONFIG_FILE), kind="config")
+        register_checkout(self)
+        return True
+
     @staticmethod
     def _read_config(directory_path):
         file_path = os.path.join(directory_path, scm_constants.PACKAGE_CONFIG_FILE)
-        if not os.path.isfile(file_path):
-            return {}
 
-        with open(file_path, "r") as read_cfg:
-            return json.load(read_cfg)
+        def _load():
+            if not os.path.isfile(file_path):
+                return {}
+
+            with open(file_path, "r") as read_cfg:
+                return json.load(read_cfg)
+
+        # callers modify the config, never hand out the cached dict itself
+        return dict(STATE_CACHE.get(kind="config", key=file_path, watched_files=[file_path], compute=_load))
+
+    @staticmethod
+    def _get_project_root(path):
+        from my_python.common.general import get_project_root_from_path
+        return STATE_CACHE.get(kind="project_root", key=path, watched_files=[path],
+                               compute=lambda: get_project_root_from_path(source_path=path))
+
+    @staticmethod
+    def cache_stats():
+        """
+        Get the hit/miss counters of the repository state cache
+        """
+        return STATE_CACHE.stats()
 
     @classmethod
     def from_path(cls, path=None):
@@ -247,8 +659,14 @@ class PyGitRepository(object):
             read_config.pop("user")
             return cls(**read_config)
 
-        from my_python.common.general import get_project_root_from_path
-        project = get_project_root_from_path(source_path=path)
+        record = find_registered_checkout(path)
+        if record is not None:
+            read_config = cls._read_config(directory_path=record.disk_path)
+            if read_config:
+                read_config.pop("user")
+                return cls(**read_config)
+
+        project = cls._get_project_root(path=path)
         if not project:
             logger.warning("This is not an valid project path. '{0}'".format(path))
             return False
@@ -268,12 +686,39 @@ class PyGitRepository(object):
         return "ClassObject : {cls}:{name}:{branch} - {desc}".format(cls=self.__class__.__name__, name=self.pkg_name,
                                                                      branch=self.active_branch, desc=self.description)
 
+    @property
+    def git_directory(self):
+        """
+        Return the git_refs.GitDirectory of the repo, None if not a valid git repo
+        """
+        return STATE_CACHE.get(kind="git_directory", key=self.disk_path,
+                               watched_files=[os.path.join(self.disk_path, ".git")],
+                               compute=lambda: find_git_directory(self.disk_path))
+
     @property
     def active_branch(self):
         """
         Return the active branch name, None if not a valid git repo
         """
-        return get_git_active_branch(directory_path=self.disk_path)
+        git_directory = self.git_directory
+        if git_directory is None:
+            return None
+
+        return STATE_CACHE.get(kind="active_branch", key=self.disk_path, watched_files=[git_directory.head_file],
+                               compute=lambda: get_git_active_branch(directory_path=self.disk_path))
+
+    @property
+    def branches(self):
+        """
+        Return all the local branch names
+        """
+        git_directory = self.git_directory
+        if git_directory is None:
+            return list()
+
+        watched_files = [git_directory.head_file, git_directory.packed_refs_file, git_directory.heads_dir]
+        return list(STATE_CACHE.get(kind="branches", key=self.disk_path, watched_files=watched_files,
+                                    compute=lambda: get_git_branch_names(directory_path=self.disk_path)))
 
     def get_active_branch(self):
         return self.active_branch
@@ -285,61 +730,169 @@ class PyGitRepository(object):
         to_path = to_path or self.disk_path
         os.chdir(to_path)
 
-    def init_development(self, source_branch=None, to_branch=None, description=None, overwrite_existing=True):
+    def init_development(self, source_branch=None, to_branch=None, description=None, overwrite_existing=True,
+                         worktree=False, sparse_paths=None):
         """
-        This should be run to initialize the development branch
+        This should be run to initialize the development branch.
+        With worktree, an existing checkout is kept and $to_branch gets its own worktree of it instead of a
+        new clone, see develop_worktree()
         """
+        if (worktree or sparse_paths) and to_branch and os.path.isdir(self.disk_path):
+            package = self.develop_worktree(to_branch=to_branch, source_branch=source_branch,
+                                            sparse_paths=sparse_paths, description=description)
+            if package is None:
+                return False
+            return bool(package.install(force=overwrite_existing))
+
         clone_repo = self.clone(source_branch=source_branch, overwrite_existing=overwrite_existing)
         if not clone_repo:
             return False
 
         self.cd_to_directory()
-        self.develop(to_branch=to_branch, source_branch=source_branch, description=description, need_rebase=False)
-        self.install(force=overwrite_existing)
-        return True
-
-    def _add_to_package_group(self):
-        raise NotImplementedError
+        if not self.develop(to_branch=to_branch, source_branch=source_branch, description=description,
+                            need_rebase=False):
+            return False
+        return bool(self.install(force=overwrite_existing))
 
-    def clone(self, source_branch=None, overwrite_existing=None):
+    def _add_to_package_group(self, group_path=None):
         """
-        Method for cloning the repository
+        Add this package to the group file of group_path, defaults to the parent directory of the package
         """
-        current_dir = os.getcwd()
+        from .package_group import PackageGroup
+        group_path = group_path or os.path.dirname(self.disk_path)
+        group = PackageGroup.load(group_path)
+        group.add(self)
+        return group.save()
+
+    def clone(self, source_branch=None, overwrite_existing=None, depth=None, clone_filter=None, single_branch=False,
+              reference=None, use_mirror=None):
+        """
+        Method for cloning the repository to self.disk_path
+
+        :param source_branch:       `str`           branch to checkout
+        :param overwrite_existing:  `bool`          remove the existing checkout first
+        :param depth:               `int`           shallow clone with only the last $depth commits
+        :param clone_filter:        `str`           partial clone, "blobless", "treeless" or a raw git filter spec
+        :param single_branch:       `bool`          fetch only the history of source_branch
+        :param reference:           `str`           local repository to borrow the objects from, '{0}' is the
+                                                    package name
+        :param use_mirror:          `bool`          clone from the host mirror cache, defaults to USE_MIRROR_CACHE
+        """
+        parent_dir = os.path.dirname(self.disk_path)
+        clone_name = os.path.basename(self.disk_path)
 
-        if self.pkg_name in os.listdir(current_dir):
+        if os.path.exists(self.disk_path):
             if overwrite_existing:
-                remove_from_disk(path=os.path.join(current_dir, self.pkg_name))
+                remove_from_disk(path=self.disk_path)
             else:
                 logger.error("Package already exists, Please use force/override flags to force clone.")
                 return False
 
         if self.ssh_path:
-            success = clone_repository(git_ssh_url=self.ssh_path, branch=source_branch)
+            success = clone_repository(git_ssh_url=self.ssh_path, branch=source_branch, directory_path=parent_dir,
+                                       target_name=clone_name, prefix=self.pkg_name, depth=depth,
+                                       clone_filter=clone_filter, single_branch=single_branch, reference=reference,
+                                       use_mirror=use_mirror)
             if success:
                 return self._write_config()
 
         return False
 
-    def rebase(self, with_branch=None):
+    def rebase(self, with_branch=None, fast=None):
         """
         Method for rebasing your current branch with latest origin-master branch
+
+        :return:                    `RebaseResult`
         """
-        return do_git_rebase(source_branch=with_branch)
+        return do_git_rebase(source_branch=with_branch, directory_path=self.disk_path, fast=fast)
 
-    def push(self, to_branch=None, open_merge_request=True, force=False):
+    def push(self, to_branch=None, open_merge_request=True, force=False, source_branch=None):
         """
         Method for pushing your changes to $to_branch and create merge_request if asked by user
+
+        One 'git ls-remote' compares the local branches with the remote heads:
+
+            *   remote branch is same as local          nothing to push
+            *   remote $source_branch not in history    rebase first, only the active branch can be rebased
+            *   otherwise                               push without the rebase
+
+        All the branches left to push go out in one 'git push'.
+
+        :param to_branch:           `str|list`      branch name or names, defaults to the active branch
+        :return:                    `bool`          True if pushed or nothing to push
         """
-        self.rebase()
-        return do_git_push(to_branch=to_branch, pull_request=open_merge_request, force=force)
+        branches = list(to_branch) if isinstance(to_branch, (list, tuple)) else [to_branch or self.active_branch]
+        source_branch = source_branch or scm_constants.MASTER_BRANCH
+
+        remote_heads = get_remote_heads(branches=branches + [source_branch], directory_path=self.disk_path)
+        if remote_heads is None:
+            # can't tell, do it the safe way
+            for branch in branches:
+                if not self._rebase_before_push(branch, source_branch):
+                    return False
+            return do_git_push(to_branch=branches, pull_request=open_merge_request, force=force,
+                               directory_path=self.disk_path)
+
+        source_sha = remote_heads.get(source_branch)
+        to_push = list()
+        for branch in branches:
+            local_sha = get_branch_sha(branch=branch, directory_path=self.disk_path)
+            if local_sha and remote_heads.get(branch) == local_sha:
+                logger.info("'{0}' is already up to date with origin, nothing to push.".format(branch))
+                continue
+
+            if source_sha and not is_ancestor(source_sha, branch, directory_path=self.disk_path):
+                logger.info("'{0}' is behind origin/{1}, rebasing before the push.".format(branch, source_branch))
+                if not self._rebase_before_push(branch, source_branch):
+                    return False
+            to_push.append(branch)
+
+        if not to_push:
+            return True
+        return do_git_push(to_branch=to_push, pull_request=open_merge_request, force=force,
+                           directory_path=self.disk_path)
+
+    def _rebase_before_push(self, to_branch, source_branch):
+        # rebase works on the active branch, another branch would be pushed without it
+        if to_branch != self.active_branch:
+            logger.error("'{0}' is not the active branch, check it out to rebase it onto '{1}' before the "
+                         "push.".format(to_branch, source_branch))
+            return False
+        return bool(self.rebase(with_branch=source_branch))
 
-    def install(self, to_path=None, hard_link=False, force=True):
+    def install(self, to_path=None, hard_link=False, force=True, link_mode=None, jobs=None):
         """
         Method to install your repo to a certain path. This can be used when developer wants to give
         his code base for testing.
+
+        Files are hardlinked, reflinked or copied in kernel, whichever is the cheapest for the
+        source/destination filesystem pair, see link_strategies.py
+
+        :param to_path:             `str`           install directory, defaults to PY_TESTING_DIR
+        :param hard_link:           `bool`          hardlink the files when they are on the same filesystem
+        :param force:               `bool`          re-install all the files, ignoring the install manifest
+        :param link_mode:           `str`           explicit install strategy, overrides hard_link
+        :param jobs:                `int`           number of parallel install workers
+        :return:                    `InstallSummary` summary of the python package install, False if failed
         """
-        raise NotImplementedError
+        link_mode = link_mode or (scm_constants.LINK_MODE_HARDLINK if hard_link else scm_constants.LINK_MODE_AUTO)
+        # not the directory name, a worktree directory is named after its branch
+        package_name = self.pkg_name or os.path.basename(self.disk_path)
+        python_root = os.path.join(self.disk_path, "src", package_name)
+        bin_root = os.path.join(self.disk_path, "src", "bin")
+
+        if not os.path.isdir(python_root):
+            logger.warning("Python source directory not found: '{0}'".format(python_root))
+            return False
+
+        summary = scm_install_package(source=python_root, override=force, jobs=jobs,
+                                      install_root=to_path or scm_constants.PY_TESTING_DIR, link_mode=link_mode)
+
+        if os.path.isdir(bin_root):
+            bin_install_dir = os.path.join(to_path, "bin") if to_path else scm_constants.BIN_TESTING_DIR
+            scm_install_bin_files(bin_directory=bin_root, override=force, jobs=jobs, install_dir=bin_install_dir,
+                                  link_mode=link_mode)
+        return summary
 
     def develop(self, to_branch, source_branch=None, description=None, need_rebase=True):
         """
@@ -348,11 +901,39 @@ class PyGitRepository(object):
             *   self.rebase() if user asked
             *   checkout $source_branch
             *   create a new branch called $to_branch
+
+        :return:                    `bool`          True if the branch was created
         """
-        if need_rebase:
-            self.rebase(with_branch=source_branch)
+        if need_rebase and not self.rebase(with_branch=source_branch):
+            logger.error("Rebase failed, '{0}' branch is not created.".format(to_branch))
+            return False
 
-        create_dev_branch(dev_branch=to_branch, source_branch=source_branch, description=description)
+        return create_dev_branch(dev_branch=to_branch, source_branch=source_branch, directory_path=self.disk_path,
+                                 description=description)
+
+    def develop_worktree(self, to_branch, source_branch=None, sparse_paths=None, description=None):
+        """
+        Start the development of $to_branch in its own git worktree of this checkout, see worktrees.py.
+        This checkout stays on its branch, the worktree gets its own .scmconf and is registered like a clone.
+
+        :param to_branch:           `str`               ticket branch name
+        :param source_branch:       `str`               branch to start from, defaults to MASTER_BRANCH
+        :param sparse_paths:        `list`              only check out these directories, all if None
+        :param description:         `str`               description note for the branch
+        :return:                    `PyGitRepository`   package of the worktree, None if failed
+        """
+        from .worktrees import add_worktree
+
+        worktree_path = add_worktree(self.disk_path, branch=to_branch, source_branch=source_branch,
+                                     sparse_paths=sparse_paths)
+        if worktree_path is None:
+            return None
+
+        worktree = PyGitRepository(pkg_name=self.pkg_name, ssh_path=self.ssh_path, ticket_id=to_branch,
+                                   disk_path=worktree_path)
+        worktree.description = description
+        worktree._write_config()
+        return worktree
 
     @property
     def package(self):
@@ -360,5 +941,16 @@ class PyGitRepository(object):
 
     @property
     def package_group(self):
-        raise NotImplementedError
+        """
+        Return the PackageGroup of the parent directory of the package
+        """
+        from .package_group import PackageGroup
+        return PackageGroup.load(os.path.dirname(self.disk_path))
+
+    def status(self, untracked=False):
+        """
+        :param untracked:           `bool`          count the untracked files too
+        :return:                    `RepositoryStatus`
+        """
+        return get_repository_status(directory_path=self.disk_path, untracked=untracked)
 
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compiled ignore matcher for the installs.
+
+Patterns are glob patterns with the .gitignore semantics (negation with '!', directory only patterns
+with a trailing '/', anchored patterns with a '/' in them and '**'). They are compiled once per install
+and the ignored directories are pruned from the os.walk() so they are never walked.
+"""
+import os
+import re
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+
+logger = get_logger(__name__)
+
+
+def translate_glob(pattern):
+    """
+    Convert a gitignore style glob pattern to regular expression string.
+    Unlike fnmatch, '*' and '?' never match a path separator and '**' matches any number of directories.
+
+    :param pattern:             `str`           glob pattern
+    :return:                    `str`           regular expression
+    """
+    index, length = 0, len(pattern)
+    result = list()
+    while index < length:
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            result.append("(?:.*/)?")
+            index += 3
+            continue
+
+        if pattern.startswith("/**", index) and index + 3 == length:
+            result.append("/.*")
+            index += 3
+            continue
+
+        if char == "*":
+            if pattern.startswith("**", index):
+                result.append(".*")
+                index += 2
+                continue
+            result.append("[^/]*")
+        elif char == "?":
+            result.append("[^/]")
+        elif char == "[":
+            end = pattern.find("]", index + 1)
+            if end == -1:
+                result.append(re.escape(char))
+            else:
+                chars = pattern[index + 1:end]
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                result.append("[{0}]".format(chars.replace("\\", "\\\\")))
+                index = end
+        elif char == "\\" and index + 1 < length:
+            index += 1
+            result.append(re.escape(pattern[index]))
+        else:
+            result.append(re.escape(char))
+        index += 1
+
+    return "".join(result)
+
+
+class IgnoreRule(object):
+    """
+    Single compiled ignore pattern
+    """
+    def __init__(self, pattern, base_dir=None):
+        super(IgnoreRule, self).__init__()
+        self.pattern = pattern
+        self.base_dir = base_dir
+
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        # pattern without any slash matches a whole path component at any depth,
+        # otherwise it is matched relative to the directory of the ignore file
+        self.anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        self.regex = re.compile(translate_glob(pattern) + r"\Z")
+
+    def __repr__(self):
+        return "IgnoreRule('{0}')".format(self.pattern)
+
+    def matches(self, path, name, is_dir):
+        """
+        :param path:                `str`           abs posix path
+        :param name:                `str`           base name of the path
+        :param is_dir:              `bool`          is the path a directory
+        :return:                    `bool`          True if this rule applies to the path
+        """
+        if self.dir_only and not is_dir:
+            return False
+
+        if self.base_dir is not None:
+            if not path.startswith(self.base_dir):
+                return False
+            rel_path = path[len(self.base_dir):]
+        else:
+            rel_path = name
+
+        if self.anchored:
+            return bool(self.regex.match(rel_path))
+        return bool(self.regex.match(name))
+
+
+class IgnoreMatcher(object):
+    """
+    Compiled matcher for all the ignore patterns of a package
+
+    Intended Usages:
+        matcher = IgnoreMatcher.for_source(source)
+        for root, dirs, files in os.walk(source):
+            matcher.prune(root, dirs)
+            files = [x for x in files if not matcher.is_ignored(os.path.join(root, x))]
+    """
+    def __init__(self, patterns=None):
+        super(IgnoreMatcher, self).__init__()
+        self.rules = list()
+        self._loaded_ignore_files = set()
+        self.add_patterns(patterns or list())
+
+    @classmethod
+    def for_source(cls, source, use_gitignore=True):
+        """
+        Build the matcher for given source directory with the default patterns and,
+        if asked, all the .gitignore files from the git root down to the source directory.
+        """
+        matcher = cls(patterns=scm_constants.IGNORE_PATTERNS)
+        if not use_gitignore:
+            return matcher
+
+        source = os.path.abspath(source)
+        parents = list()
+        path = source
+        while True:
+            parents.append(path)
+            if os.path.exists(os.path.join(path, ".git")):
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                # not inside a git repository, only the source directory's own ignore file counts
+                parents = [source]
+                break
+            path = parent
+
+        for directory in reversed(parents):
+            matcher.load_ignore_file(directory)
+        return matcher
+
+    def add_patterns(self, patterns, base_dir=None):
+        """
+        Compile and add the given patterns, blank lines and comments are skipped
+        """
+        if base_dir is not None:
+            base_dir = _to_posix(base_dir).rstrip("/") + "/"
+
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            self.rules.append(IgnoreRule(pattern=pattern, base_dir=base_dir))
+
+    def load_ignore_file(self, directory):
+        """
+        Add the patterns from the .gitignore file of given directory, if there is one.
+        """
+        file_path = os.path.join(directory, scm_constants.GIT_IGNORE_FILE)
+        if file_path in self._loaded_ignore_files or not os.path.isfile(file_path):
+            return False
+
+        self._loaded_ignore_files.add(file_path)
+        with open(file_path, "r") as read_file:
+            self.add_patterns(read_file.read().splitlines(), base_dir=directory)
+        logger.debug("Loaded ignore patterns from '{0}'".format(file_path))
+        return True
+
+    def match(self, path, is_dir=False):
+        """
+        Check given path against all the rules, the last matching rule wins.
+
+        :param path:                `str`           abs path
+        :param is_dir:              `bool`          is the path a directory
+        :return:                    `bool`          True if the path is ignored
+        """
+        path = _to_posix(path)
+        name = path.rsplit("/", 1)[-1]
+        ignored = False
+        for rule in self.rules:
+            if ignored == (not rule.negate):
+                # this rule can not change the result
+                continue
+            if rule.matches(path=path, name=name, is_dir=is_dir):
+                ignored = not rule.negate
+        return ignored
+
+    def is_ignored(self, path):
+        """
+        Check if the given file path is ignored
+        """
+        return self.match(path=path, is_dir=False)
+
+    def is_ignored_component(self, path):
+        """
+        Check if any of the path component of the given path is ignored
+        """
+        path = _to_posix(path)
+        components = [x for x in path.split("/") if x]
+        prefix = "/" if path.startswith("/") else ""
+        for index in range(len(components)):
+            current = prefix + "/".join(components[:index + 1])
+            if self.match(path=current, is_dir=index < len(components) - 1):
+                return True
+        return False
+
+    def prune(self, root, dirs, files=None):
+        """
+        Remove the ignored directories from the os.walk() dirs list in place.
+        If the files list is given, the .gitignore file of the root is loaded for its sub directories.
+        """
+        if files is not None and scm_constants.GIT_IGNORE_FILE in files:
+            self.load_ignore_file(root)
+
+        dirs[:] = [x for x in dirs if not self.match(path=os.path.join(root, x), is_dir=True)]
+        return dirs
+
+
+def _to_posix(path):
+    return path.replace(os.sep, "/") if os.sep != "/" else path
+
+
+_DEFAULT_MATCHER = None
+
+
+def get_default_matcher():
+    """
+    Matcher with just the default IGNORE_PATTERNS, compiled once
+    """
+    global _DEFAULT_MATCHER
+    if _DEFAULT_MATCHER is None:
+        _DEFAULT_MATCHER = IgnoreMatcher(patterns=scm_constants.IGNORE_PATTERNS)
+    return _DEFAULT_MATCHER
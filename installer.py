@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-process install API of the projects.
+
+scm install used to run `python <project>/package_setup.py install <live> <force>` for every package, which
+costs a new interpreter and all the scm_tools imports per package. install_projects() installs any number of
+project roots in the running process instead, and the packages of a batch share one FileInstaller, so the
+install strategies found working for a pair of file systems are probed once for the whole batch.
+
+    report = install_projects(["/work/pkg_a", "/work/pkg_b"], jobs=8)
+    print(report.format())
+
+A project has the layout package_setup.py expects: <root>/src/<root name> is the python package and
+<root>/src/bin has the scripts. package_setup.py uses this module too, so running it directly still works.
+
+A project whose package_setup.py is not one of the stock templates may do more than installing the two
+directories, so it is still run in its own interpreter, with a warning. It's given exactly
+`install <live> <force>` like scm install did, the copies of the old template accept nothing else, so the
+other options are ignored for that project.
+"""
+import os
+import sys
+import time
+import hashlib
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .manifest import InstallSummary
+from .link_strategies import FileInstaller
+from .common import scm_install_package, scm_install_bin_files
+
+logger = get_logger(__name__)
+
+
+def get_project_sources(project_root):
+    """
+    Get the python package and bin directories of a project
+
+    :return:                    `tuple`         (python package directory, bin directory), None if missing
+    """
+    python_root = os.path.join(project_root, "src", os.path.basename(project_root))
+    bin_root = os.path.join(project_root, "src", "bin")
+    return (python_root if os.path.isdir(python_root) else None,
+            bin_root if os.path.isdir(bin_root) else None)
+
+
+def _get_file_hash(file_path):
+    with open(file_path, "rb") as read_file:
+        return hashlib.sha1(read_file.read().replace(b"\r\n", b"\n")).hexdigest()
+
+
+def get_custom_package_setup(project_root):
+    """
+    Get the package_setup.py of the project if it's not a stock template, which install_project() replaces
+
+    :return:                    `str`           path of the customized package_setup.py, None if stock or missing
+    """
+    setup_file = os.path.join(project_root, scm_constants.package_setup_file)
+    if not os.path.isfile(setup_file):
+        return None
+
+    stock_hashes = set(scm_constants.STOCK_PACKAGE_SETUP_HASHES)
+    stock_hashes.add(_get_file_hash(os.path.join(os.path.dirname(os.path.abspath(__file__)), "package_setup.py")))
+    return None if _get_file_hash(setup_file) in stock_hashes else setup_file
+
+
+class ProjectInstallResult(object):
+    """
+    Result of the install of one project
+    """
+    def __init__(self, project_root):
+        super(ProjectInstallResult, self).__init__()
+        self.project_root = project_root
+        self.name = os.path.basename(project_root)
+        self.package = None
+        self.bin = None
+        self.success = True
+        self.elapsed = 0.0
+        self.message = ""
+
+    def __repr__(self):
+        return "ProjectInstallResult('{0}', success={1})".format(self.name, self.success)
+
+    def to_dict(self):
+        data_dict = OrderedDict()
+        data_dict["name"] = self.name
+        data_dict["project_root"] = self.project_root
+        data_dict["success"] = self.success
+        data_dict["elapsed"] = round(self.elapsed, 3)
+        data_dict["message"] = self.message
+        if isinstance(self.package, InstallSummary):
+            data_dict["package"] = OrderedDict((x, len(getattr(self.package, x)))
+                                               for x in ("copied", "skipped", "removed", "failed"))
+            data_dict["release"] = self.package.release
+        else:
+            data_dict["package"] = self.package
+        data_dict["bin"] = self.bin
+        return data_dict
+
+
+class InstallReport(object):
+    """
+    Combined result of install_projects()
+
+    Intended Usages:
+        report = install_projects(project_roots)
+        if not report.success:
+            print(report.format())
+    """
+    def __init__(self):
+        super(InstallReport, self).__init__()
+        self.results = OrderedDict()
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return "InstallReport({0} projects, {1} failed)".format(len(self.results), len(self.get_failed()))
+
+    def __iter__(self):
+        return iter(self.results.values())
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def success(self):
+        return not self.get_failed()
+
+    def get_failed(self):
+        return [x for x in self.results.values() if not x.success]
+
+    def get_totals(self):
+        """
+        Sum of the package install summaries of all the projects
+
+        :return:                    `InstallSummary`
+        """
+        totals = InstallSummary()
+        for result in self.results.values():
+            if isinstance(result.package, InstallSummary):
+                for name in ("copied", "skipped", "removed", "failed"):
+                    getattr(totals, name).extend(getattr(result.package, name))
+        return totals
+
+    def to_dict(self):
+        data_dict = OrderedDict()
+        data_dict["success"] = self.success
+        data_dict["elapsed"] = round(self.elapsed, 3)
+        totals = self.get_totals()
+        data_dict["totals"] = OrderedDict((x, len(getattr(totals, x)))
+                                          for x in ("copied", "skipped", "removed", "failed"))
+        data_dict["projects"] = [x.to_dict() for x in self.results.values()]
+        return data_dict
+
+    def format(self):
+        """
+        Format the results as a table, one line per project and the combined summary
+        """
+        width = max([len("Project")] + [len(x.name) for x in self.results.values()])
+        lines = ["{0:<{width}}  {1:<7}  {2:>8}  {3}".format("Project", "Status", "Time", "Files", width=width)]
+        for result in self.results.values():
+            package = result.package
+            files = "{0!r}".format(package) if isinstance(package, InstallSummary) else \
+                ("linked" if package else "-")
+            lines.append("{0:<{width}}  {1:<7}  {2:>7.2f}s  {3}{4}".format(
+                result.name, "OK" if result.success else "FAILED", result.elapsed, files,
+                "  ({0})".format(result.message) if result.message else "", width=width))
+
+        lines.append("{0} projects installed, {1} failed in {2:.2f}s. {3!r}".format(
+            len(self.results) - len(self.get_failed()), len(self.get_failed()), self.elapsed, self.get_totals()))
+        return "\n".join(lines)
+
+
+def install_project(project_root, live=False, override=False, jobs=None, link_mode=None, dedup=None,
+                    compile_bytecode=None, build_format=None, install_root=None, bin_install_dir=None,
+                    file_installer=None):
+    """
+    Install the python package and the bin files of one project, what `package_setup.py install` does
+
+    :param project_root:        `str`                   project directory
+    :param live:                `bool`                  install symlinks to the sources in the testing directories
+    :param override:            `bool`                  ignore the install manifest, overwrite existing bin files
+    :param jobs:                `int`                   number of parallel copy workers
+    :param link_mode:           `str`                   install strategy (constants.LINK_MODES), defaults to auto
+    :param dedup:               `bool`                  link the files from the object store, defaults to DEDUP_INSTALLS
+    :param compile_bytecode:    `bool`                  byte-compile the changed files, defaults to COMPILE_BYTECODE
+    :param build_format:        `str`                   "tree" or "archive", defaults to BUILD_FORMAT
+    :param install_root:        `str`                   python install directory, defaults to PY_BUILDS_DIR
+    :param bin_install_dir:     `str`                   bin install directory, defaults to BIN_BUILDS_DIR
+    :param file_installer:      `FileInstaller`         shared installer of a batch, defaults to a new one
+    :return:                    `ProjectInstallResult`
+    """
+    start_time = time.time()
+    project_root = os.path.abspath(project_root)
+    result = ProjectInstallResult(project_root)
+    python_root, bin_root = get_project_sources(project_root)
+    if not python_root and not bin_root:
+        result.success = False
+        result.message = "no src/{0} or src/bin directory".format(result.name)
+        logger.warning("Nothing to install in '{0}', {1}".format(project_root, result.message))
+        return result
+
+    try:
+        if python_root:
+            logger.debug("Installing python files from : '{0}'".format(python_root))
+            result.package = scm_install_package(python_root, for_qc=live, override=override, jobs=jobs,
+                                                 install_root=install_root, link_mode=link_mode, dedup=dedup,
+                                                 compile_bytecode=compile_bytecode, build_format=build_format,
+                                                 file_installer=file_installer)
+            if isinstance(result.package, InstallSummary) and result.package.failed:
+                result.success = False
+                result.message = "{0} file(s) failed".format(len(result.package.failed))
+
+        if bin_root:
+            logger.debug("Installing script/bin files from : '{0}'".format(bin_root))
+            result.bin = scm_install_bin_files(bin_directory=bin_root, for_qc=live, override=override, jobs=jobs,
+                                               install_dir=bin_install_dir, link_mode=link_mode, dedup=dedup,
+                                               file_installer=file_installer)
+            if not result.bin:
+                result.success = False
+                result.message = result.message or "bin files failed"
+    except (IOError, OSError, ValueError) as e:
+        logger.error("Install of '{0}' failed : {1}".format(result.name, e))
+        result.success = False
+        result.message = str(e)
+
+    result.elapsed = time.time() - start_time
+    return result
+
+
+def run_package_setup(project_root, setup_file, live=False, override=False):
+    """
+    Install the project by running its own package_setup.py, like scm install did before the install api
+
+    :return:                    `ProjectInstallResult`
+    """
+    from .command_runner import run_command
+
+    start_time = time.time()
+    result = ProjectInstallResult(os.path.abspath(project_root))
+    args = [sys.executable, setup_file, "install", str(bool(live)), str(bool(override))]
+    command_result = run_command(args, cwd=result.project_root, prefix=result.name)
+    result.success = bool(command_result)
+    result.message = "custom {0}".format(os.path.basename(setup_file))
+    if not result.success:
+        result.message += " failed"
+    result.elapsed = time.time() - start_time
+    return result
+
+
+def install_projects(project_roots, live=False, override=False, jobs=None, link_mode=None, dedup=None,
+                     compile_bytecode=None, build_format=None, install_root=None, bin_install_dir=None):
+    """
+    Install many projects in one run, a failed project does not stop the others.
+    Same arguments as install_project(). The projects with a customized package_setup.py run it instead.
+
+    :param project_roots:       `list`          project directories
+    :return:                    `InstallReport` result of every project, in the given order
+    """
+    start_time = time.time()
+    report = InstallReport()
+    file_installer = FileInstaller(link_mode=link_mode)
+    for project_root in project_roots:
+        setup_file = get_custom_package_setup(project_root)
+        if setup_file:
+            logger.warning("'{0}' is not a stock package_setup.py, running it instead of the in-process "
+                           "install".format(setup_file))
+            ignored = [x for x, y in (("jobs", jobs), ("link_mode", link_mode), ("dedup", dedup),
+                                      ("compile_bytecode", compile_bytecode), ("build_format", build_format),
+                                      ("install_root", install_root), ("bin_install_dir", bin_install_dir))
+                       if y is not None]
+            if ignored:
+                logger.warning("Ignored for '{0}', only live and override are given to its package_setup.py : "
+                               "{1}".format(os.path.basename(project_root), ", ".join(ignored)))
+            result = run_package_setup(project_root, setup_file, live=live, override=override)
+            report.results[result.project_root] = result
+            continue
+
+        result = install_project(project_root, live=live, override=override, jobs=jobs, link_mode=link_mode,
+                                 dedup=dedup, compile_bytecode=compile_bytecode, build_format=build_format,
+                                 install_root=install_root, bin_install_dir=bin_install_dir,
+                                 file_installer=file_installer)
+        report.results[result.project_root] = result
+
+    file_installer.report()
+    report.elapsed = time.time() - start_time
+    return report
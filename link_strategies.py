@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Zero-copy file install strategies.
+
+Every file is installed with the cheapest strategy which works for its source/destination filesystem pair:
+
+    *   hardlink            same filesystem, no data is written at all (only if asked for)
+    *   reflink             copy-on-write clone (btrfs, xfs, ...), no data is written until modified
+    *   copy_file_range     kernel side copy, server side copy on NFS 4.2
+    *   sendfile            kernel side copy
+    *   copy                plain user space copy
+
+The working strategy is remembered per filesystem pair so the failing ones are only tried once.
+"""
+import os
+import errno
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+
+logger = get_logger(__name__)
+
+# ioctl request number of FICLONE from linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning "this strategy is not supported here", anything else is a real error
+_UNSUPPORTED_ERRORS = set([errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EOPNOTSUPP,
+                           getattr(errno, "ENOTSUP", errno.EOPNOTSUPP), errno.EMLINK])
+# fs.protected_hardlinks refuses links to files the user does not own with EPERM, a copy still works
+_HARDLINK_UNSUPPORTED_ERRORS = _UNSUPPORTED_ERRORS | set([errno.EPERM])
+
+
+def _hardlink(src_path, tmp_path):
+    os.link(src_path, tmp_path)
+
+
+def _reflink(src_path, tmp_path):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflink is not supported on this platform")
+
+    with open(src_path, "rb") as src_file:
+        with open(tmp_path, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+
+def _copy_file_range(src_path, tmp_path):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not supported on this platform")
+
+    with open(src_path, "rb") as src_file:
+        with open(tmp_path, "wb") as dst_file:
+            remaining = os.fstat(src_file.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(src_file.fileno(), dst_file.fileno(), remaining)
+                if copied == 0:
+                    # eg: procfs/sysfs files or a file truncated meanwhile, the tmp file would be short
+                    raise OSError(errno.EINVAL, "copy_file_range stopped {0} bytes early".format(remaining),
+                                  src_path)
+                remaining -= copied
+
+
+def _sendfile(src_path, tmp_path):
+    if not hasattr(os, "sendfile"):
+        raise OSError(errno.ENOSYS, "sendfile is not supported on this platform")
+
+    with open(src_path, "rb") as src_file:
+        with open(tmp_path, "wb") as dst_file:
+            offset = 0
+            size = os.fstat(src_file.fileno()).st_size
+            while offset < size:
+                sent = os.sendfile(dst_file.fileno(), src_file.fileno(), offset, size - offset)
+                if sent == 0:
+                    raise OSError(errno.EINVAL, "sendfile stopped {0} bytes early".format(size - offset), src_path)
+                offset += sent
+
+
+def _copy(src_path, tmp_path):
+    shutil.copyfile(src_path, tmp_path)
+
+
+# ordered from the cheapest to the most expensive
+STRATEGIES = [
+    (scm_constants.LINK_MODE_HARDLINK, _hardlink),
+    (scm_constants.LINK_MODE_REFLINK, _reflink),
+    (scm_constants.LINK_MODE_COPY_FILE_RANGE, _copy_file_range),
+    (scm_constants.LINK_MODE_SENDFILE, _sendfile),
+    (scm_constants.LINK_MODE_COPY, _copy),
+]
+
+
+def get_strategy_names(link_mode=None):
+    """
+    Get the ordered strategy names to try for given link mode
+
+    :param link_mode:           `str`           one of the constants.LINK_MODES, defaults to "auto"
+    :return:                    `list`          strategy names, cheapest first
+    """
+    link_mode = link_mode or scm_constants.LINK_MODE_AUTO
+    names = [name for name, _ in STRATEGIES]
+    if link_mode == scm_constants.LINK_MODE_AUTO:
+        # hardlinks share the inode with the source, so they are only used when asked for
+        return [x for x in names if x != scm_constants.LINK_MODE_HARDLINK]
+
+    if link_mode not in names:
+        raise ValueError("Invalid link mode '{0}', expected one of {1}".format(link_mode, scm_constants.LINK_MODES))
+
+    # the asked strategy first, and the cheaper-than-copy fallbacks after it
+    return names[names.index(link_mode):]
+
+
+class FileInstaller(object):
+    """
+    Callable which installs a single file with the cheapest working strategy.
+    Can be given as copy_function to the copy_engine.ParallelCopier.
+
+    Intended Usages:
+        installer = FileInstaller(link_mode="hardlink")
+        installer(src_path, dst_path)
+    """
+    def __init__(self, link_mode=None):
+        super(FileInstaller, self).__init__()
+        self.link_mode = link_mode or scm_constants.LINK_MODE_AUTO
+        self.strategy_names = get_strategy_names(link_mode=self.link_mode)
+        self.used = dict()
+
+        self._functions = dict(STRATEGIES)
+        self._device_strategies = dict()
+        self._lock = threading.Lock()
+
+    def __call__(self, src_path, dst_path):
+        return self.install(src_path=src_path, dst_path=dst_path)
+
+    def _candidates(self, device_pair):
+        with self._lock:
+            return list(self._device_strategies.get(device_pair, self.strategy_names))
+
+    def _drop_strategy(self, device_pair, name):
+        with self._lock:
+            names = self._device_strategies.get(device_pair, self.strategy_names)
+            self._device_strategies[device_pair] = [x for x in names if x != name]
+
+    def install(self, src_path, dst_path):
+        """
+        Install the src_path file to dst_path. The file is written next to the destination
+        and renamed over it, so readers never see a half written file.
+
+        :param src_path:            `str`           abs source file path
+        :param dst_path:            `str`           abs destination file path
+        :return:                    `str`           name of the strategy used
+        """
+        dst_dir = os.path.dirname(dst_path)
+        if not os.path.isdir(dst_dir):
+            try:
+                os.makedirs(dst_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        if os.path.exists(dst_path) and os.path.samefile(src_path, dst_path):
+            # already hardlinked to the source
+            return scm_constants.LINK_MODE_HARDLINK
+
+        device_pair = (os.stat(src_path).st_dev, os.stat(dst_dir).st_dev)
+        tmp_path = "{0}.scm_tmp.{1}.{2}".format(dst_path, os.getpid(), threading.current_thread().ident)
+
+        for name in self._candidates(device_pair):
+            if name == scm_constants.LINK_MODE_HARDLINK and device_pair[0] != device_pair[1]:
+                self._drop_strategy(device_pair, name)
+                continue
+
+            try:
+                self._functions[name](src_path, tmp_path)
+            except (OSError, IOError) as e:
+                _remove_silently(tmp_path)
+                if e.errno not in _get_unsupported_errors(name) or name == scm_constants.LINK_MODE_COPY:
+                    raise
+                logger.debug("'{0}' is not supported for {1}, falling back : {2}".format(name, device_pair, e))
+                self._drop_strategy(device_pair, name)
+                continue
+            except Exception:
+                _remove_silently(tmp_path)
+                raise
+
+            if name != scm_constants.LINK_MODE_HARDLINK:
+                shutil.copystat(src_path, tmp_path)
+            os.rename(tmp_path, dst_path)
+
+            with self._lock:
+                self.used[name] = self.used.get(name, 0) + 1
+            return name
+
+        raise OSError(errno.ENOSYS, "No install strategy worked for '{0}'".format(src_path))
+
+    def report(self):
+        """
+        Log how many files were installed with each strategy
+        """
+        if self.used:
+            used = ", ".join("{0}: {1}".format(x, self.used[x]) for x in self.strategy_names if x in self.used)
+            logger.info("Install strategies used : {0}".format(used))
+
+
+def _get_unsupported_errors(name):
+    if name == scm_constants.LINK_MODE_HARDLINK:
+        return _HARDLINK_UNSUPPORTED_ERRORS
+    return _UNSUPPORTED_ERRORS
+
+
+def _remove_silently(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
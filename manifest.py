@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+Install manifest for the scm_tools builds.
+
+Every build directory keeps a small json manifest with the path, size, mtime and content hash
+of each installed file so that the next install only has to touch what actually changed.
+"""
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+
+logger = get_logger(__name__)
+
+
+def get_file_hash(file_path):
+    """
+    Get the content hash for the given file
+
+    :param file_path:           `str`           abs file path
+    :return:                    `str`           hex digest of the file content
+    """
+    hasher = hashlib.sha1()
+    with open(file_path, "rb") as read_file:
+        chunk = read_file.read(scm_constants.HASH_CHUNK_SIZE)
+        while chunk:
+            hasher.update(chunk)
+            chunk = read_file.read(scm_constants.HASH_CHUNK_SIZE)
+    return hasher.hexdigest()
+
+
+class InstallSummary(object):
+    """
+    Counters of one install run
+    """
+    def __init__(self):
+        super(InstallSummary, self).__init__()
+        self.copied = list()
+        self.skipped = list()
+        self.removed = list()
+        self.failed = list()
+        self.release = None
+        self.bytecode = None
+
+    def __repr__(self):
+        return "Copied: {0}, Skipped: {1}, Removed: {2}, Failed: {3}".format(len(self.copied), len(self.skipped),
+                                                                             len(self.removed), len(self.failed))
+
+    def report(self, name=None):
+        """
+        Log the summary of the install
+        """
+        logger.info("Install summary{0}: {1}".format(" for '{0}'".format(name) if name else "", self))
+
+
+class InstallManifest(object):
+    """
+    Manifest of all the files installed in a build directory
+
+    Intended Usages:
+        old_manifest = InstallManifest.load(install_dir)
+        if old_manifest.is_unchanged(rel_path, src_path):
+            ...
+    """
+    def __init__(self, install_dir, entries=None):
+        super(InstallManifest, self).__init__()
+        self.install_dir = install_dir
+        self.entries = entries or OrderedDict()
+
+    @property
+    def file_path(self):
+        return os.path.join(self.install_dir, scm_constants.INSTALL_MANIFEST_FILE)
+
+    @classmethod
+    def load(cls, install_dir):
+        """
+        Load the manifest from given install directory, returns an empty manifest if nothing is installed
+        """
+        file_path = os.path.join(install_dir, scm_constants.INSTALL_MANIFEST_FILE)
+        if not os.path.isfile(file_path):
+            return cls(install_dir=install_dir)
+
+        try:
+            with open(file_path, "r") as read_file:
+                data = json.load(read_file, object_pairs_hook=OrderedDict)
+        except ValueError:
+            logger.warning("Install manifest is corrupted, doing a full install. '{0}'".format(file_path))
+            return cls(install_dir=install_dir)
+
+        return cls(install_dir=install_dir, entries=data.get("files", OrderedDict()))
+
+    def save(self):
+        """
+        Write the manifest to the install directory
+        """
+        if not os.path.isdir(self.install_dir):
+            os.makedirs(self.install_dir)
+
+        data_dict = OrderedDict()
+        data_dict["version"] = 1
+        data_dict["files"] = OrderedDict(sorted(self.entries.items()))
+
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, "w") as write_file:
+            json.dump(data_dict, write_file, indent=4)
+        os.rename(tmp_path, self.file_path)
+
+    def __contains__(self, rel_path):
+        return rel_path in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def get(self, rel_path):
+        return self.entries.get(rel_path)
+
+    def add(self, rel_path, size, mtime, file_hash):
+        """
+        Record an installed file
+        """
+        self.entries[rel_path] = OrderedDict([("size", size), ("mtime", mtime), ("hash", file_hash)])
+
+    def remove(self, rel_path):
+        """
+        Forget a removed file
+        """
+        return self.entries.pop(rel_path, None)
+
+    def add_from_source(self, rel_path, src_path, file_hash=None):
+        """
+        Record an installed file by reading the stats of its source file
+        """
+        stat = os.stat(src_path)
+        file_hash = file_hash or get_file_hash(src_path)
+        self.add(rel_path=rel_path, size=stat.st_size, mtime=stat.st_mtime, file_hash=file_hash)
+
+    def is_unchanged(self, rel_path, src_path):
+        """
+        Check if the source file is same as the one recorded in the manifest.
+        A cheap size/mtime check is done first and the content hash is only computed if the mtime changed.
+
+        :param rel_path:            `str`           path relative to the install directory
+        :param src_path:            `str`           abs path of the source file
+        :return:                    `bool`          True if the installed copy is still valid
+        """
+        entry = self.entries.get(rel_path)
+        if not entry:
+            return False
+
+        if not os.path.isfile(os.path.join(self.install_dir, rel_path)):
+            return False
+
+        stat = os.stat(src_path)
+        if stat.st_size != entry["size"]:
+            return False
+
+        if stat.st_mtime == entry["mtime"]:
+            return True
+
+        return get_file_hash(src_path) == entry["hash"]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Host level bare mirror cache of the git repositories.
+
+One bare mirror per repository url is kept in MIRROR_CACHE_DIR and refreshed from upstream at most once
+every MIRROR_REFRESH_SECONDS. Clones and fetches take their objects from the local mirror, so only the
+mirror refresh goes over the network.
+
+A deadline given to ensure_mirror() covers the wait for the mirror lock and the git command, so a caller
+stuck behind a hung refresh of another process gives up with it.
+"""
+import os
+import time
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .command_runner import run_git, DEFAULT_TIMEOUT, get_timeout
+
+logger = get_logger(__name__)
+
+REFRESH_STAMP_FILE = "scm_last_refresh"
+LOCK_POLL_SECONDS = 0.1
+
+
+def get_mirror_path(url, cache_dir=None):
+    """
+    Get the mirror directory for the given repository url
+
+    :param url:                 `str`           repository url
+    :param cache_dir:           `str`           mirror cache directory, defaults to MIRROR_CACHE_DIR
+    :return:                    `str`           abs path of the bare mirror, eg: <cache_dir>/my_repo-1a2b3c4d.git
+    """
+    cache_dir = cache_dir or scm_constants.MIRROR_CACHE_DIR
+    name = os.path.basename(url.rstrip("/")).rsplit(":", 1)[-1]
+    if name.endswith(".git"):
+        name = name[:-4]
+    url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(cache_dir, "{0}-{1}.git".format(name, url_hash))
+
+
+@contextmanager
+def _mirror_lock(mirror_path, deadline=None):
+    """
+    Exclusive lock of a mirror so concurrent clones don't refresh the same mirror twice
+
+    :param deadline:            `float`         give up waiting for the lock at this time, None waits forever
+    :return:                    `bool`          True if the lock is held
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    with open(mirror_path + ".lock", "a") as lock_file:
+        if deadline is None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except (IOError, OSError):
+                    if time.time() >= deadline:
+                        yield False
+                        return
+                    time.sleep(LOCK_POLL_SECONDS)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _get_remaining(deadline, timeout):
+    # the time left until the deadline, or the command's own timeout if there is no deadline
+    return timeout if deadline is None else max(deadline - time.time(), 0)
+
+
+def _run_git(args, cwd=None, timeout=None):
+    if timeout is not None and timeout <= 0:
+        logger.warning("No time left for 'git {0}'".format(args[0]))
+        return -1
+    return run_git(args, cwd=cwd, log_output=False, timeout=timeout).exit_code
+
+
+def get_last_refresh(mirror_path):
+    """
+    :return:                    `float`         time of the last successful refresh, None if never refreshed
+    """
+    stamp_file = os.path.join(mirror_path, REFRESH_STAMP_FILE)
+    if not os.path.isfile(stamp_file):
+        return None
+    return os.path.getmtime(stamp_file)
+
+
+def _touch_refresh_stamp(mirror_path):
+    with open(os.path.join(mirror_path, REFRESH_STAMP_FILE), "w") as stamp:
+        stamp.write(str(time.time()))
+
+
+def ensure_mirror(url, cache_dir=None, max_age=None, force_refresh=False, timeout=DEFAULT_TIMEOUT):
+    """
+    Create or refresh the local mirror of the url. Upstream is only contacted if the mirror
+    doesn't exist or its last refresh is older than max_age.
+
+    :param url:                 `str`           upstream repository url
+    :param cache_dir:           `str`           mirror cache directory, defaults to MIRROR_CACHE_DIR
+    :param max_age:             `int`           refresh interval in seconds, defaults to MIRROR_REFRESH_SECONDS
+    :param force_refresh:       `bool`          refresh even if the mirror is fresh
+    :param timeout:             `int`           deadline of the lock wait and the git command together, None
+                                                waits forever. Defaults to GIT_CLONE_TIMEOUT for a new mirror
+                                                and GIT_COMMAND_TIMEOUT for a refresh, without a lock deadline
+    :return:                    `str`           mirror path, None if the mirror couldn't be created, or
+                                                couldn't be refreshed with force_refresh or a max_age of 0
+    """
+    max_age = scm_constants.MIRROR_REFRESH_SECONDS if max_age is None else max_age
+    deadline = None if timeout is DEFAULT_TIMEOUT or timeout is None else time.time() + timeout
+    clone_timeout = get_timeout(timeout, scm_constants.GIT_CLONE_TIMEOUT)
+    refresh_timeout = get_timeout(timeout, scm_constants.GIT_COMMAND_TIMEOUT)
+    mirror_path = get_mirror_path(url, cache_dir=cache_dir)
+    mirror_dir = os.path.dirname(mirror_path)
+
+    try:
+        if not os.path.isdir(mirror_dir):
+            os.makedirs(mirror_dir)
+    except OSError as e:
+        logger.warning("Can't create the mirror cache directory '{0}' : {1}".format(mirror_dir, e))
+        return None
+
+    with _mirror_lock(mirror_path, deadline=deadline) as locked:
+        if not locked:
+            logger.warning("Timed out waiting for the lock of the mirror '{0}'".format(mirror_path))
+            return None
+
+        last_refresh = get_last_refresh(mirror_path)
+
+        if last_refresh is None:
+            logger.info("Creating the local mirror of '{0}'".format(url))
+            tmp_path = "{0}.scm_tmp.{1}".format(mirror_path, os.getpid())
+            shutil.rmtree(mirror_path, ignore_errors=True)
+            if _run_git(["clone", "--mirror", "--quiet", url, tmp_path],
+                        timeout=_get_remaining(deadline, clone_timeout)) != 0:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                logger.warning("Failed to create the mirror of '{0}'".format(url))
+                return None
+            # partial clones from the mirror need the filter support of upload-pack
+            _run_git(["config", "uploadpack.allowFilter", "true"], cwd=tmp_path)
+            os.rename(tmp_path, mirror_path)
+            _touch_refresh_stamp(mirror_path)
+            return mirror_path
+
+        if force_refresh or time.time() - last_refresh > max_age:
+            logger.debug("Refreshing the local mirror of '{0}'".format(url))
+            if _run_git(["fetch", "--prune", "--quiet", "origin"], cwd=mirror_path,
+                        timeout=_get_remaining(deadline, refresh_timeout)) != 0:
+                if force_refresh or max_age == 0:
+                    # the caller needs the current upstream, the old objects would look up to date
+                    logger.warning("Failed to refresh the mirror of '{0}'".format(url))
+                    return None
+                logger.warning("Failed to refresh the mirror of '{0}', using the old objects.".format(url))
+            else:
+                _touch_refresh_stamp(mirror_path)
+
+    return mirror_path
+
+
+def get_origin_url(directory_path):
+    """
+    Get the url of the origin remote of the repository at directory_path, None if not set
+    """
+    result = run_git(["config", "--get", "remote.origin.url"], cwd=directory_path, capture=True, log_output=False)
+    return result.output.strip() or None if result else None
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content-addressed object store for the installed builds.
+
+Each file is hashed once and stored as a single read-only blob per content,
+the install trees only hold hardlinks to these blobs:
+
+    PY_BUILDS_DIR/
+        .objects/1a/2b3c4d....444       blob, the permission bits are part of the name
+        .objects/1a/2b3c4d....555       executable blob of the same content
+        <pkg>/module.py                 hardlink to the blob
+
+A blob which is not linked from any install tree anymore has a link count of 1 and is removed by gc().
+An install linking a blob which gc() removes at the same time stores the blob again.
+"""
+import os
+import stat
+import time
+import errno
+import shutil
+import threading
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .manifest import get_file_hash
+from .link_strategies import FileInstaller
+
+logger = get_logger(__name__)
+
+# link() stores the blob again if gc() removed it in the middle, this many times
+LINK_ATTEMPTS = 3
+
+
+class ObjectStore(object):
+    """
+    Hardlink based content-addressed blob store
+
+    Intended Usages:
+        store = ObjectStore.for_install_root(scm_constants.PY_BUILDS_DIR)
+        file_hash = store.link(src_path, dst_path)
+        ...
+        store.gc()
+    """
+    def __init__(self, root_path):
+        super(ObjectStore, self).__init__()
+        self.root_path = root_path
+        self._fallback = FileInstaller()
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.reused = 0
+
+    def __call__(self, src_path, dst_path):
+        return self.link(src_path=src_path, dst_path=dst_path)
+
+    @classmethod
+    def for_install_root(cls, install_root):
+        """
+        Get the store of the given install root, the blobs must be on the same filesystem as the installs.
+        """
+        return cls(root_path=os.path.join(install_root, scm_constants.OBJECT_STORE_DIR_NAME))
+
+    def get_blob_path(self, file_hash, mode):
+        """
+        :param file_hash:           `str`           content hash
+        :param mode:                `int`           permission bits of the blob, the same content with other
+                                                    bits is a separate blob
+        :return:                    `str`           abs path of the blob
+        """
+        name = "{0}.{1:03o}".format(file_hash[2:], get_blob_mode(mode))
+        return os.path.join(self.root_path, file_hash[:2], name)
+
+    def add(self, src_path, file_hash=None):
+        """
+        Add the given file to the store, nothing is written if the content is already there.
+
+        :param src_path:            `str`           abs source file path
+        :param file_hash:           `str`           content hash if already known
+        :return:                    `tuple`         (file_hash, blob_path)
+        """
+        file_hash = file_hash or get_file_hash(src_path)
+        blob_mode = get_blob_mode(os.stat(src_path).st_mode)
+        blob_path = self.get_blob_path(file_hash, blob_mode)
+
+        if os.path.isfile(blob_path):
+            with self._lock:
+                self.reused += 1
+            return file_hash, blob_path
+
+        blob_dir = os.path.dirname(blob_path)
+        if not os.path.isdir(blob_dir):
+            try:
+                os.makedirs(blob_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        tmp_path = "{0}.scm_tmp.{1}.{2}".format(blob_path, os.getpid(), threading.current_thread().ident)
+        shutil.copyfile(src_path, tmp_path)
+        os.chmod(tmp_path, blob_mode)
+        os.rename(tmp_path, blob_path)
+
+        with self._lock:
+            self.stored += 1
+        return file_hash, blob_path
+
+    def link(self, src_path, dst_path, file_hash=None):
+        """
+        Install src_path at dst_path as a hardlink to its blob. Falls back to a normal install
+        if the store is not on the same filesystem as the destination.
+
+        :param src_path:            `str`           abs source file path
+        :param dst_path:            `str`           abs destination file path
+        :param file_hash:           `str`           content hash if already known
+        :return:                    `str`           content hash of the file
+        """
+        for attempt in range(1, LINK_ATTEMPTS + 1):
+            try:
+                file_hash, blob_path = self.add(src_path=src_path, file_hash=file_hash)
+                return self._link_blob(blob_path=blob_path, src_path=src_path, dst_path=dst_path,
+                                       file_hash=file_hash)
+            except (IOError, OSError) as e:
+                # gc() removed the blob or its directory between add() and the link
+                if e.errno != errno.ENOENT or attempt == LINK_ATTEMPTS or not os.path.isfile(src_path):
+                    raise
+                logger.debug("Blob of '{0}' was removed by gc, storing it again".format(src_path))
+
+    def _link_blob(self, blob_path, src_path, dst_path, file_hash):
+        if os.path.exists(dst_path) and os.path.samefile(blob_path, dst_path):
+            return file_hash
+
+        tmp_path = "{0}.scm_tmp.{1}.{2}".format(dst_path, os.getpid(), threading.current_thread().ident)
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            logger.debug("Can't link from the object store, installing a copy : {0}".format(e))
+            self._fallback(src_path, dst_path)
+            return file_hash
+
+        os.rename(tmp_path, dst_path)
+        return file_hash
+
+    def gc(self, dry_run=False, grace_seconds=None):
+        """
+        Remove all the blobs which are not linked from any install anymore.
+        Blobs changed in the last GC_GRACE_SECONDS are kept, they might be in the middle of an install.
+
+        :param dry_run:             `bool`          only report, don't remove anything
+        :param grace_seconds:       `int`           override GC_GRACE_SECONDS
+        :return:                    `tuple`         (number of removed blobs, freed bytes)
+        """
+        removed, freed = 0, 0
+        if not os.path.isdir(self.root_path):
+            return removed, freed
+
+        grace_seconds = scm_constants.GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        min_ctime = time.time() - grace_seconds
+        for root, dirs, files in os.walk(self.root_path):
+            for each_file in files:
+                blob_path = os.path.join(root, each_file)
+                blob_stat = os.lstat(blob_path)
+                if blob_stat.st_ctime > min_ctime:
+                    continue
+                if blob_stat.st_nlink > 1 and ".scm_tmp." not in each_file:
+                    continue
+
+                removed += 1
+                freed += blob_stat.st_size
+                if not dry_run:
+                    os.remove(blob_path)
+
+            if not dry_run and root != self.root_path and not os.listdir(root):
+                os.rmdir(root)
+
+        logger.info("Object store gc{0}: {1} blob(s), {2} bytes freed from '{3}'".format(
+            " (dry run)" if dry_run else "", removed, freed, self.root_path))
+        return removed, freed
+
+    def report(self):
+        """
+        Log the number of new and reused blobs
+        """
+        logger.info("Object store: {0} new blob(s), {1} reused".format(self.stored, self.reused))
+
+
+def get_blob_mode(mode):
+    """
+    Permission bits of the blob of a file with the given mode, blobs are shared by all the installs so
+    nobody should edit them in place
+
+    :param mode:                `int`           st_mode of the source file
+    :return:                    `int`           read-only permission bits, eg: 0o444 or 0o555
+    """
+    return stat.S_IMODE(mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
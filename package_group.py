@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+"""
+Groups of packages which are fetched, rebased, pushed and checked together.
+
+A group is a directory of package checkouts. Its members are listed in the PACKAGE_GROUP_FILE of that
+directory, or discovered from the .scmconf files of its sub directories when there is no group file.
+Every operation runs over all the packages on the async_git engine, at most GIT_JOBS packages at the same
+time, so a group takes about as long as its slowest package.
+"""
+import os
+import json
+import time
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .git_utils import PyGitRepository
+
+logger = get_logger(__name__)
+
+
+def read_manifest(file_path):
+    """
+    Read the package manifest file, one package per line with an optional branch name:
+
+        my_package
+        other_package   develop
+
+    :param file_path:           `str`           manifest file path
+    :return:                    `list`          (package name, branch or None) pairs
+    """
+    packages = list()
+    with open(file_path, "r") as read_file:
+        for line in read_file:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            packages.append((parts[0], parts[1] if len(parts) > 1 else None))
+    return packages
+
+
+class GroupResult(object):
+    """
+    Result of one package of a PackageGroup operation
+    """
+    def __init__(self, pkg_name, success, elapsed, message="", value=None, disk_path=None):
+        super(GroupResult, self).__init__()
+        self.pkg_name = pkg_name
+        self.disk_path = disk_path
+        self.success = success
+        self.elapsed = elapsed
+        self.message = message
+        self.value = value
+
+    def to_dict(self):
+        data_dict = OrderedDict()
+        data_dict["pkg_name"] = self.pkg_name
+        data_dict["disk_path"] = self.disk_path
+        data_dict["success"] = self.success
+        data_dict["elapsed"] = round(self.elapsed, 3)
+        data_dict["message"] = self.message
+        if hasattr(self.value, "to_dict"):
+            data_dict["value"] = self.value.to_dict()
+        return data_dict
+
+
+class PackageGroup(object):
+    """
+    Set of package checkouts handled together
+
+    Intended Usages:
+        group = PackageGroup.load("/work/my_show")
+        results = group.rebase(with_branch="master", jobs=16)
+        logger.info(format_group_report(results))
+    """
+    def __init__(self, group_path, name=None):
+        super(PackageGroup, self).__init__()
+        self.group_path = os.path.abspath(group_path)
+        self.name = name or os.path.basename(self.group_path)
+        self.packages = OrderedDict()
+        self.branches = dict()
+
+    def __repr__(self):
+        return "PackageGroup('{0}', {1} package(s))".format(self.name, len(self.packages))
+
+    def __len__(self):
+        return len(self.packages)
+
+    def __iter__(self):
+        return iter(self.packages.values())
+
+    def __contains__(self, pkg_name):
+        return pkg_name in self.packages
+
+    @property
+    def group_file(self):
+        return os.path.join(self.group_path, scm_constants.PACKAGE_GROUP_FILE)
+
+    @classmethod
+    def load(cls, group_path):
+        """
+        Load the group from its group file, or discover the packages if there is no group file
+        """
+        group = cls(group_path=group_path)
+        if not os.path.isfile(group.group_file):
+            return cls.discover(group_path)
+
+        with open(group.group_file, "r") as read_file:
+            data = json.load(read_file)
+
+        group.name = data.get("name") or group.name
+        for package in data.get("packages", list()):
+            group.add_by_name(package["pkg_name"], branch=package.get("branch"))
+        return group
+
+    @classmethod
+    def discover(cls, group_path):
+        """
+        Create the group from all the sub directories of group_path which have a PACKAGE_CONFIG_FILE
+        """
+        group = cls(group_path=group_path)
+        if not os.path.isdir(group.group_path):
+            return group
+
+        for each_name in sorted(os.listdir(group.group_path)):
+            package_path = os.path.join(group.group_path, each_name)
+            if os.path.isfile(os.path.join(package_path, scm_constants.PACKAGE_CONFIG_FILE)):
+                package = PyGitRepository.from_path(path=package_path)
+                if package:
+                    group.add(package)
+        return group
+
+    @classmethod
+    def from_manifest(cls, file_path, group_path=None):
+        """
+        Create the group from a package manifest file, see read_manifest()
+
+        :param file_path:           `str`           manifest file path
+        :param group_path:          `str`           directory of the checkouts, defaults to os.getcwd()
+        """
+        group = cls(group_path=group_path or os.getcwd(),
+                    name=os.path.splitext(os.path.basename(file_path))[0])
+        for pkg_name, branch in read_manifest(file_path):
+            group.add_by_name(pkg_name, branch=branch)
+        return group
+
+    def add(self, package, branch=None):
+        """
+        :param package:             `PyGitRepository`
+        :param branch:              `str`           upstream branch of the package, defaults to MASTER_BRANCH
+        """
+        self.packages[package.pkg_name] = package
+        if branch:
+            self.branches[package.pkg_name] = branch
+        return package
+
+    def add_by_name(self, pkg_name, branch=None):
+        package_path = os.path.join(self.group_path, pkg_name)
+        package = None
+        if os.path.isfile(os.path.join(package_path, scm_constants.PACKAGE_CONFIG_FILE)):
+            package = PyGitRepository.from_path(path=package_path)
+        return self.add(package or PyGitRepository(pkg_name=pkg_name, disk_path=package_path), branch=branch)
+
+    def save(self):
+        """
+        Write the group file
+        """
+        data_dict = OrderedDict()
+        data_dict["name"] = self.name
+        data_dict["packages"] = [OrderedDict([("pkg_name", x), ("branch", self.branches.get(x))])
+                                 for x in self.packages]
+        with open(self.group_file, "w") as write_file:
+            json.dump(data_dict, write_file, indent=4)
+        return True
+
+    def get_branch(self, pkg_name):
+        return self.branches.get(pkg_name) or scm_constants.MASTER_BRANCH
+
+    def run(self, operation, jobs=None):
+        """
+        Run the operation for every package with at most $jobs packages at the same time, see run_for_packages()
+
+        :return:                    `OrderedDict`   {package name: GroupResult}
+        """
+        return OrderedDict((x.pkg_name, x) for x in run_for_packages(self.packages.values(), operation, jobs=jobs))
+
+    def fetch(self, jobs=None):
+        """
+        Update the origin/* branches of all the packages
+        """
+        from .async_git import fetch_origin_async
+
+        async def _fetch(package):
+            return await fetch_origin_async(directory_path=package.disk_path, prefix=package.pkg_name)
+
+        return self.run(_fetch, jobs=jobs)
+
+    def rebase(self, with_branch=None, fast=None, jobs=None):
+        """
+        Rebase the active branch of all the packages, onto with_branch or the group branch of each package
+        """
+        results = self.run(lambda x: x.rebase(with_branch=with_branch or self.get_branch(x.pkg_name), fast=fast),
+                           jobs=jobs)
+        for result in results.values():
+            if result.value is not None and not result.message:
+                result.message = result.value.status
+        return results
+
+    def status(self, untracked=False, jobs=None):
+        """
+        Get the RepositoryStatus of all the packages
+
+        :param untracked:           `bool`          count the untracked files too
+        """
+        results = get_packages_status(self.packages.values(), untracked=untracked, jobs=jobs)
+        return OrderedDict((x.pkg_name, x) for x in results)
+
+    def push(self, open_merge_request=False, force=False, jobs=None):
+        """
+        Push the active branch of all the packages
+        """
+        return self.run(lambda x: x.push(open_merge_request=open_merge_request, force=force,
+                                         source_branch=self.get_branch(x.pkg_name)), jobs=jobs)
+
+
+def run_for_packages(packages, operation, jobs=None):
+    """
+    Run the operation for every package with at most $jobs packages at the same time, on the async_git engine.
+    A coroutine function operation (eg: one awaiting fetch_origin_async()) runs in the event loop, any other
+    callable in the executor threads of the loop.
+
+    :param packages:            `list`          PyGitRepository objects
+    :param operation:           `callable`      called with the PyGitRepository, returns a truthy value on success
+    :param jobs:                `int`           number of parallel packages, defaults to GIT_JOBS
+    :return:                    `list`          GroupResult per package, in the order of the packages
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from .async_git import run_sync, run_concurrently, in_thread
+
+    jobs = jobs or scm_constants.GIT_JOBS
+
+    async def _run(package):
+        start_time = time.time()
+        if not os.path.isdir(package.disk_path):
+            return GroupResult(pkg_name=package.pkg_name, success=False, elapsed=0.0, message="not cloned",
+                               disk_path=package.disk_path)
+        try:
+            if asyncio.iscoroutinefunction(operation):
+                value = await operation(package)
+            else:
+                value = await in_thread(operation, package)
+            success = bool(value)
+            message = ""
+        except Exception as e:
+            value, success, message = None, False, str(e)
+        return GroupResult(pkg_name=package.pkg_name, success=success, elapsed=time.time() - start_time,
+                           message=message, value=value, disk_path=package.disk_path)
+
+    async def _run_all():
+        # the blocking operations get one thread per job, the default executor may be smaller
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=jobs))
+        return await run_concurrently([_run(x) for x in packages], jobs=jobs)
+
+    packages = list(packages)
+    return run_sync(_run_all()) if packages else list()
+
+
+def get_packages_status(packages, untracked=False, jobs=None):
+    """
+    Get the RepositoryStatus of many packages concurrently, the status summary is the result message
+
+    :param packages:            `list`          PyGitRepository objects
+    :param untracked:           `bool`          count the untracked files too
+    :param jobs:                `int`           number of parallel packages, defaults to GIT_JOBS
+    :return:                    `list`          GroupResult per package with the RepositoryStatus as value
+    """
+    results = run_for_packages(packages, lambda x: x.status(untracked=untracked), jobs=jobs)
+    for result in results:
+        if result.value is not None:
+            result.message = result.value.describe()
+    return results
+
+
+def format_status_report(results):
+    """
+    Format the get_packages_status() results as a table
+
+    :param results:             `list`          GroupResult with RepositoryStatus values
+    :return:                    `str`           table text
+    """
+    results = list(results.values() if isinstance(results, dict) else results)
+    rows = [("Package", "Branch", "Ahead", "Behind", "Dirty", "Stash", "Untracked", "Path")]
+    for result in results:
+        status = result.value
+        if status is None:
+            rows.append((result.pkg_name, "-", "", "", "", "", "", "{0} ({1})".format(
+                result.disk_path, result.message or "failed")))
+            continue
+        rows.append((result.pkg_name, status.branch or "(detached)", str(status.ahead), str(status.behind),
+                     "yes" if status.is_dirty else "", str(status.stashes or ""),
+                     "" if status.untracked is None else str(status.untracked), result.disk_path))
+
+    widths = [max(len(x[i]) for x in rows) for i in range(len(rows[0]) - 1)]
+    lines = ["  ".join(x.ljust(y) for x, y in zip(row, widths)) + "  " + row[-1] for row in rows]
+
+    with_work = len([x for x in results if x.value is not None and x.value.has_local_work])
+    failed = len([x for x in results if x.value is None])
+    lines.append("{0} repositories, {1} with local work, {2} failed".format(len(results), with_work, failed))
+    return "\n".join(lines)
+
+
+def format_group_report(results, operation="done"):
+    """
+    Format the PackageGroup results as a table
+
+    :param results:             `dict`          {package name: GroupResult}
+    :param operation:           `str`           verb for the summary line, eg: "rebased"
+    :return:                    `str`           table text
+    """
+    width = max([len("Package")] + [len(x) for x in results])
+    lines = ["{0:<{width}}  {1:<7}  {2:>8}  {3}".format("Package", "Status", "Time", "Message", width=width)]
+    for result in results.values():
+        lines.append("{0:<{width}}  {1:<7}  {2:>7.1f}s  {3}".format(
+            result.pkg_name, "OK" if result.success else "FAILED", result.elapsed, result.message, width=width))
+
+    failed = len([x for x in results.values() if not x.success])
+    slowest = max([x.elapsed for x in results.values()] or [0.0])
+    lines.append("{0} {1}, {2} failed, slowest {3:.1f}s".format(len(results) - failed, operation, failed, slowest))
+    return "\n".join(lines)
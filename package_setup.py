@@ -7,6 +7,7 @@ It can configure the whole package for your running env
 """
 import os
 import sys
+import argparse
 
 from logIO import get_logger
 from my_python.common.general import get_project_root_from_path
@@ -20,11 +21,6 @@ if not package_directory:
     logger.warning("Valid project files not found in the current path.")
     sys.exit(0)
 
-# setup the PYTHON and BIN path for process
-PYTHON_ROOT = os.path.join(package_directory, "src", os.path.basename(package_directory))
-BIN_ROOT = os.path.join(package_directory, "src/bin")
-
-
 # Now check if user has given any other arguments for installation and all
 if sys.argv:
     logger.debug("Arguments given for package_setup: {0}".format(sys.argv))
@@ -32,16 +28,25 @@ if sys.argv:
     if "install" in sys.argv:
         logger.debug("Installing package files...")
 
-        _py, process, live, override = sys.argv
-        from scm_tools.common import scm_install_package, scm_install_bin_files
-
-        if os.path.exists(PYTHON_ROOT):
-            logger.debug("Installing python files from : '{0}'".format(PYTHON_ROOT))
-            scm_install_package(PYTHON_ROOT, for_qc=eval(live), override=eval(override))
-
-        if os.path.exists(BIN_ROOT):
-            logger.debug("Installing script/bin files from : '{0}'".format(BIN_ROOT))
-            scm_install_bin_files(bin_directory=BIN_ROOT, for_qc=eval(live), override=eval(override))
+        _py, process, live, override = sys.argv[:4]
+
+        # optional arguments after the positional ones: [jobs] [--dedup] [--no_compile] [--archive]
+        extra_parser = argparse.ArgumentParser()
+        extra_parser.add_argument("jobs", nargs="?", type=int, default=None)
+        extra_parser.add_argument("--dedup", action="store_true", default=None)
+        extra_parser.add_argument("--no_compile", action="store_true", default=False)
+        extra_parser.add_argument("--archive", action="store_true", default=False)
+        extra_args = extra_parser.parse_args(sys.argv[4:])
+        from scm_tools.installer import install_project
+
+        # live and override are given as str(bool)
+        result = install_project(package_directory, live=live == "True", override=override == "True",
+                                 jobs=extra_args.jobs, dedup=extra_args.dedup,
+                                 compile_bytecode=False if extra_args.no_compile else None,
+                                 build_format="archive" if extra_args.archive else None)
+        if not result.success:
+            logger.error("Setup failed for '{0}' package : {1}".format(result.name, result.message))
+            sys.exit(1)
 
 logger.info("Setup completed for '{0}' package.".format(os.path.basename(package_directory)))
 
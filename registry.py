@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+"""
+Persistent registry of all the known package checkouts.
+
+Every checkout (pkg_name, disk_path, ssh_path, ticket_id, last known branch) is a row of a SQLite table
+keyed by disk_path, with an index on pkg_name. Both lookups by package name and by path prefix are
+index range scans, so no filesystem walk is needed to answer "where are all my checkouts of X".
+
+Rows are written by PyGitRepository._write_config() (clone, from_path of a new project) and fixed up by
+rescan() when checkouts are moved, removed or switched to another branch. rescan() remembers the mtime and
+the sub directories of every directory it walked: adding or removing an entry changes the mtime of its
+directory, so the unchanged directories are not listed again on the next rescan.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .git_refs import get_branch_state
+
+logger = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkouts (
+    disk_path       TEXT PRIMARY KEY,
+    pkg_name        TEXT NOT NULL,
+    ssh_path        TEXT,
+    ticket_id       TEXT,
+    branch          TEXT,
+    config_mtime    REAL,
+    updated         REAL
+);
+CREATE INDEX IF NOT EXISTS checkouts_pkg_name ON checkouts (pkg_name);
+CREATE TABLE IF NOT EXISTS roots (
+    root_path       TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS scanned_dirs (
+    dir_path        TEXT PRIMARY KEY,
+    mtime           REAL,
+    sub_dirs        TEXT
+);
+"""
+COLUMNS = ("disk_path", "pkg_name", "ssh_path", "ticket_id", "branch", "config_mtime", "updated")
+# a directory changed this close to the scan may change again within the same mtime, it's listed again next time
+RACY_MTIME_SECONDS = 2
+
+
+class CheckoutRecord(object):
+    """
+    One registered checkout
+    """
+    def __init__(self, disk_path, pkg_name, ssh_path=None, ticket_id=None, branch=None, config_mtime=None,
+                 updated=None):
+        super(CheckoutRecord, self).__init__()
+        self.disk_path = disk_path
+        self.pkg_name = pkg_name
+        self.ssh_path = ssh_path
+        self.ticket_id = ticket_id
+        self.branch = branch
+        self.config_mtime = config_mtime
+        self.updated = updated
+
+    def __repr__(self):
+        return "CheckoutRecord({0}:{1} '{2}')".format(self.pkg_name, self.branch, self.disk_path)
+
+    @property
+    def config_file(self):
+        return os.path.join(self.disk_path, scm_constants.PACKAGE_CONFIG_FILE)
+
+    def to_dict(self):
+        return OrderedDict((x, getattr(self, x)) for x in COLUMNS)
+
+
+def _get_config_mtime(disk_path):
+    try:
+        return os.path.getmtime(os.path.join(disk_path, scm_constants.PACKAGE_CONFIG_FILE))
+    except OSError:
+        return None
+
+
+def _path_range(path_prefix):
+    # all the paths under path_prefix sort between "<prefix>/" and "<prefix>0", '0' comes right after '/'
+    path_prefix = path_prefix.rstrip(os.sep)
+    return path_prefix + os.sep, path_prefix + chr(ord(os.sep) + 1)
+
+
+class WorkspaceRegistry(object):
+    """
+    SQLite registry of the checkouts, safe to use from multiple threads and processes
+
+    Intended Usages:
+        registry = get_registry()
+        registry.find_by_name("my_package")
+        registry.find_by_prefix("/work/my_show")
+        registry.rescan(roots=["/work"])
+        registry.close()
+    """
+    def __init__(self, db_path=None):
+        super(WorkspaceRegistry, self).__init__()
+        self.db_path = os.path.abspath(os.path.expanduser(db_path or scm_constants.REGISTRY_FILE))
+        self._local = threading.local()
+        self._connections = list()
+        self._connections_lock = threading.Lock()
+
+    def __repr__(self):
+        return "WorkspaceRegistry('{0}')".format(self.db_path)
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+
+        db_dir = os.path.dirname(self.db_path)
+        if not os.path.isdir(db_dir):
+            try:
+                os.makedirs(db_dir)
+            except OSError:
+                # created by another process meanwhile
+                if not os.path.isdir(db_dir):
+                    raise
+
+        # every thread has its own connection, only close() uses them from another thread
+        connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        connection.executescript(SCHEMA)
+        self._local.connection = connection
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def close(self):
+        """
+        Close the connections of all the threads, the next call opens a new one. Don't call it while
+        other threads are still using the registry.
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, list()
+            self._local = threading.local()
+
+        for connection in connections:
+            connection.close()
+
+    def _query(self, sql, parameters=()):
+        rows = self._connect().execute(sql, parameters).fetchall()
+        return [CheckoutRecord(*x) for x in rows]
+
+    def register(self, pkg_name, disk_path, ssh_path=None, ticket_id=None, branch=None):
+        """
+        Add or update the checkout at disk_path
+        """
+        disk_path = os.path.abspath(disk_path)
+        connection = self._connect()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO checkouts ({0}) VALUES (?, ?, ?, ?, ?, ?, ?)".format(
+                ", ".join(COLUMNS)), (disk_path, pkg_name, ssh_path, ticket_id, branch,
+                                      _get_config_mtime(disk_path), time.time()))
+
+    def register_package(self, package):
+        """
+        Add or update the checkout of the PyGitRepository
+        """
+        branch = get_branch_state(directory_path=package.disk_path, with_branches=False)[0]
+        self.register(pkg_name=package.pkg_name, disk_path=package.disk_path, ssh_path=package.ssh_path,
+                      ticket_id=package.ticket_id, branch=branch)
+
+    def unregister(self, disk_path):
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM checkouts WHERE disk_path = ?", (os.path.abspath(disk_path),))
+
+    def get(self, disk_path):
+        """
+        :return:                    `CheckoutRecord`    None if the path is not a registered checkout
+        """
+        records = self._query("SELECT {0} FROM checkouts WHERE disk_path = ?".format(", ".join(COLUMNS)),
+                              (os.path.abspath(disk_path),))
+        return records[0] if records else None
+
+    def find_by_name(self, pkg_name):
+        """
+        :return:                    `list`          CheckoutRecord of all the checkouts of the package
+        """
+        return self._query("SELECT {0} FROM checkouts WHERE pkg_name = ? ORDER BY disk_path".format(
+            ", ".join(COLUMNS)), (pkg_name,))
+
+    def find_by_prefix(self, path_prefix):
+        """
+        :return:                    `list`          CheckoutRecord of all the checkouts at or under path_prefix
+        """
+        path_prefix = os.path.abspath(path_prefix)
+        low, high = _path_range(path_prefix)
+        return self._query("SELECT {0} FROM checkouts WHERE disk_path = ? OR (disk_path >= ? AND disk_path < ?) "
+                           "ORDER BY disk_path".format(", ".join(COLUMNS)), (path_prefix, low, high))
+
+    def find_containing(self, path):
+        """
+        Find the checkout which contains the given path, one primary key lookup per parent directory
+
+        :return:                    `CheckoutRecord`    innermost checkout, None if the path is not in any
+        """
+        path = os.path.abspath(path)
+        parents = [path]
+        while os.path.dirname(parents[-1]) != parents[-1]:
+            parents.append(os.path.dirname(parents[-1]))
+
+        records = self._query("SELECT {0} FROM checkouts WHERE disk_path IN ({1})".format(
+            ", ".join(COLUMNS), ", ".join("?" * len(parents))), parents)
+        return max(records, key=lambda x: len(x.disk_path)) if records else None
+
+    def all(self):
+        return self._query("SELECT {0} FROM checkouts ORDER BY disk_path".format(", ".join(COLUMNS)))
+
+    def get_roots(self):
+        return [x[0] for x in self._connect().execute("SELECT root_path FROM roots ORDER BY root_path")]
+
+    def add_roots(self, roots):
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT OR IGNORE INTO roots (root_path) VALUES (?)",
+                                   [(os.path.abspath(x),) for x in roots])
+
+    def rescan(self, roots=None, full=False):
+        """
+        Fix the drift between the registry and the disk:
+
+            *   removed checkouts are dropped
+            *   checkouts with a changed .scmconf or active branch are updated
+            *   new checkouts under the scan roots are added, registered checkouts are not walked into
+
+        A .scmconf which can't be read is logged and skipped, the rest of the rescan goes on.
+
+        :param roots:               `list`          directories to scan for new checkouts, remembered for the
+                                                    next rescan. The registered roots are always scanned
+        :param full:                `bool`          list every directory again, even if its mtime is unchanged
+        :return:                    `tuple`         (added, updated, removed) counts
+        """
+        if roots:
+            self.add_roots(roots)
+
+        added, updated, removed = 0, 0, 0
+        known = dict((x.disk_path, x) for x in self.all())
+        for record in known.values():
+            config_mtime = _get_config_mtime(record.disk_path)
+            if config_mtime is None:
+                self.unregister(record.disk_path)
+                removed += 1
+                continue
+
+            branch = get_branch_state(directory_path=record.disk_path, with_branches=False)[0]
+            if config_mtime != record.config_mtime:
+                if self._register_from_config(record.disk_path, branch=branch):
+                    updated += 1
+            elif branch != record.branch:
+                self.register(pkg_name=record.pkg_name, disk_path=record.disk_path, ssh_path=record.ssh_path,
+                              ticket_id=record.ticket_id, branch=branch)
+                updated += 1
+
+        for root_path in self.get_roots():
+            for disk_path in self._find_new_checkouts(root_path, known, full=full):
+                if self._register_from_config(disk_path):
+                    added += 1
+
+        logger.info("Registry rescan: {0} added, {1} updated, {2} removed".format(added, updated, removed))
+        return added, updated, removed
+
+    def _register_from_config(self, disk_path, branch=None):
+        config_file = os.path.join(disk_path, scm_constants.PACKAGE_CONFIG_FILE)
+        try:
+            with open(config_file, "r") as read_cfg:
+                config = json.load(read_cfg)
+            if not isinstance(config, dict):
+                raise ValueError("not a json object")
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Skipping '{0}', can't read it : {1}".format(config_file, e))
+            return False
+
+        if branch is None:
+            branch = get_branch_state(directory_path=disk_path, with_branches=False)[0]
+        self.register(pkg_name=config.get("pkg_name") or os.path.basename(disk_path), disk_path=disk_path,
+                      ssh_path=config.get("ssh_path"), ticket_id=config.get("ticket_id"), branch=branch)
+        return True
+
+    def _find_new_checkouts(self, root_path, known, full=False):
+        """
+        Walk root_path for the unregistered checkouts, without going into the checkouts themselves.
+        The directories whose mtime didn't change since the last rescan are not listed, their sub directories
+        are known already.
+        """
+        root_path = os.path.abspath(root_path)
+        low, high = _path_range(root_path)
+        connection = self._connect()
+        scanned = dict((x[0], (x[1], x[2])) for x in connection.execute(
+            "SELECT dir_path, mtime, sub_dirs FROM scanned_dirs WHERE dir_path = ? OR "
+            "(dir_path >= ? AND dir_path < ?)", (root_path, low, high)))
+
+        found, walked = list(), dict()
+        scan_time = time.time()
+        pending = [root_path]
+        while pending:
+            dir_path = pending.pop()
+            if dir_path in known:
+                continue
+
+            try:
+                mtime = os.stat(dir_path).st_mtime
+            except OSError:
+                continue
+
+            previous = scanned.get(dir_path)
+            if not full and previous and previous[0] == mtime:
+                sub_dirs = json.loads(previous[1])
+            else:
+                try:
+                    entries = os.listdir(dir_path)
+                except OSError as e:
+                    logger.debug("Can't list '{0}' : {1}".format(dir_path, e))
+                    continue
+
+                if scm_constants.PACKAGE_CONFIG_FILE in entries:
+                    found.append(dir_path)
+                    continue
+
+                sub_dirs = sorted(x for x in entries if not x.startswith(".") and
+                                  os.path.isdir(os.path.join(dir_path, x)) and
+                                  not os.path.islink(os.path.join(dir_path, x)))
+
+            walked[dir_path] = (mtime if scan_time - mtime > RACY_MTIME_SECONDS else None, json.dumps(sub_dirs))
+            pending.extend(os.path.join(dir_path, x) for x in reversed(sub_dirs))
+
+        with connection:
+            connection.executemany("DELETE FROM scanned_dirs WHERE dir_path = ?",
+                                   [(x,) for x in scanned if x not in walked])
+            connection.executemany("INSERT OR REPLACE INTO scanned_dirs (dir_path, mtime, sub_dirs) VALUES (?, ?, ?)",
+                                   [(x, y[0], y[1]) for x, y in walked.items() if scanned.get(x) != y])
+        return found
+
+
+_REGISTRIES = dict()
+_REGISTRIES_LOCK = threading.Lock()
+
+
+def get_registry(db_path=None):
+    """
+    Get the process wide registry of db_path, defaults to REGISTRY_FILE
+    """
+    db_path = os.path.abspath(os.path.expanduser(db_path or scm_constants.REGISTRY_FILE))
+    with _REGISTRIES_LOCK:
+        if db_path not in _REGISTRIES:
+            _REGISTRIES[db_path] = WorkspaceRegistry(db_path=db_path)
+        return _REGISTRIES[db_path]
+
+
+def close_registries():
+    """
+    Close the connections of all the process wide registries
+    """
+    with _REGISTRIES_LOCK:
+        registries = list(_REGISTRIES.values())
+    for registry in registries:
+        registry.close()
+
+
+def register_checkout(package):
+    """
+    Register the PyGitRepository checkout if USE_REGISTRY, registry errors never fail the caller
+    """
+    if not scm_constants.USE_REGISTRY:
+        return False
+
+    try:
+        get_registry().register_package(package)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Can't update the workspace registry : {0}".format(e))
+        return False
+    return True
+
+
+def find_registered_checkout(path):
+    """
+    Find the registered checkout containing path, None if USE_REGISTRY is off or nothing is registered
+    """
+    if not scm_constants.USE_REGISTRY:
+        return None
+
+    try:
+        return get_registry().find_containing(path)
+    except (sqlite3.Error, OSError) as e:
+        logger.debug("Can't read the workspace registry : {0}".format(e))
+        return None
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""
+Atomic versioned releases for the builds.
+
+Every install is staged into its own versioned directory and made live by swapping a symlink:
+
+    PY_BUILDS_DIR/
+        .releases/<pkg>/20240101-120000-1a2b3c4d5e6f/
+        .releases/<pkg>/20240102-090000-6f5e4d3c2b1a/
+        <pkg> -> .releases/<pkg>/20240102-090000-6f5e4d3c2b1a
+
+Running processes keep seeing a complete tree while a new version is installed,
+and a rollback is just another symlink swap.
+"""
+import os
+import sys
+import time
+import errno
+import ctypes
+import shutil
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .command_runner import run_git
+
+logger = get_logger(__name__)
+
+STAGING_SUFFIX = ".staging"
+# the old non versioned install becomes the oldest release, so a rollback from the first release returns to it
+LEGACY_RELEASE_NAME = "00000000-000000-legacy"
+
+# renameat2() flag from linux/fs.h, swaps the two paths in one step
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+
+def get_releases_dir(package_path):
+    """
+    Get the directory holding all the versions of given package install path
+
+    :param package_path:        `str`           live install path, eg: PY_BUILDS_DIR/<pkg>
+    :return:                    `str`           PY_BUILDS_DIR/.releases/<pkg>
+    """
+    package_path = os.path.abspath(package_path)
+    return os.path.join(os.path.dirname(package_path), scm_constants.RELEASES_DIR_NAME,
+                        os.path.basename(package_path))
+
+
+def get_source_revision(source):
+    """
+    Get the short commit SHA of the source directory, None if it's not a git checkout
+    """
+    result = run_git(["rev-parse", "--short=12", "HEAD"], cwd=source, capture=True, log_output=False)
+    return result.output.strip() or None if result else None
+
+
+def make_version_name(source):
+    """
+    Version key of a new release, timestamp first so the names sort in install order
+    """
+    version = time.strftime("%Y%m%d-%H%M%S")
+    revision = get_source_revision(source)
+    if revision:
+        version += "-{0}".format(revision)
+    return version
+
+
+def list_releases(package_path):
+    """
+    Get all the installed versions of the package, oldest first
+
+    :param package_path:        `str`           live install path
+    :return:                    `list`          version names
+    """
+    releases_dir = get_releases_dir(package_path)
+    if not os.path.isdir(releases_dir):
+        return list()
+
+    return sorted(x for x in os.listdir(releases_dir)
+                  if not x.endswith(STAGING_SUFFIX) and os.path.isdir(os.path.join(releases_dir, x)))
+
+
+def get_live_release(package_path):
+    """
+    Get the version name the live symlink is pointing to, None if the install is not versioned
+    """
+    if not os.path.islink(package_path):
+        return None
+
+    target = os.path.realpath(package_path)
+    if os.path.dirname(target) != os.path.realpath(get_releases_dir(package_path)):
+        return None
+    return os.path.basename(target)
+
+
+def stage_release(package_path, source, seed=True):
+    """
+    Create the staging directory for a new release. The staging tree is seeded with hardlinks
+    of the live release so the incremental install only has to write the changed files.
+
+    :param package_path:        `str`           live install path
+    :param source:              `str`           source directory, used for the version name
+    :param seed:                `bool`          seed from the live release
+    :return:                    `str`           abs path of the staging directory
+    """
+    releases_dir = get_releases_dir(package_path)
+    version = make_version_name(source)
+
+    index = 1
+    name = version
+    while os.path.exists(os.path.join(releases_dir, name)) or \
+            os.path.exists(os.path.join(releases_dir, name + STAGING_SUFFIX)):
+        index += 1
+        name = "{0}.{1:03d}".format(version, index)
+
+    staging_path = os.path.join(releases_dir, name + STAGING_SUFFIX)
+    os.makedirs(staging_path)
+
+    live_release = get_live_release(package_path)
+    if seed and live_release:
+        _link_tree(os.path.join(releases_dir, live_release), staging_path)
+    return staging_path
+
+
+def discard_release(staging_path):
+    """
+    Remove a staging directory which should not go live
+    """
+    logger.warning("Discarding the staged release '{0}'".format(staging_path))
+    shutil.rmtree(staging_path, ignore_errors=True)
+
+
+def activate_release(package_path, release_path):
+    """
+    Make the given release live by swapping the package symlink atomically.
+
+    :param package_path:        `str`           live install path
+    :param release_path:        `str`           abs path of the (staging) release directory
+    :return:                    `str`           version name which is live now
+    """
+    if release_path.endswith(STAGING_SUFFIX):
+        final_path = release_path[:-len(STAGING_SUFFIX)]
+        os.rename(release_path, final_path)
+        release_path = final_path
+
+    target = os.path.relpath(release_path, os.path.dirname(os.path.abspath(package_path)))
+    tmp_link = "{0}.scm_tmp.{1}".format(package_path, os.getpid())
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+
+    if os.path.isdir(package_path) and not os.path.islink(package_path):
+        # old, non versioned layout. rename() can't replace a directory by a symlink, so the two are swapped
+        # with renameat2(). Without it, the install path is missing between the two renames.
+        legacy_path = _get_legacy_path(package_path)
+        logger.warning("Moving the non-versioned install to '{0}'".format(legacy_path))
+        if _exchange_paths(tmp_link, package_path):
+            # the new release is live already, a failure here only leaves the old tree at tmp_link
+            try:
+                os.rename(tmp_link, legacy_path)
+            except OSError as e:
+                logger.error("Can't move the non-versioned install to '{0}', it's left at '{1}' : {2}".format(
+                    legacy_path, tmp_link, e))
+        else:
+            os.rename(package_path, legacy_path)
+            os.rename(tmp_link, package_path)
+    else:
+        os.rename(tmp_link, package_path)
+
+    version = os.path.basename(release_path)
+    logger.info("Release '{0}' is live for '{1}'".format(version, os.path.basename(package_path)))
+    return version
+
+
+def rollback(package_path, version=None):
+    """
+    Switch the live symlink back to an older release
+
+    :param package_path:        `str`           live install path
+    :param version:             `str`           version to go live, defaults to the one before the live version
+    :return:                    `str`           version name which is live now, None if nothing to roll back to
+    """
+    releases = list_releases(package_path)
+    live_release = get_live_release(package_path)
+
+    if version is None:
+        if live_release not in releases or releases.index(live_release) == 0:
+            logger.error("No older release found for '{0}'".format(package_path))
+            return None
+        version = releases[releases.index(live_release) - 1]
+
+    if version not in releases:
+        logger.error("Release '{0}' not found. Available releases: {1}".format(version, releases))
+        return None
+
+    return activate_release(package_path, os.path.join(get_releases_dir(package_path), version))
+
+
+def cleanup_releases(package_path, keep=None):
+    """
+    Remove the old releases and the left over staging directories. The live release is never removed.
+
+    :param package_path:        `str`           live install path
+    :param keep:                `int`           number of newest releases to keep, defaults to RELEASE_RETENTION
+    :return:                    `list`          removed version names
+    """
+    keep = scm_constants.RELEASE_RETENTION if keep is None else keep
+    releases_dir = get_releases_dir(package_path)
+    live_release = get_live_release(package_path)
+    releases = list_releases(package_path)
+
+    removed = list()
+    for version in releases[:max(0, len(releases) - keep)]:
+        if version == live_release:
+            continue
+        shutil.rmtree(os.path.join(releases_dir, version), ignore_errors=True)
+        removed.append(version)
+
+    if os.path.isdir(releases_dir):
+        for name in os.listdir(releases_dir):
+            staging_path = os.path.join(releases_dir, name)
+            if name.endswith(STAGING_SUFFIX) and \
+                    time.time() - os.path.getmtime(staging_path) > scm_constants.STALE_STAGING_SECONDS:
+                shutil.rmtree(staging_path, ignore_errors=True)
+
+    if removed:
+        logger.debug("Removed old releases: {0}".format(removed))
+    return removed
+
+
+def _get_legacy_path(package_path):
+    """
+    Release path for the non-versioned install at package_path. A package converted again after a
+    non-versioned reinstall already has the legacy release, the new one is named after its install time
+    so it sorts right before the releases installed after it.
+    """
+    releases_dir = get_releases_dir(package_path)
+    legacy_path = os.path.join(releases_dir, LEGACY_RELEASE_NAME)
+    if not os.path.lexists(legacy_path):
+        return legacy_path
+
+    version = time.strftime("%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(package_path))) + "-legacy"
+    index = 1
+    name = version
+    while os.path.lexists(os.path.join(releases_dir, name)):
+        index += 1
+        name = "{0}.{1:03d}".format(version, index)
+    return os.path.join(releases_dir, name)
+
+
+def _exchange_paths(path_a, path_b):
+    """
+    Swap the two paths atomically, False if the platform or the filesystem can't (linux >= 3.15 only)
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+
+    fs_encoding = sys.getfilesystemencoding()
+    if renameat2(AT_FDCWD, path_a.encode(fs_encoding), AT_FDCWD, path_b.encode(fs_encoding),
+                 RENAME_EXCHANGE) == 0:
+        return True
+
+    error = ctypes.get_errno()
+    if error in (errno.ENOSYS, errno.EINVAL, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP), errno.EOPNOTSUPP):
+        return False
+    raise OSError(error, os.strerror(error), path_b)
+
+
+def _link_tree(source_dir, destination_dir):
+    for root, dirs, files in os.walk(source_dir):
+        dest_root = os.path.join(destination_dir, os.path.relpath(root, source_dir))
+        for each_dir in dirs:
+            dest_dir = os.path.join(dest_root, each_dir)
+            if not os.path.isdir(dest_dir):
+                os.makedirs(dest_dir)
+
+        for each_file in files:
+            os.link(os.path.join(root, each_file), os.path.join(dest_root, each_file))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per repository state cache for the PyGitRepository objects.
+
+Values (active branch, branch list, .scmconf config, project root) are cached together with the
+stat signature (inode, size, mtime) of the files they were computed from. git updates HEAD and the refs
+with a lock file + rename, so every update gives a new inode and invalidates the cached value.
+"""
+import os
+import threading
+from collections import defaultdict
+
+from logIO import get_logger
+
+logger = get_logger(__name__)
+
+
+def get_file_signature(file_path):
+    """
+    :param file_path:           `str`           abs file or directory path
+    :return:                    `tuple`         (inode, size, mtime), None if the path doesn't exist
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+class RepositoryStateCache(object):
+    """
+    Cache of computed repository values invalidated by the stat signature of watched files
+
+    Intended Usages:
+        value = STATE_CACHE.get(kind="active_branch", key=disk_path, watched_files=[head_file],
+                                compute=lambda: get_git_active_branch(disk_path))
+        STATE_CACHE.stats()
+    """
+    def __init__(self):
+        super(RepositoryStateCache, self).__init__()
+        self._entries = dict()
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def get(self, kind, key, watched_files, compute):
+        """
+        Get the cached value or compute and cache it
+
+        :param kind:                `str`           value type, eg: "active_branch", used for the counters
+        :param key:                 `str`           repository key, usually the disk path
+        :param watched_files:       `list`          files which invalidate the value when changed
+        :param compute:             `callable`      returns the fresh value
+        :return:                                    cached or computed value
+        """
+        signature = tuple(get_file_signature(x) for x in watched_files)
+        cache_key = (kind, key)
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] == signature:
+                self.hits[kind] += 1
+                return entry[1]
+            self.misses[kind] += 1
+
+        value = compute()
+        with self._lock:
+            self._entries[cache_key] = (signature, value)
+        return value
+
+    def invalidate(self, key=None, kind=None):
+        """
+        Drop the cached values of the given key and/or kind, everything if nothing given
+        """
+        with self._lock:
+            for cache_key in list(self._entries):
+                if (kind is None or cache_key[0] == kind) and (key is None or cache_key[1] == key):
+                    del self._entries[cache_key]
+
+    def stats(self):
+        """
+        :return:                    `dict`          {kind: {"hits": int, "misses": int}}
+        """
+        with self._lock:
+            kinds = set(self.hits) | set(self.misses)
+            return dict((x, {"hits": self.hits[x], "misses": self.misses[x]}) for x in sorted(kinds))
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+
+# process wide cache shared by all the PyGitRepository objects
+STATE_CACHE = RepositoryStateCache()
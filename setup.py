@@ -18,7 +18,7 @@ DESCRIPTION = "Source Code Management toolsets"
 URL = "https://github.com/arjun-namdeo/scm_tools"
 EMAIL = 'arjun.namdeo.vfx@gmail.com'
 AUTHOR = 'Arjun Prasad Namdeo'
-REQUIRES_PYTHON = '>=3.6.0'
+REQUIRES_PYTHON = '>=3.8.0'
 VERSION = "0.0.1"
 
 # What packages are required for this module to be executed?
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+"""
+The scm dispatcher must not import the heavy subsystems before a command runs, `scm --help` stays fast.
+"""
+import os
+import sys
+import subprocess
+import unittest
+
+from scm_tools.benchmarks import HEAVY_MODULES
+
+# the directory holding the scm_tools package
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HELP_COMMAND = """
+import sys
+sys.path.insert(0, {0!r})
+from scm_tools.cli import main
+try:
+    main(["--help"])
+except SystemExit:
+    pass
+sys.stdout.write("\\nmodules:" + ",".join(x for x in {1!r} if x in sys.modules))
+"""
+
+
+class CliStartupTest(unittest.TestCase):
+
+    def test_help_imports_no_heavy_module(self):
+        code = HELP_COMMAND.format(PACKAGE_PARENT, HEAVY_MODULES)
+        output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+        modules = [x for x in output.strip().splitlines()[-1].split(":", 1)[-1].split(",") if x]
+        self.assertEqual(modules, list())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+clone_repository() modes against a local bare repository, through file:// so git packs the objects like it
+does for a remote. Every mode is checked for what makes it that mode, and the disk sizes are compared.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+from scm_tools.benchmarks import get_disk_usage
+from scm_tools.git_utils import clone_repository
+
+FILES = 10
+FILE_SIZE = 32 * 1024
+COMMITS = 4
+BRANCHES = ("feature_a", "feature_b")
+CLONE_MODES = (("full", dict()), ("shallow", dict(depth=1)), ("blobless", dict(clone_filter="blobless")),
+               ("treeless", dict(clone_filter="treeless")), ("single_branch", dict(single_branch=True)),
+               ("reference", dict()))
+
+
+def _git(args, cwd):
+    return subprocess.check_output(["git", "-c", "user.name=scm", "-c", "user.email=scm@localhost"] + list(args),
+                                   cwd=cwd, universal_newlines=True).strip()
+
+
+def _write_files(work_path, name):
+    # random data doesn't compress, so the sizes tell which objects were downloaded
+    for index in range(FILES):
+        with open(os.path.join(work_path, "file{0}.bin".format(index)), "wb") as write_file:
+            write_file.write(os.urandom(FILE_SIZE))
+    _git(["add", "-A"], cwd=work_path)
+    _git(["commit", "-q", "-m", name], cwd=work_path)
+
+
+class CloneModesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp(prefix="scm_clone_test_")
+        work_path = os.path.join(cls.work_dir, "work")
+        os.makedirs(work_path)
+        _git(["init", "-q"], cwd=work_path)
+        _git(["symbolic-ref", "HEAD", "refs/heads/master"], cwd=work_path)
+        for index in range(COMMITS):
+            _write_files(work_path, "commit {0}".format(index))
+        for branch in BRANCHES:
+            _git(["checkout", "-q", "-b", branch, "master"], cwd=work_path)
+            _write_files(work_path, branch)
+        _git(["checkout", "-q", "master"], cwd=work_path)
+
+        cls.bare_path = os.path.join(cls.work_dir, "repository.git")
+        _git(["clone", "-q", "--bare", work_path, cls.bare_path], cwd=cls.work_dir)
+        _git(["config", "uploadpack.allowFilter", "true"], cwd=cls.bare_path)
+
+        cls.clone_root = os.path.join(cls.work_dir, "clones")
+        os.makedirs(cls.clone_root)
+        cls.sizes = dict()
+        for mode, options in CLONE_MODES:
+            if mode == "reference":
+                options = dict(reference=cls.bare_path)
+            success = clone_repository("file://" + cls.bare_path, directory_path=cls.clone_root, target_name=mode,
+                                       use_mirror=False, **options)
+            if not success:
+                raise RuntimeError("{0} clone failed".format(mode))
+            cls.sizes[mode] = get_disk_usage(os.path.join(cls.clone_root, mode, ".git"))
+
+        sys.stderr.write("\nclone sizes (.git bytes): {0}\n".format(
+            ", ".join("{0}={1}".format(x, cls.sizes[x]) for x, _ in CLONE_MODES)))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def _clone_path(self, mode):
+        return os.path.join(self.clone_root, mode)
+
+    def _config(self, mode, key):
+        result = subprocess.run(["git", "config", "--get", key], cwd=self._clone_path(mode),
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        return result.stdout.strip() or None
+
+    def test_full(self):
+        git_dir = os.path.join(self._clone_path("full"), ".git")
+        self.assertFalse(os.path.exists(os.path.join(git_dir, "shallow")))
+        self.assertIsNone(self._config("full", "remote.origin.promisor"))
+        self.assertEqual(_git(["rev-list", "--count", "HEAD"], cwd=self._clone_path("full")), str(COMMITS))
+
+    def test_shallow(self):
+        self.assertTrue(os.path.isfile(os.path.join(self._clone_path("shallow"), ".git", "shallow")))
+        self.assertEqual(_git(["rev-list", "--count", "HEAD"], cwd=self._clone_path("shallow")), "1")
+        self.assertLess(self.sizes["shallow"], self.sizes["full"])
+
+    def test_blobless(self):
+        self.assertEqual(self._config("blobless", "remote.origin.promisor"), "true")
+        self.assertEqual(self._config("blobless", "remote.origin.partialclonefilter"), "blob:none")
+        self.assertLess(self.sizes["blobless"], self.sizes["full"])
+
+    def test_treeless(self):
+        self.assertEqual(self._config("treeless", "remote.origin.promisor"), "true")
+        self.assertEqual(self._config("treeless", "remote.origin.partialclonefilter"), "tree:0")
+        self.assertLess(self.sizes["treeless"], self.sizes["full"])
+
+    def test_single_branch(self):
+        remote_branches = _git(["for-each-ref", "--format=%(refname)", "refs/remotes/origin/"],
+                               cwd=self._clone_path("single_branch")).split()
+        self.assertEqual([x for x in remote_branches if not x.endswith("/HEAD")], ["refs/remotes/origin/master"])
+        self.assertLess(self.sizes["single_branch"], self.sizes["full"])
+
+    def test_reference(self):
+        alternates_file = os.path.join(self._clone_path("reference"), ".git", "objects", "info", "alternates")
+        self.assertTrue(os.path.isfile(alternates_file))
+        with open(alternates_file, "r") as read_file:
+            self.assertIn(os.path.join(self.bare_path, "objects"), read_file.read())
+        self.assertLess(self.sizes["reference"], self.sizes["full"])
+
+
+if __name__ == "__main__":
+    unittest.main()
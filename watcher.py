@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+
+"""
+Watch mode of the installs.
+
+After the normal install, the source directories are watched and every change is applied to the install
+location right away, file by file, instead of reinstalling the whole package:
+
+    *   inotify (linux)     one watch per source directory, events are read from a single file descriptor
+    *   polling             everywhere else, the tree is compared with its last snapshot every WATCH_POLL_SECONDS
+
+The events are debounced: a batch is applied once the source was quiet for WATCH_DEBOUNCE_SECONDS, so an
+editor's save (write temp file, rename, chmod) or a git checkout is applied once. The files go through the
+same ignore patterns, install strategies, manifest and byte-compile stage as the normal install.
+
+The build location is updated in place: with versioned installs that is the live release, so the watch
+mode is meant for the development and test installs, not for the production releases.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .manifest import InstallManifest, InstallSummary
+from .ignore_matcher import IgnoreMatcher
+from .link_strategies import FileInstaller
+from .bytecode import compile_install
+from .archives import build_archive
+from .common import install_tree, _remove_empty_parents
+from .installer import get_project_sources
+
+logger = get_logger(__name__)
+
+# inotify event bits from linux/inotify.h
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# file content is complete on close_write and on the rename of an editor's temp file, attrib is a chmod +x
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_inotify():
+    """
+    Get the libc functions of inotify, None where they are not available
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (ImportError, OSError, AttributeError) as e:
+        logger.debug("inotify is not available : {0}".format(e))
+        return None
+    return libc
+
+
+class InotifyWatcher(object):
+    """
+    Recursive watcher of directory trees with inotify
+
+    Intended Usages:
+        watcher = InotifyWatcher()
+        watcher.add_tree(source, matcher=IgnoreMatcher.for_source(source))
+        paths, overflow = watcher.read_changes(timeout=1.0)
+    """
+    def __init__(self, libc=None):
+        super(InotifyWatcher, self).__init__()
+        self._libc = libc or _load_inotify()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not supported on this platform")
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+        self._paths = dict()
+        self._matchers = dict()
+
+    def __repr__(self):
+        return "InotifyWatcher({0} directories)".format(len(self._paths))
+
+    @staticmethod
+    def _get_errno():
+        import ctypes
+        return ctypes.get_errno()
+
+    def add_tree(self, root, matcher=None):
+        """
+        Watch the root directory and all its sub directories which are not ignored by the matcher
+
+        :return:                    `list`          abs paths of the files found in the tree
+        """
+        files = list()
+        for directory, dirs, file_names in os.walk(root):
+            if matcher is not None:
+                matcher.prune(root=directory, dirs=dirs, files=file_names)
+            self._add_watch(directory, matcher)
+            files.extend(os.path.join(directory, x) for x in file_names)
+        return files
+
+    def _add_watch(self, directory, matcher):
+        path = directory.encode(sys.getfilesystemencoding()) if not isinstance(directory, bytes) else directory
+        watch_descriptor = self._libc.inotify_add_watch(self.fd, path, WATCH_MASK | IN_ONLYDIR)
+        if watch_descriptor < 0:
+            error = self._get_errno()
+            if error == errno.ENOSPC:
+                logger.warning("Out of inotify watches, raise fs.inotify.max_user_watches. Not watching '{0}'"
+                               .format(directory))
+            elif error not in (errno.ENOENT, errno.ENOTDIR):
+                logger.warning("Can't watch '{0}' : {1}".format(directory, os.strerror(error)))
+            return None
+        self._paths[watch_descriptor] = directory
+        self._matchers[watch_descriptor] = matcher
+        return watch_descriptor
+
+    def read_changes(self, timeout=None):
+        """
+        Wait up to timeout seconds for events and read all of them
+
+        :param timeout:             `float`         seconds to wait, None waits until there is an event
+        :return:                    `tuple`         (set of changed abs paths, True if the kernel queue overflowed)
+        """
+        changed = set()
+        overflow = False
+        readable = select.select([self.fd], [], [], timeout)[0]
+        while readable:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            offset = 0
+            while offset < len(data):
+                watch_descriptor, mask, _cookie, name_size = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_size].rstrip(b"\0")
+                offset += EVENT_HEADER.size + name_size
+                overflow = self._handle_event(watch_descriptor, mask, name, changed) or overflow
+        return changed, overflow
+
+    def _handle_event(self, watch_descriptor, mask, name, changed):
+        if mask & IN_Q_OVERFLOW:
+            return True
+
+        directory = self._paths.get(watch_descriptor)
+        if directory is None:
+            return False
+        if mask & IN_IGNORED:
+            # the directory is gone, the kernel dropped its watch
+            self._paths.pop(watch_descriptor, None)
+            self._matchers.pop(watch_descriptor, None)
+            return False
+        if not name:
+            # event of the watched directory itself, its parent reports the change
+            return False
+
+        path = os.path.join(directory, name.decode(sys.getfilesystemencoding()))
+        changed.add(path)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            matcher = self._matchers.get(watch_descriptor)
+            if matcher is None or not matcher.match(path, is_dir=True):
+                # files written before the watch was in place have no event of their own
+                changed.update(self.add_tree(path, matcher=matcher))
+        return False
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class PollingWatcher(object):
+    """
+    Watcher comparing snapshots of the trees, for the platforms without inotify
+    """
+    def __init__(self, interval=None):
+        super(PollingWatcher, self).__init__()
+        self.interval = interval or scm_constants.WATCH_POLL_SECONDS
+        self._trees = list()
+        self._snapshot = dict()
+
+    def __repr__(self):
+        return "PollingWatcher({0} files)".format(len(self._snapshot))
+
+    def add_tree(self, root, matcher=None):
+        self._trees.append((root, matcher))
+        snapshot = self._scan(root, matcher)
+        self._snapshot.update(snapshot)
+        return list(snapshot)
+
+    @staticmethod
+    def _scan(root, matcher):
+        snapshot = dict()
+        for directory, dirs, file_names in os.walk(root):
+            if matcher is not None:
+                matcher.prune(root=directory, dirs=dirs, files=file_names)
+            for each_name in file_names:
+                file_path = os.path.join(directory, each_name)
+                try:
+                    stat_result = os.stat(file_path)
+                except OSError:
+                    continue
+                snapshot[file_path] = (stat_result.st_mtime, stat_result.st_size, stat_result.st_mode)
+        return snapshot
+
+    def read_changes(self, timeout=None):
+        """
+        Same as InotifyWatcher.read_changes(), the trees are scanned every interval until something changed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot = dict()
+            for root, matcher in self._trees:
+                snapshot.update(self._scan(root, matcher))
+            changed = set(x for x in set(snapshot) | set(self._snapshot) if snapshot.get(x) != self._snapshot.get(x))
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed, False
+            wait = self.interval if deadline is None else min(self.interval, max(0.0, deadline - time.time()))
+            time.sleep(wait)
+
+    def close(self):
+        self._trees = list()
+
+
+def get_watcher():
+    """
+    Get the inotify watcher, or the polling one where inotify is not available
+    """
+    libc = _load_inotify()
+    if libc is not None:
+        try:
+            return InotifyWatcher(libc=libc)
+        except OSError as e:
+            logger.warning("Can't use inotify, polling the files instead : {0}".format(e))
+    return PollingWatcher()
+
+
+class SyncTarget(object):
+    """
+    Applies the changed files of a source directory to its install location
+
+    Intended Usages:
+        target = SyncTarget(source, installation_path, compile_bytecode=True)
+        target.apply(["my_package/module.py"])
+    """
+    def __init__(self, source, destination, flat=False, symlink=False, compile_bytecode=False, use_manifest=True,
+                 link_mode=None):
+        """
+        :param source:              `str`           source directory
+        :param destination:         `str`           install directory, the target of its symlink if it's one
+        :param flat:                `bool`          only the top level files are installed, like the bin files
+        :param symlink:             `bool`          install symlinks to the source files (the QC bin files)
+        :param compile_bytecode:    `bool`          byte-compile the changed python files
+        :param use_manifest:        `bool`          keep the install manifest of the destination up to date
+        :param link_mode:           `str`           install strategy (constants.LINK_MODES), defaults to auto
+        """
+        super(SyncTarget, self).__init__()
+        self.source = os.path.abspath(source)
+        self.destination = os.path.realpath(destination)
+        self.flat = flat
+        self.symlink = symlink
+        self.compile_bytecode = compile_bytecode
+        self.use_manifest = use_manifest
+        self.matcher = None if flat else IgnoreMatcher.for_source(self.source)
+        self.link_mode = link_mode
+        self.file_installer = FileInstaller(link_mode=link_mode)
+
+    def __repr__(self):
+        return "SyncTarget('{0}' >>> '{1}')".format(self.source, self.destination)
+
+    def get_rel_path(self, path):
+        """
+        Get the path relative to the source, None if the path is not in the source or is ignored
+        """
+        if not path.startswith(self.source + os.sep):
+            return None
+
+        rel_path = os.path.relpath(path, self.source)
+        if self.flat:
+            return None if os.sep in rel_path else rel_path
+
+        components = rel_path.split(os.sep)
+        current = self.source
+        for index, component in enumerate(components):
+            current = os.path.join(current, component)
+            if self.matcher.match(current, is_dir=index < len(components) - 1 or os.path.isdir(current)):
+                return None
+        return rel_path
+
+    def _expand(self, rel_paths, manifest):
+        """
+        Turn the changed paths into changed files: a directory stands for all the files in it, on disk
+        or, if it was removed, in the manifest
+        """
+        files = set()
+        for rel_path in rel_paths:
+            src_path = os.path.join(self.source, rel_path)
+            if os.path.isdir(src_path) and not self.flat:
+                for root, dirs, file_names in os.walk(src_path):
+                    self.matcher.prune(root=root, dirs=dirs, files=file_names)
+                    files.update(os.path.relpath(os.path.join(root, x), self.source) for x in file_names
+                                 if not self.matcher.is_ignored(os.path.join(root, x)))
+            elif os.path.exists(src_path) or manifest is None:
+                files.add(rel_path)
+            else:
+                prefix = rel_path + os.sep
+                files.update(x for x in manifest if x == rel_path or x.startswith(prefix))
+                files.add(rel_path)
+        return files
+
+    def apply(self, paths):
+        """
+        Install the changed files and remove the deleted ones
+
+        :param paths:               `list`          changed abs paths, the ones outside the source are skipped
+        :return:                    `InstallSummary`
+        """
+        summary = InstallSummary()
+        if not self.flat and any(os.path.basename(x) == scm_constants.GIT_IGNORE_FILE and
+                                 x.startswith(self.source + os.sep) for x in paths):
+            # the filtering itself changed, check everything again
+            self.matcher = IgnoreMatcher.for_source(self.source)
+            return self.resync()
+
+        rel_paths = set(x for x in (self.get_rel_path(y) for y in paths) if x)
+        if not rel_paths:
+            return summary
+
+        manifest = InstallManifest.load(install_dir=self.destination) if self.use_manifest else None
+        for rel_path in sorted(self._expand(rel_paths, manifest)):
+            src_path = os.path.join(self.source, rel_path)
+            dst_path = os.path.join(self.destination, rel_path)
+            try:
+                if os.path.isfile(src_path):
+                    self._install_file(src_path, dst_path)
+                    if manifest is not None:
+                        manifest.add_from_source(rel_path=rel_path, src_path=src_path)
+                    summary.copied.append(rel_path)
+                elif os.path.lexists(dst_path) and not os.path.isdir(dst_path):
+                    os.remove(dst_path)
+                    summary.removed.append(rel_path)
+            except (IOError, OSError) as e:
+                # the file can be gone again meanwhile, the next event brings it in sync
+                logger.warning("Can't sync '{0}' : {1}".format(rel_path, e))
+                summary.failed.append(rel_path)
+                continue
+
+            if manifest is not None and not os.path.isfile(src_path):
+                manifest.remove(rel_path)
+
+        if self.compile_bytecode and (summary.copied or summary.removed):
+            summary.bytecode = compile_install(installation_path=self.destination, changed=summary.copied,
+                                               removed=summary.removed)
+        for rel_path in summary.removed:
+            # after the bytecode stage, which removes the pycs of the removed files
+            _remove_empty_parents(path=os.path.dirname(os.path.join(self.destination, rel_path)),
+                                  stop_at=self.destination)
+        if manifest is not None:
+            manifest.save()
+        return summary
+
+    def _install_file(self, src_path, dst_path):
+        if not self.symlink:
+            self.file_installer(src_path, dst_path)
+            return
+
+        if os.path.islink(dst_path) and os.path.realpath(dst_path) == os.path.realpath(src_path):
+            return
+        if os.path.lexists(dst_path):
+            os.remove(dst_path)
+        os.symlink(src_path, dst_path)
+
+    def resync(self):
+        """
+        Apply all the files of the source, and remove the installed files which are not in the source anymore
+        """
+        if self.flat:
+            return self.apply([os.path.join(self.source, x) for x in os.listdir(self.source)])
+        return install_tree(source=self.source, installation_path=self.destination, link_mode=self.link_mode,
+                            compile_bytecode=self.compile_bytecode)
+
+
+class ArchiveTarget(SyncTarget):
+    """
+    An archive is never changed in place, any change of the source builds a new archive version
+    """
+    def __init__(self, source, install_root=None, compile_bytecode=False):
+        super(ArchiveTarget, self).__init__(source, destination=install_root or scm_constants.PY_BUILDS_DIR,
+                                            compile_bytecode=compile_bytecode, use_manifest=False)
+
+    def apply(self, paths):
+        if any(self.get_rel_path(x) for x in paths):
+            return self.resync()
+        return InstallSummary()
+
+    def resync(self):
+        self.matcher = IgnoreMatcher.for_source(self.source)
+        return build_archive(source=self.source, install_root=self.destination,
+                             compile_bytecode=self.compile_bytecode)
+
+
+def get_sync_targets(project_root, for_qc=False, install_root=None, bin_install_dir=None, link_mode=None,
+                     compile_bytecode=None, build_format=None):
+    """
+    Get the SyncTargets of the project installed by scm_install_package() and scm_install_bin_files().
+    The python package of a QC install is a symlink to the source, so only its bin files need syncing.
+    """
+    compile_bytecode = scm_constants.COMPILE_BYTECODE if compile_bytecode is None else compile_bytecode
+    python_root, bin_root = get_project_sources(project_root)
+    targets = list()
+    if python_root and not for_qc and (build_format or scm_constants.BUILD_FORMAT) == "archive":
+        targets.append(ArchiveTarget(python_root, install_root=install_root, compile_bytecode=compile_bytecode))
+    elif python_root and not for_qc:
+        installation_path = os.path.join(install_root or scm_constants.PY_BUILDS_DIR, os.path.basename(python_root))
+        targets.append(SyncTarget(python_root, installation_path, compile_bytecode=compile_bytecode,
+                                  link_mode=link_mode))
+    if bin_root:
+        if not bin_install_dir:
+            bin_install_dir = scm_constants.BIN_TESTING_DIR if for_qc else scm_constants.BIN_BUILDS_DIR
+        targets.append(SyncTarget(bin_root, bin_install_dir, flat=True, symlink=for_qc, use_manifest=False,
+                                  link_mode=link_mode))
+    return targets
+
+
+def watch(targets, debounce=None, watcher=None, max_batches=None):
+    """
+    Apply the changes of the target sources until interrupted
+
+    :param targets:             `list`          SyncTarget objects
+    :param debounce:            `float`         quiet seconds before applying a batch, default WATCH_DEBOUNCE_SECONDS
+    :param watcher:             `object`        InotifyWatcher or PollingWatcher, defaults to get_watcher()
+    :param max_batches:         `int`           stop after this many batches, None runs until Ctrl+C
+    :return:                    `int`           number of applied batches
+    """
+    debounce = scm_constants.WATCH_DEBOUNCE_SECONDS if debounce is None else debounce
+    watcher = watcher or get_watcher()
+    for target in targets:
+        watcher.add_tree(target.source, matcher=target.matcher)
+    logger.info("Watching {0} for changes with {1}, Ctrl+C to stop".format(
+        ", ".join("'{0}'".format(x.source) for x in targets), watcher))
+
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            changed, overflow = watcher.read_changes(timeout=None)
+            while True:
+                more, more_overflow = watcher.read_changes(timeout=debounce)
+                if not more and not more_overflow:
+                    break
+                changed.update(more)
+                overflow = overflow or more_overflow
+
+            start_time = time.time()
+            for target in targets:
+                if overflow:
+                    logger.warning("Too many changes at once, checking all the files of '{0}'".format(target.source))
+                    summary = target.resync()
+                else:
+                    summary = target.apply(changed)
+                if summary.copied or summary.removed or summary.failed:
+                    logger.info("Synced '{0}' in {1:.2f}s: {2}".format(os.path.basename(target.source),
+                                                                      time.time() - start_time, summary))
+            batches += 1
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
+    finally:
+        watcher.close()
+    return batches
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ticket branches as git worktrees of one shared checkout.
+
+scm develop used to switch the branch of the checkout, which rewrites its working tree, or to clone the
+package again. With worktrees every ticket branch gets its own directory attached to the same repository:
+the objects, the refs and the fetches are shared, and a new branch only costs the checkout of its files.
+
+    <workspace>/my_package                          shared checkout, on any branch
+    <workspace>/my_package-worktrees/PROJ-123       worktree of the PROJ-123 branch, with its own .scmconf
+    <workspace>/my_package-worktrees/PROJ-456       sparse worktree, only the given paths are checked out
+
+The base commit and the source branch of a worktree branch are kept in its git config
+(branch.<name>.scmbase / scmsource). A worktree is finished once its branch has commits of its own, all of
+them merged into origin/<source branch>, and there are no local changes left. cleanup_worktrees()
+removes the finished ones together with their branches.
+"""
+import os
+from collections import OrderedDict
+
+from logIO import get_logger
+
+from . import constants as scm_constants
+from .command_runner import run_git
+from .git_refs import HEADS_PREFIX
+from .git_utils import fetch_origin, get_git_branch_names, get_git_version, get_repository_status, is_ancestor
+
+logger = get_logger(__name__)
+
+# sparse-checkout writes a per worktree config since git 2.35, older versions change the shared config
+MIN_SPARSE_GIT_VERSION = (2, 35)
+BASE_CONFIG_KEY = "branch.{0}.scmbase"
+SOURCE_CONFIG_KEY = "branch.{0}.scmsource"
+
+
+class Worktree(object):
+    """
+    One entry of 'git worktree list'
+    """
+    def __init__(self, path, head=None, branch=None, is_main=False, locked=False, prunable=False):
+        super(Worktree, self).__init__()
+        self.path = path
+        self.head = head
+        self.branch = branch
+        self.is_main = is_main
+        self.locked = locked
+        self.prunable = prunable
+
+    def __repr__(self):
+        return "Worktree('{0}', branch={1})".format(self.path, self.branch)
+
+    def to_dict(self):
+        data_dict = OrderedDict()
+        data_dict["path"] = self.path
+        data_dict["head"] = self.head
+        data_dict["branch"] = self.branch
+        data_dict["is_main"] = self.is_main
+        data_dict["locked"] = self.locked
+        data_dict["prunable"] = self.prunable
+        return data_dict
+
+
+def list_worktrees(repository_path):
+    """
+    Get the worktrees of the repository, the main checkout first
+
+    :param repository_path:     `str`           the main checkout or any of its worktrees
+    :return:                    `list`          Worktree objects, empty if it's not a git repository
+    """
+    result = run_git(["worktree", "list", "--porcelain"], cwd=repository_path, capture=True, log_output=False)
+    if not result:
+        return list()
+
+    worktrees = list()
+    for block in result.output.strip().split("\n\n"):
+        entry = dict(x.split(" ", 1) if " " in x else (x, True) for x in block.splitlines() if x)
+        if "worktree" not in entry:
+            continue
+        branch = entry.get("branch")
+        worktrees.append(Worktree(path=entry["worktree"], head=entry.get("HEAD"),
+                                  branch=branch[len(HEADS_PREFIX):] if branch else None, is_main=not worktrees,
+                                  locked="locked" in entry, prunable="prunable" in entry))
+    return worktrees
+
+
+def get_main_path(repository_path):
+    """
+    Get the main checkout of the repository, the one all its worktrees are attached to
+    """
+    worktrees = list_worktrees(repository_path)
+    return worktrees[0].path if worktrees else None
+
+
+def get_worktrees_dir(repository_path):
+    """
+    :return:                    `str`           <workspace>/<package><WORKTREE_DIR_SUFFIX>
+    """
+    repository_path = os.path.abspath(repository_path).rstrip(os.sep)
+    return repository_path + scm_constants.WORKTREE_DIR_SUFFIX
+
+
+def get_worktree_path(repository_path, branch):
+    """
+    :return:                    `str`           worktree directory of the branch, "/" in the name becomes "_"
+    """
+    return os.path.join(get_worktrees_dir(repository_path), branch.replace("/", "_"))
+
+
+def _get_config(repository_path, key):
+    result = run_git(["config", "--get", key], cwd=repository_path, capture=True, log_output=False)
+    return result.output.strip() if result else None
+
+
+def add_worktree(repository_path, branch, source_branch=None, sparse_paths=None, fetch=True):
+    """
+    Create the worktree of the branch. A new branch starts from origin/<source_branch> and tracks it, an
+    existing local branch is checked out as it is.
+
+    :param repository_path:     `str`           the main checkout or any of its worktrees
+    :param branch:              `str`           ticket branch name
+    :param source_branch:       `str`           branch to start from, defaults to MASTER_BRANCH
+    :param sparse_paths:        `list`          only check out these directories (cone mode), all if None
+    :param fetch:               `bool`          fetch origin first, so the branch starts from the latest commit
+    :return:                    `str`           worktree path, None if it failed
+    """
+    source_branch = source_branch or scm_constants.MASTER_BRANCH
+    main_path = get_main_path(repository_path)
+    if main_path is None:
+        logger.error("Not a git repository : '{0}'".format(repository_path))
+        return None
+
+    if sparse_paths and get_git_version() < MIN_SPARSE_GIT_VERSION:
+        logger.error("Sparse worktrees need git >= {0}, found {1}".format(
+            ".".join(str(x) for x in MIN_SPARSE_GIT_VERSION), ".".join(str(x) for x in get_git_version())))
+        return None
+
+    worktree_path = get_worktree_path(main_path, branch)
+    if os.path.exists(worktree_path):
+        logger.error("Worktree directory already exists : '{0}'".format(worktree_path))
+        return None
+
+    args = ["worktree", "add"]
+    if sparse_paths:
+        # the files are checked out once the sparse patterns are set
+        args.append("--no-checkout")
+
+    is_new_branch = branch not in get_git_branch_names(directory_path=main_path)
+    if is_new_branch:
+        if fetch:
+            fetch_origin(directory_path=main_path, max_age=0)
+        args += ["--track", "-b", branch, worktree_path, "origin/{0}".format(source_branch)]
+    else:
+        logger.info("'{0}' branch already exists in your local, checking it out as it is.".format(branch))
+        args += [worktree_path, branch]
+
+    if not run_git(args, cwd=main_path):
+        return None
+
+    if is_new_branch:
+        base = run_git(["rev-parse", "HEAD"], cwd=worktree_path, capture=True, log_output=False).output.strip()
+        run_git(["config", BASE_CONFIG_KEY.format(branch), base], cwd=main_path)
+        run_git(["config", SOURCE_CONFIG_KEY.format(branch), source_branch], cwd=main_path)
+
+    if sparse_paths and not set_sparse_paths(worktree_path, sparse_paths):
+        return None
+
+    logger.info("Worktree of '{0}' is ready : '{1}'".format(branch, worktree_path))
+    return worktree_path
+
+
+def set_sparse_paths(worktree_path, sparse_paths):
+    """
+    Check out only the given directories of the worktree, the files at the top of the repository are always
+    checked out (cone mode). Can be called again to change the paths.
+    """
+    for args in (["sparse-checkout", "init", "--cone"], ["sparse-checkout", "set"] + list(sparse_paths),
+                 ["checkout"]):
+        if not run_git(args, cwd=worktree_path):
+            logger.error("'git {0}' failed in '{1}'".format(" ".join(args[:2]), worktree_path))
+            return False
+    return True
+
+
+def is_finished(repository_path, worktree, fetch=False):
+    """
+    Check if the worktree can be removed without losing anything: its branch has commits since it was
+    created, all of them are in origin/<source branch>, and the worktree has no changes or untracked files.
+    Worktrees not created by add_worktree() are never finished, remove them with remove_worktree().
+    """
+    if worktree.is_main or worktree.locked or not worktree.branch or not os.path.isdir(worktree.path):
+        return False
+
+    base = _get_config(repository_path, BASE_CONFIG_KEY.format(worktree.branch))
+    source_branch = _get_config(repository_path, SOURCE_CONFIG_KEY.format(worktree.branch))
+    if not base or not source_branch or worktree.head == base:
+        return False
+
+    if fetch:
+        fetch_origin(directory_path=repository_path, max_age=0)
+    if not is_ancestor(worktree.head, "origin/{0}".format(source_branch), directory_path=repository_path):
+        return False
+
+    status = get_repository_status(directory_path=worktree.path, untracked=True)
+    return status is not None and not status.is_dirty and not status.untracked
+
+
+def remove_worktree(repository_path, worktree, force=False, delete_branch=True):
+    """
+    Remove the worktree directory, its workspace registry entry and, if asked, its branch
+
+    :param force:               `bool`          remove it with its local changes and delete an unmerged branch
+    :return:                    `bool`          True if the worktree is removed
+    """
+    from .registry import get_registry
+
+    if worktree.is_main:
+        logger.error("The main checkout is not a worktree : '{0}'".format(worktree.path))
+        return False
+
+    if not force:
+        status = get_repository_status(directory_path=worktree.path, untracked=True)
+        if status is not None and (status.is_dirty or status.untracked):
+            logger.error("'{0}' has local changes, commit them or use force.".format(worktree.path))
+            return False
+
+    # the .scmconf is untracked, git only removes a worktree with untracked files when forced
+    args = ["worktree", "remove", "--force", worktree.path]
+    if force and worktree.locked:
+        args.insert(3, "--force")
+    if not run_git(args, cwd=repository_path):
+        return False
+
+    if scm_constants.USE_REGISTRY:
+        get_registry().unregister(worktree.path)
+    worktrees_dir = os.path.dirname(worktree.path)
+    if worktrees_dir.endswith(scm_constants.WORKTREE_DIR_SUFFIX) and not os.listdir(worktrees_dir):
+        os.rmdir(worktrees_dir)
+
+    if delete_branch and worktree.branch:
+        if not run_git(["branch", "-D" if force else "-d", worktree.branch], cwd=repository_path):
+            logger.warning("Kept the '{0}' branch, it's not merged.".format(worktree.branch))
+
+    logger.info("Removed the worktree of '{0}' : '{1}'".format(worktree.branch, worktree.path))
+    return True
+
+
+def cleanup_worktrees(repository_path, dry_run=False, fetch=True):
+    """
+    Remove the finished worktrees of the repository with their branches, and forget the worktrees whose
+    directory was deleted by hand
+
+    :param repository_path:     `str`           the main checkout or any of its worktrees
+    :param dry_run:             `bool`          only report what would be removed
+    :param fetch:               `bool`          fetch origin first, so the merged branches are known
+    :return:                    `list`          removed (or with dry_run, finished) Worktree objects
+    """
+    main_path = get_main_path(repository_path)
+    if main_path is None:
+        return list()
+
+    if fetch:
+        fetch_origin(directory_path=main_path, max_age=0)
+
+    worktrees = list_worktrees(main_path)
+    if not dry_run and any(x.prunable for x in worktrees):
+        run_git(["worktree", "prune"], cwd=main_path)
+
+    finished = [x for x in worktrees if not x.prunable and is_finished(main_path, x)]
+    if dry_run:
+        for worktree in finished:
+            logger.info("Finished worktree : '{0}'".format(worktree.path))
+        return finished
+
+    return [x for x in finished if remove_worktree(main_path, x)]
+
+
+def format_worktrees(repository_path, worktrees):
+    """
+    Format the worktrees as a table with their state: main, finished, locked, prunable or active
+    """
+    rows = [("Branch", "State", "Path")]
+    for worktree in worktrees:
+        if worktree.is_main:
+            state = "main"
+        elif worktree.prunable:
+            state = "prunable"
+        elif worktree.locked:
+            state = "locked"
+        else:
+            state = "finished" if is_finished(repository_path, worktree) else "active"
+        rows.append((worktree.branch or "(detached)", state, worktree.path))
+
+    widths = [max(len(x[i]) for x in rows) for i in range(len(rows[0]) - 1)]
+    return "\n".join("  ".join(x.ljust(y) for x, y in zip(row, widths)) + "  " + row[-1] for row in rows)